@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+UnblockPay Batch Off-Ramp Payout Script
+Executes many off-ramp payouts from a CSV/JSONL file using offramp_payout.py helpers.
+
+Input rows need wallet_id, external_account_id and amount (an optional id column is
+used as the row key for resuming; otherwise rows are keyed by their content). Example:
+
+    python batch_offramp_payout.py payouts.csv --concurrency 4 --rate 2 --yes
+
+Every payout is recorded in the resume file as attempted before it is sent. A re-run skips
+completed rows and, instead of sending them again, lists rows that were attempted without a
+recorded success (the payout may exist even though the request failed or timed out). Check
+those in UnblockPay, then re-run with --retry-unconfirmed to send them again. Payouts UnblockPay
+rejected (HTTP 4xx, so none was created) are retried by a plain re-run.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from offramp_payout import PayoutRejected, create_offramp_quote, create_payout
+
+REPORT_COLUMNS = [
+    "key", "wallet_id", "external_account_id", "amount", "quote_id",
+    "payout_id", "status", "error", "latency_ms", "started_at"
+]
+
+
+class SharedQuote:
+    """One off-ramp quote shared by every payout until it is about to expire"""
+
+    def __init__(self, refresh_margin_seconds: float):
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._quote: Optional[Dict] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[Dict]:
+        with self._lock:
+            if self._quote and time.time() < self._expires_at - self.refresh_margin_seconds:
+                return self._quote
+
+            quote = create_offramp_quote(quiet=True)
+            if not quote or not quote.get("id"):
+                self._quote = None
+                return None
+
+            self._quote = quote
+            self._expires_at = parse_expires_at(quote.get("expires_at"))
+            return quote
+
+
+class RateLimiter:
+    """Spaces payout submissions so at most `rate` start per second across all threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Checkpoint:
+    """Append-only resume file recording every payout attempted, rejected and created"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Tuple[Set[str], Set[str]]:
+        """Keys of completed payouts, and keys attempted without a recorded success"""
+        completed, attempted = set(), set()
+        if not os.path.exists(self.path):
+            return completed, attempted
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash mid-write can leave a truncated last line
+                    continue
+                if entry.get("status") == "success":
+                    completed.add(entry["key"])
+                elif entry.get("status") == "attempting":
+                    attempted.add(entry["key"])
+                elif entry.get("status") == "rejected":
+                    # The attempt before this entry created no payout
+                    attempted.discard(entry["key"])
+        return completed, attempted - completed
+
+    def record_attempt(self, key: str):
+        self._append({"key": key, "status": "attempting", "attempted_at": datetime.now(timezone.utc).isoformat()})
+
+    def record_rejection(self, key: str, error: str):
+        self._append({"key": key, "status": "rejected", "error": error, "rejected_at": datetime.now(timezone.utc).isoformat()})
+
+    def record(self, key: str, payout_id: Optional[str]):
+        self._append({
+            "key": key,
+            "payout_id": payout_id,
+            "status": "success",
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        })
+
+    def _append(self, entry: Dict):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def parse_expires_at(expires_at) -> float:
+    """Quote expiry as a unix timestamp (the API returns epoch seconds)"""
+    if isinstance(expires_at, (int, float)):
+        return float(expires_at)
+    if isinstance(expires_at, str):
+        try:
+            return float(expires_at)
+        except ValueError:
+            return datetime.fromisoformat(expires_at.replace('Z', '+00:00')).timestamp()
+    return 0.0
+
+
+def load_rows(path: str) -> List[Dict]:
+    """Read payout rows from a CSV (with header) or JSONL file"""
+    rows = []
+    occurrences: Dict[str, int] = {}
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl") or path.endswith(".ndjson"):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = csv.DictReader(f)
+
+        for line_number, record in enumerate(records, start=1):
+            wallet_id = str(record.get("wallet_id") or "").strip()
+            external_account_id = str(record.get("external_account_id") or "").strip()
+            try:
+                amount = float(record.get("amount") or 0)
+            except (TypeError, ValueError):
+                raise ValueError(f"Row {line_number}: invalid amount {record.get('amount')!r}")
+
+            if not wallet_id or not external_account_id or amount <= 0:
+                raise ValueError(f"Row {line_number}: wallet_id, external_account_id and a positive amount are required")
+
+            # Without an id, key on content (numbering identical rows) so edits elsewhere in
+            # the file do not change which rows count as done
+            key = str(record.get("id") or "").strip()
+            if not key:
+                content = f"{wallet_id}:{external_account_id}:{amount}"
+                occurrences[content] = occurrences.get(content, 0) + 1
+                key = f"{content}#{occurrences[content]}"
+
+            rows.append({
+                "key": key,
+                "wallet_id": wallet_id,
+                "external_account_id": external_account_id,
+                "amount": amount
+            })
+    return rows
+
+
+def execute_row(row: Dict, shared_quote: SharedQuote, rate_limiter: RateLimiter, checkpoint: Checkpoint) -> Dict:
+    """Create one payout and return its report row"""
+    result = {column: row.get(column) for column in REPORT_COLUMNS}
+    result["started_at"] = datetime.now(timezone.utc).isoformat()
+
+    rate_limiter.wait()
+    started = time.perf_counter()
+    try:
+        quote = shared_quote.get()
+        if not quote:
+            result.update(status="failed", error="Failed to create quote")
+            return result
+
+        result["quote_id"] = quote.get("id")
+        checkpoint.record_attempt(row["key"])
+        try:
+            payout = create_payout(
+                quote["id"],
+                row["amount"],
+                wallet_id=row["wallet_id"],
+                external_account_id=row["external_account_id"],
+                quiet=True
+            )
+        except PayoutRejected as e:
+            # No payout exists, so the row is retried by a plain re-run
+            checkpoint.record_rejection(row["key"], str(e))
+            result.update(status="failed", error=str(e))
+            return result
+        result.update(status="success", payout_id=payout.get("id"))
+        checkpoint.record(row["key"], payout.get("id"))
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+    finally:
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Execute off-ramp payouts in batch from a CSV/JSONL file")
+    parser.add_argument("input", help="CSV (with header) or .jsonl file of wallet_id, external_account_id, amount")
+    parser.add_argument("--resume-file", help="Checkpoint file (default: <input>.resume.jsonl)")
+    parser.add_argument("--report", help="Results report CSV (default: <input>.report-<timestamp>.csv)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Payouts executed in parallel (default: 4)")
+    parser.add_argument("--rate", type=float, default=2.0, help="Max payouts started per second (default: 2, 0 = unlimited)")
+    parser.add_argument("--quote-margin", type=float, default=10.0,
+                        help="Refresh the shared quote this many seconds before it expires (default: 10)")
+    parser.add_argument("--retry-unconfirmed", action="store_true",
+                        help="Send rows attempted in an earlier run without a recorded success again")
+    parser.add_argument("--yes", action="store_true", help="Skip the confirmation prompt")
+    args = parser.parse_args()
+
+    resume_file = args.resume_file or f"{args.input}.resume.jsonl"
+    report_file = args.report or f"{args.input}.report-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+
+    print("🚀 UnblockPay Batch Off-Ramp Payout Script")
+    print("=" * 50)
+
+    try:
+        rows = load_rows(args.input)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read input file: {e}")
+        sys.exit(1)
+
+    checkpoint = Checkpoint(resume_file)
+    completed, attempted = checkpoint.load()
+    unconfirmed = [row for row in rows if row["key"] in attempted]
+    skipped = completed if args.retry_unconfirmed else completed | attempted
+    pending = [row for row in rows if row["key"] not in skipped]
+
+    print(f"Input rows: {len(rows)}")
+    print(f"Already completed (from {resume_file}): {sum(row['key'] in completed for row in rows)}")
+    if unconfirmed:
+        action = "retrying" if args.retry_unconfirmed else "skipped"
+        print(f"⚠️  Attempted without a recorded result ({action}): {len(unconfirmed)}")
+        for row in unconfirmed:
+            print(f"   {row['key']}: {row['amount']} USDC from {row['wallet_id']} to {row['external_account_id']}")
+    print(f"Pending payouts: {len(pending)} totalling ${sum(row['amount'] for row in pending):.2f} USDC")
+    print("=" * 50)
+
+    if unconfirmed and not args.retry_unconfirmed:
+        print("💡 Check these payouts in UnblockPay; re-run with --retry-unconfirmed to send the missing ones again.")
+
+    if not pending:
+        print("✅ Nothing to do.")
+        if unconfirmed and not args.retry_unconfirmed:
+            sys.exit(1)
+        return
+
+    if not args.yes:
+        user_input = input(f"Do you want to proceed with {len(pending)} payouts? (y/N): ").strip().lower()
+        if user_input not in ['y', 'yes']:
+            print("✋ Batch cancelled by user.")
+            return
+
+    shared_quote = SharedQuote(args.quote_margin)
+    rate_limiter = RateLimiter(args.rate)
+    results = []
+
+    with open(report_file, "w", newline="") as report:
+        writer = csv.DictWriter(report, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            futures = [executor.submit(execute_row, row, shared_quote, rate_limiter, checkpoint) for row in pending]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                writer.writerow(result)
+                report.flush()
+                icon = "✅" if result["status"] == "success" else "❌"
+                print(f"{icon} {result['key']}: {result['status']} ({result['latency_ms']} ms) {result.get('payout_id') or result.get('error') or ''}")
+
+    succeeded = [r for r in results if r["status"] == "success"]
+    latencies = sorted(r["latency_ms"] for r in results)
+    print("=" * 50)
+    print(f"🎉 Batch finished: {len(succeeded)} succeeded, {len(results) - len(succeeded)} failed")
+    if latencies:
+        print(f"   Latency p50: {latencies[len(latencies) // 2]} ms, max: {latencies[-1]} ms")
+    print(f"   Report: {report_file}")
+    print(f"   Resume file: {resume_file}")
+
+    if len(succeeded) < len(results):
+        print("💡 Re-run the same command to retry payouts that failed before being sent or were rejected; completed ones are skipped.")
+        print("   Payouts that failed after being sent are listed for checking instead (--retry-unconfirmed).")
+        sys.exit(1)
+    if unconfirmed and not args.retry_unconfirmed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
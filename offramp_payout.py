@@ -20,10 +20,25 @@ WALLET_ID = "0199d386-a3e2-77ce-8402-877744f4eb1b"
 EXTERNAL_ACCOUNT_ID = "0199e8da-edd4-76b5-95fe-04f2690e25bc"
 AMOUNT_USDC = 922.35
 
-def create_offramp_quote() -> Optional[Dict]:
-    """Create an off-ramp quote for USDC to USD"""
+class PayoutRejected(Exception):
+    """UnblockPay answered the payout request with a 4xx, so no payout was created"""
+
+    def __init__(self, status_code: int, response_text: str):
+        super().__init__(f"Payout rejected with HTTP {status_code}: {response_text}")
+        self.status_code = status_code
+
+def _silent(*args, **kwargs):
+    pass
+
+def create_offramp_quote(quiet: bool = False) -> Optional[Dict]:
+    """
+    Create an off-ramp quote for USDC to USD.
+    quiet: print nothing and raise errors instead of logging them (for callers that report
+    results themselves, like batch_offramp_payout.py running payouts on several threads)
+    """
+    log = _silent if quiet else print
     try:
-        print("🔄 Creating off-ramp quote...")
+        log("🔄 Creating off-ramp quote...")
         
         headers = {
             "Authorization": AUTH_TOKEN,
@@ -35,7 +50,7 @@ def create_offramp_quote() -> Optional[Dict]:
             "type": "off_ramp"
         }
         
-        print(f"📋 Quote request: {json.dumps(quote_data, indent=2)}")
+        log(f"📋 Quote request: {json.dumps(quote_data, indent=2)}")
         
         response = requests.post(
             f"{BASE_URL}/quote",
@@ -44,32 +59,47 @@ def create_offramp_quote() -> Optional[Dict]:
             timeout=30
         )
         
-        print(f"📊 Quote API response status: {response.status_code}")
-        print(f"📊 Quote API response: {response.text}")
+        log(f"📊 Quote API response status: {response.status_code}")
+        log(f"📊 Quote API response: {response.text}")
         
         response.raise_for_status()
         quote_result = response.json()
         
-        print(f"✅ Successfully created quote:")
-        print(f"   Quote ID: {quote_result.get('id')}")
-        print(f"   Rate: {quote_result.get('quotation')}")
-        print(f"   Expires at: {quote_result.get('expires_at')}")
+        log(f"✅ Successfully created quote:")
+        log(f"   Quote ID: {quote_result.get('id')}")
+        log(f"   Rate: {quote_result.get('quotation')}")
+        log(f"   Expires at: {quote_result.get('expires_at')}")
         
         return quote_result
         
     except requests.exceptions.HTTPError as e:
+        if quiet:
+            raise
         print(f"❌ HTTP Error creating quote: {e}")
         if hasattr(e, 'response') and e.response:
             print(f"   Response: {e.response.text}")
         return None
     except Exception as e:
+        if quiet:
+            raise
         print(f"❌ Error creating quote: {e}")
         return None
 
-def create_payout(quote_id: str, amount: float) -> Optional[Dict]:
-    """Create a payout using the quote"""
+def create_payout(
+    quote_id: str,
+    amount: float,
+    wallet_id: str = WALLET_ID,
+    external_account_id: str = EXTERNAL_ACCOUNT_ID,
+    quiet: bool = False
+) -> Optional[Dict]:
+    """
+    Create a payout using the quote.
+    quiet: print nothing and raise errors instead of returning None - PayoutRejected for a 4xx
+    (no payout exists), the original exception otherwise (the payout may have been created)
+    """
+    log = _silent if quiet else print
     try:
-        print(f"💰 Creating payout for ${amount} USDC...")
+        log(f"💰 Creating payout for ${amount} USDC...")
         
         headers = {
             "Authorization": AUTH_TOKEN,
@@ -82,14 +112,14 @@ def create_payout(quote_id: str, amount: float) -> Optional[Dict]:
             "sender": {
                 "currency": "USDC",
                 "payment_rail": "solana",
-                "wallet_id": WALLET_ID
+                "wallet_id": wallet_id
             },
             "receiver": {
-                "external_account_id": EXTERNAL_ACCOUNT_ID
+                "external_account_id": external_account_id
             }
         }
         
-        print(f"📋 Payout request: {json.dumps(payout_data, indent=2)}")
+        log(f"📋 Payout request: {json.dumps(payout_data, indent=2)}")
         
         response = requests.post(
             f"{BASE_URL}/payout",
@@ -98,25 +128,32 @@ def create_payout(quote_id: str, amount: float) -> Optional[Dict]:
             timeout=30
         )
         
-        print(f"💸 Payout API response status: {response.status_code}")
-        print(f"💸 Payout API response: {response.text}")
+        log(f"💸 Payout API response status: {response.status_code}")
+        log(f"💸 Payout API response: {response.text}")
         
         response.raise_for_status()
         payout_result = response.json()
         
-        print(f"🎉 Successfully created payout:")
-        print(f"   Payout ID: {payout_result.get('id')}")
-        print(f"   Status: {payout_result.get('status')}")
-        print(f"   Amount: ${payout_result.get('amount')} {payout_result.get('currency', 'USD')}")
+        log(f"🎉 Successfully created payout:")
+        log(f"   Payout ID: {payout_result.get('id')}")
+        log(f"   Status: {payout_result.get('status')}")
+        log(f"   Amount: ${payout_result.get('amount')} {payout_result.get('currency', 'USD')}")
         
         return payout_result
         
     except requests.exceptions.HTTPError as e:
+        if quiet:
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code is not None and 400 <= status_code < 500:
+                raise PayoutRejected(status_code, e.response.text)
+            raise
         print(f"❌ HTTP Error creating payout: {e}")
         if hasattr(e, 'response') and e.response:
             print(f"   Response: {e.response.text}")
         return None
     except Exception as e:
+        if quiet:
+            raise
         print(f"❌ Error creating payout: {e}")
         return None
 
@@ -402,6 +402,8 @@ const GetStarted = () => {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          // One payin per quote: double-clicks and retries reuse the key and get the original response
+          'Idempotency-Key': `spei-${quote.on_ramp.id}`,
         },
         body: JSON.stringify({
           amount_mxn: quote.total_local_amount,
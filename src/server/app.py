@@ -1,18 +1,49 @@
-from flask import Flask, request, jsonify
+import time
+_import_started = time.perf_counter()
+
+from flask import Blueprint, Flask, current_app, has_app_context, request, jsonify, Response, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import requests
 import json
 import os
+import sys
+import csv
+import gc
+import gzip
+import io
+import hashlib
+import hmac
+import threading
+import tracemalloc
 import uuid
-from typing import Dict, Union, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Union, Optional
+from urllib.parse import urlsplit
+import random
+import re
+import sqlite3
+from collections import OrderedDict
 from datetime import datetime
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = Flask(__name__)
+# Routes and request hooks live on this blueprint; create_app() builds the Flask app around it
+api = Blueprint("api", __name__)
 
 # Get environment variables
 ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', 'http://localhost:8080,http://127.0.0.1:8080,http://localhost:8081,http://localhost:8082,http://127.0.0.1:8081,http://127.0.0.1:8082').split(',')
@@ -27,39 +58,1252 @@ FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 # Supabase configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL', 'https://udzmxstrkhesiantlods.supabase.co')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY')  # Need service key for server-side operations
+SUPABASE_TIMEOUT_SECONDS = float(os.getenv('SUPABASE_TIMEOUT_SECONDS', 10))
 
-# Initialize Supabase client (only if service key is available)
-supabase: Client = None
-if SUPABASE_SERVICE_KEY:
-    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-else:
-    print("WARNING: SUPABASE_SERVICE_KEY not set - webhook events will not be saved to database")
+# Admin API configuration (admin endpoints are disabled when no token is set)
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN')
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', 1000))
+
+# Off-ramp quote pool configuration
+OFFRAMP_QUOTE_POOL_ENABLED = os.getenv('OFFRAMP_QUOTE_POOL_ENABLED', 'True').lower() == 'true'
+OFFRAMP_QUOTE_REFRESH_MARGIN_SECONDS = float(os.getenv('OFFRAMP_QUOTE_REFRESH_MARGIN_SECONDS', 15))
+OFFRAMP_QUOTE_IDLE_SECONDS = float(os.getenv('OFFRAMP_QUOTE_IDLE_SECONDS', 300))
+
+# Supabase client is created on first use (importing supabase costs ~0.4 s of cold start)
+_supabase = None
+_supabase_initialized = False
+_supabase_lock = threading.Lock()
+
+def get_supabase():
+    """Return the Supabase client, or None when SUPABASE_SERVICE_KEY is not set"""
+    global _supabase, _supabase_initialized
+    if _supabase_initialized:
+        return _supabase
+    with _supabase_lock:
+        if _supabase_initialized:
+            return _supabase
+        if SUPABASE_SERVICE_KEY:
+            from supabase import create_client, ClientOptions
+            _supabase = create_client(
+                SUPABASE_URL,
+                SUPABASE_SERVICE_KEY,
+                options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT_SECONDS)
+            )
+        else:
+            print("WARNING: SUPABASE_SERVICE_KEY not set - webhook events will not be saved to database")
+        _supabase_initialized = True
+        return _supabase
+
+# Direct Postgres (optional): hot webhook/transaction queries use a psycopg pool instead of
+# PostgREST when DATABASE_URL is set and psycopg is installed; otherwise supabase-py is used
+DATABASE_URL = os.getenv('DATABASE_URL')
+DATABASE_POOL_MIN_SIZE = int(os.getenv('DATABASE_POOL_MIN_SIZE', 1))
+DATABASE_POOL_MAX_SIZE = int(os.getenv('DATABASE_POOL_MAX_SIZE', 10))
+DATABASE_POOL_TIMEOUT_SECONDS = float(os.getenv('DATABASE_POOL_TIMEOUT_SECONDS', 5))
+# Disable behind a transaction-mode pooler (Supabase port 6543), which can't keep prepared statements
+DATABASE_PREPARED_STATEMENTS = os.getenv('DATABASE_PREPARED_STATEMENTS', 'True').lower() == 'true'
+
+_db_pool = None
+_db_pool_initialized = False
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Return the Postgres connection pool, or None when DATABASE_URL or psycopg is missing"""
+    global _db_pool, _db_pool_initialized
+    if _db_pool_initialized:
+        return _db_pool
+    with _db_pool_lock:
+        if _db_pool_initialized:
+            return _db_pool
+        if DATABASE_URL:
+            try:
+                from psycopg.rows import dict_row
+                from psycopg_pool import ConnectionPool
+            except ImportError:
+                print("WARNING: DATABASE_URL is set but psycopg is not installed - using the Supabase client")
+            else:
+                _db_pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=DATABASE_POOL_MIN_SIZE,
+                    max_size=DATABASE_POOL_MAX_SIZE,
+                    timeout=DATABASE_POOL_TIMEOUT_SECONDS,
+                    kwargs={
+                        "autocommit": True,
+                        "row_factory": dict_row,
+                        "prepare_threshold": 0 if DATABASE_PREPARED_STATEMENTS else None,
+                    },
+                    name="crebit",
+                    open=False,
+                )
+                _db_pool.open(wait=False)
+        _db_pool_initialized = True
+        return _db_pool
+
+# Serving: "production" makes `python app.py` exec gunicorn with gunicorn.conf.py (same as --production)
+SERVER_MODE = os.getenv('SERVER_MODE', 'development').lower()
+PREWARM_CONNECTIONS = os.getenv('PREWARM_CONNECTIONS', 'True').lower() == 'true'
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', 20))
+# Set by gunicorn.conf.py when running several workers so /metrics aggregates all of them
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+METRICS_REFRESH_SECONDS = float(os.getenv('METRICS_REFRESH_SECONDS', 10))
+
+# Warn when importing this module (the cold-start path) exceeds this budget
+IMPORT_TIME_BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', 500))
+
+# UnblockPay resilience configuration (retries apply to idempotent calls only)
+UNBLOCKPAY_MAX_RETRIES = int(os.getenv('UNBLOCKPAY_MAX_RETRIES', 2))
+UNBLOCKPAY_RETRY_BASE_DELAY_SECONDS = float(os.getenv('UNBLOCKPAY_RETRY_BASE_DELAY_SECONDS', 0.25))
+UNBLOCKPAY_RETRY_MAX_DELAY_SECONDS = float(os.getenv('UNBLOCKPAY_RETRY_MAX_DELAY_SECONDS', 4))
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv('CIRCUIT_BREAKER_RESET_SECONDS', 30))
+
+# Deadline budgets: every upstream call made while handling a request gets the remaining budget as its timeout
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', 25))
+WEBHOOK_DEADLINE_SECONDS = float(os.getenv('WEBHOOK_DEADLINE_SECONDS', 45))
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv('UPSTREAM_TIMEOUT_SECONDS', 30))
+SLACK_TIMEOUT_SECONDS = float(os.getenv('SLACK_TIMEOUT_SECONDS', 10))
+
+# Write-behind batching of webhook_events inserts: events are spilled to a local file, then
+# inserted together every WEBHOOK_EVENT_BATCH_SIZE events or WEBHOOK_EVENT_FLUSH_MS milliseconds
+WEBHOOK_EVENT_BATCHING = os.getenv('WEBHOOK_EVENT_BATCHING', 'False').lower() == 'true'
+WEBHOOK_EVENT_BATCH_SIZE = int(os.getenv('WEBHOOK_EVENT_BATCH_SIZE', 50))
+WEBHOOK_EVENT_FLUSH_MS = float(os.getenv('WEBHOOK_EVENT_FLUSH_MS', 200))
+WEBHOOK_EVENT_SPILL_DIR = os.getenv('WEBHOOK_EVENT_SPILL_DIR', 'webhook_spill')
+WEBHOOK_EVENT_RETRY_MAX_SECONDS = float(os.getenv('WEBHOOK_EVENT_RETRY_MAX_SECONDS', 30))
+
+# Dashboard summary via the user_transaction_summary database function (user-transaction-summary-function.sql);
+# falls back to grouping in Python when it is disabled or missing
+TRANSACTION_SUMMARY_RPC = os.getenv('TRANSACTION_SUMMARY_RPC', 'True').lower() == 'true'
+
+# Content-addressed payloads: store each event resource once in webhook_payloads and reference it by
+# hash from webhook_events and transactions (requires webhook-payloads-migration.sql)
+WEBHOOK_PAYLOAD_DEDUP = os.getenv('WEBHOOK_PAYLOAD_DEDUP', 'False').lower() == 'true'
+WEBHOOK_PAYLOAD_HASH_CACHE_ENTRIES = int(os.getenv('WEBHOOK_PAYLOAD_HASH_CACHE_ENTRIES', 4096))
+# Must stay below the min_age of prune_webhook_payloads (7 days), or a cached hash can outlive its row
+WEBHOOK_PAYLOAD_HASH_CACHE_TTL_SECONDS = float(os.getenv('WEBHOOK_PAYLOAD_HASH_CACHE_TTL_SECONDS', 86400))
+
+# OpenTelemetry tracing: "otlp" (OTEL_EXPORTER_OTLP_ENDPOINT), "json" (OTEL_TRACES_JSON_FILE) or "none"
+OTEL_TRACES_EXPORTER = os.getenv('OTEL_TRACES_EXPORTER', 'none').lower()
+OTEL_TRACES_JSON_FILE = os.getenv('OTEL_TRACES_JSON_FILE', 'traces.jsonl')
+OTEL_SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'tuition-bridge-backend')
+
+# Sampling profiler: profiles a PROFILER_SAMPLE_RATE fraction of requests when enabled; admins can
+# force one with "X-Profile: 1". Either way at most PROFILER_MAX_PER_MINUTE profiles run per process
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'False').lower() == 'true'
+PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', 0.01))
+PROFILER_ROUTES = {route.strip() for route in os.getenv('PROFILER_ROUTES', '').split(',') if route.strip()}
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 5))
+PROFILER_MAX_PER_MINUTE = float(os.getenv('PROFILER_MAX_PER_MINUTE', 6))
+PROFILER_OUTPUT_DIR = os.getenv('PROFILER_OUTPUT_DIR', 'profiles')
+
+# Memory instrumentation: trace allocations from startup (otherwise start them from /api/admin/memory/snapshot)
+TRACEMALLOC_ENABLED = os.getenv('TRACEMALLOC_ENABLED', 'False').lower() == 'true'
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', 5))
+if TRACEMALLOC_ENABLED:
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+# Idempotency-Key support for payin creation: successful responses are replayed for repeats
+IDEMPOTENCY_ENABLED = os.getenv('IDEMPOTENCY_ENABLED', 'True').lower() == 'true'
+# SQLite file shared by every worker on the host, so keys survive restarts and span processes
+IDEMPOTENCY_DB_PATH = os.getenv('IDEMPOTENCY_DB_PATH', 'idempotency.sqlite3')
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', 86400))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 1000))
+# How long a duplicate waits for the original request to finish before getting a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 30))
+# A pending key older than this belongs to a worker that died mid-request and can be claimed again
+IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = float(os.getenv('IDEMPOTENCY_PENDING_TIMEOUT_SECONDS', 120))
+
+# Response compression (gzip, or brotli when installed) for bodies of at least COMPRESSION_MIN_BYTES
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True').lower() == 'true'
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))
+# Compressed bodies kept for identical responses (e.g. polled transaction lists)
+COMPRESSION_CACHE_ENTRIES = int(os.getenv('COMPRESSION_CACHE_ENTRIES', 256))
+# Leave the full_response/transaction echoes out of create-customer and payin responses for every
+# client (clients can also ask per request with "Prefer: return=minimal" or ?minimal=true)
+OMIT_RESPONSE_ECHOES = os.getenv('OMIT_RESPONSE_ECHOES', 'False').lower() == 'true'
+
+# Wallet provisioning: with async mode (or "Prefer: respond-async") /api/create-customer responds once
+# the customer exists and creates the wallet in the background
+ASYNC_WALLET_PROVISIONING = os.getenv('ASYNC_WALLET_PROVISIONING', 'False').lower() == 'true'
+WALLET_PROVISIONING_MAX_WORKERS = int(os.getenv('WALLET_PROVISIONING_MAX_WORKERS', 4))
+# SQLite file shared by every worker on the host holding each customer's provisioning status
+WALLET_PROVISIONING_DB_PATH = os.getenv('WALLET_PROVISIONING_DB_PATH', 'wallet_provisioning.sqlite3')
+WALLET_PROVISIONING_STATUS_TTL_SECONDS = float(os.getenv('WALLET_PROVISIONING_STATUS_TTL_SECONDS', 3600))
+# A pending status older than this belongs to a worker that died mid-provisioning and is retried
+WALLET_PROVISIONING_PENDING_TIMEOUT_SECONDS = float(os.getenv('WALLET_PROVISIONING_PENDING_TIMEOUT_SECONDS', 120))
+# How long a payin without a wallet waits for provisioning, and how long an event stream stays open
+WALLET_PROVISIONING_WAIT_SECONDS = float(os.getenv('WALLET_PROVISIONING_WAIT_SECONDS', 15))
+WALLET_PROVISIONING_STREAM_SECONDS = float(os.getenv('WALLET_PROVISIONING_STREAM_SECONDS', 60))
+
+# Bulk onboarding (/api/admin/bulk-onboarding): rows processed in parallel and the largest batch accepted
+BULK_ONBOARDING_MAX_WORKERS = int(os.getenv('BULK_ONBOARDING_MAX_WORKERS', 4))
+BULK_ONBOARDING_MAX_ROWS = int(os.getenv('BULK_ONBOARDING_MAX_ROWS', 1000))
+
+# Outbound rate limits per endpoint class as "class=rate_per_second:burst,..." (empty = unlimited)
+UNBLOCKPAY_RATE_LIMITS = os.getenv('UNBLOCKPAY_RATE_LIMITS', '')
+UNBLOCKPAY_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv('UNBLOCKPAY_RATE_LIMIT_MAX_WAIT_SECONDS', 10))
+# Directory for bucket state shared across worker processes (unset = per-process buckets)
+UNBLOCKPAY_RATE_LIMIT_STATE_DIR = os.getenv('UNBLOCKPAY_RATE_LIMIT_STATE_DIR')
 
 # Pre-configured external account ID for check delivery
 CHECK_DELIVERY_EXTERNAL_ACCOUNT_ID = "11111111111"
 
+# Treasury wallet that funds the per-payin payout bonus
+TREASURY_CUSTOMER_ID = "0199d13b-6e91-71cb-afba-30113108e359"
+TREASURY_WALLET_ID = "0199d386-a3e2-77ce-8402-877744f4eb1b"
+BONUS_AMOUNT_USDC = 10
+
+# Payout netting: aggregate payins to the same wallet/external account over this window (0 disables)
+PAYOUT_NETTING_WINDOW_SECONDS = float(os.getenv('PAYOUT_NETTING_WINDOW_SECONDS', 0))
+# SQLite file shared by every worker on the host holding the payins of open netting buckets
+PAYOUT_NETTING_DB_PATH = os.getenv('PAYOUT_NETTING_DB_PATH', 'netting.sqlite3')
+
+# Bonus transfers run in a background stage instead of blocking the payout
+ASYNC_BONUS_TRANSFERS_ENABLED = os.getenv('ASYNC_BONUS_TRANSFERS_ENABLED', 'True').lower() == 'true'
+BONUS_TRANSFER_BATCH_INTERVAL_SECONDS = float(os.getenv('BONUS_TRANSFER_BATCH_INTERVAL_SECONDS', 0.5))
+BONUS_TRANSFER_MAX_WORKERS = int(os.getenv('BONUS_TRANSFER_MAX_WORKERS', 4))
+# How long a payout waits for its bonus transfer before paying out without it
+BONUS_TRANSFER_WAIT_SECONDS = float(os.getenv('BONUS_TRANSFER_WAIT_SECONDS', 15))
+
 # Validate required environment variables
 if not AUTH_TOKEN:
     raise ValueError("UNBLOCKPAY_AUTH_TOKEN environment variable is required")
 
-# Configure CORS with environment-based origins
-CORS(app, 
-     origins=ALLOWED_ORIGINS,
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-     allow_headers=["Content-Type", "Authorization"],
-     expose_headers=["Content-Type"],
-     supports_credentials=True,
-     allow_credentials=True)
-
 # Session configuration removed - using localStorage on frontend instead
 
+# Prometheus metrics (served at /metrics)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Flask request latency", ["route", "method", "status"]
+)
+UNBLOCKPAY_REQUEST_DURATION = Histogram(
+    "unblockpay_request_duration_seconds", "UnblockPay API call latency per attempt", ["endpoint", "method"]
+)
+UNBLOCKPAY_RESPONSES = Counter(
+    "unblockpay_responses_total", "UnblockPay API call outcomes (HTTP status or exception name)", ["endpoint", "method", "status"]
+)
+UNBLOCKPAY_RETRIES = Counter("unblockpay_retries_total", "UnblockPay call retries", ["endpoint"])
+CIRCUIT_BREAKER_TRIPS = Counter("unblockpay_circuit_breaker_trips_total", "Circuit breaker open transitions", ["endpoint"])
+CIRCUIT_BREAKER_REJECTIONS = Counter(
+    "unblockpay_circuit_breaker_rejections_total", "Calls failed fast by an open circuit breaker", ["endpoint"]
+)
+RATE_LIMIT_THROTTLED = Counter(
+    "unblockpay_rate_limit_throttled_total", "Calls that waited for an outbound rate-limit token", ["limit_class", "priority"]
+)
+SUPABASE_QUERY_DURATION = Histogram(
+    "supabase_query_duration_seconds", "Supabase query latency", ["table", "operation"]
+)
+WEBHOOK_PROCESSING_DURATION = Histogram(
+    "webhook_processing_duration_seconds", "UnblockPay webhook handling time", ["event_type"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 45)
+)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by result", ["cache", "result"])
+WEBHOOK_TRACKER_ENTRIES = Gauge(
+    "webhook_status_tracker_entries", "Transactions held in webhook_status_tracker", multiprocess_mode="livesum"
+)
+PAYOUT_NETTING_OPEN_BUCKETS = Gauge(
+    "payout_netting_open_buckets", "Netting buckets waiting for their window to close", multiprocess_mode="livesum"
+)
+BONUS_TRANSFERS_PENDING = Gauge("bonus_transfers_pending", "Bonus transfers queued or in flight", multiprocess_mode="livesum")
+CACHED_OBJECTS = Gauge("cached_objects", "Entries held in in-process caches and trackers", ["cache"], multiprocess_mode="livesum")
+TRACEMALLOC_TRACED_BYTES = Gauge(
+    "tracemalloc_traced_bytes", "Memory currently traced by tracemalloc (0 when not tracing)", multiprocess_mode="livesum"
+)
+REQUEST_PROFILES = Counter("request_profiles_total", "Request profiles written by the sampling profiler", ["route", "trigger"])
+WEBHOOK_EVENT_FLUSHES = Counter("webhook_event_flushes_total", "Batched webhook_events inserts by result", ["result"])
+BULK_ONBOARDING_ROWS = Counter("bulk_onboarding_rows_total", "Bulk onboarding rows by outcome", ["status"])
+
+# Gauges whose value is computed from in-process state. Under multi-worker gunicorn
+# (PROMETHEUS_MULTIPROC_DIR set) set_function values are invisible to the aggregated
+# registry, so they are written periodically instead
+_live_gauges = []
+
+def live_gauge(gauge, value_function):
+    if PROMETHEUS_MULTIPROC_DIR:
+        _live_gauges.append((gauge, value_function))
+    else:
+        gauge.set_function(value_function)
+
+def refresh_live_gauges():
+    for gauge, value_function in _live_gauges:
+        try:
+            gauge.set(value_function())
+        except Exception as e:
+            print(f"WARNING: Could not refresh gauge: {e}")
+
+def start_live_gauge_refresher():
+    """Keep this worker's live gauges current in the multiprocess registry"""
+    if not _live_gauges:
+        return
+    def refresh_forever():
+        while True:
+            refresh_live_gauges()
+            time.sleep(METRICS_REFRESH_SECONDS)
+    threading.Thread(target=refresh_forever, name="live-gauge-refresher", daemon=True).start()
+
+def run_query(query, table: str, operation: str):
+    """Execute a Supabase query, recording its latency"""
+    started = time.perf_counter()
+    try:
+        with trace_span(f"supabase {operation} {table}", {"db.system": "postgresql", "db.sql.table": table, "db.operation": operation}):
+            return query.execute()
+    finally:
+        SUPABASE_QUERY_DURATION.labels(table, operation).observe(time.perf_counter() - started)
+
+def _jsonb_dumps(obj):
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+def _db_value(value):
+    """psycopg parameter for a column value (dicts and lists go to JSONB columns)"""
+    if isinstance(value, (dict, list)):
+        from psycopg.types.json import Jsonb
+        return Jsonb(value, dumps=_jsonb_dumps)
+    return value
+
+def _db_row(row: Dict) -> Dict:
+    """Render a psycopg row the way PostgREST returns it (ISO timestamps, numbers, string ids)"""
+    from decimal import Decimal
+    rendered = {}
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = float(value)
+        elif isinstance(value, uuid.UUID):
+            value = str(value)
+        rendered[key] = value
+    return rendered
+
+def run_sql(sql: str, params, table: str, operation: str) -> List[Dict]:
+    """Execute a statement on a pooled Postgres connection and return its rows, recording latency"""
+    started = time.perf_counter()
+    try:
+        with trace_span(f"postgres {operation} {table}", {"db.system": "postgresql", "db.sql.table": table, "db.operation": operation}):
+            with get_db_pool().connection() as conn:
+                cursor = conn.execute(sql, params)
+                return [_db_row(row) for row in cursor.fetchall()] if cursor.description else []
+    finally:
+        SUPABASE_QUERY_DURATION.labels(table, operation).observe(time.perf_counter() - started)
+
+def db_error_code(e: Exception) -> Optional[str]:
+    """SQLSTATE of a psycopg error, or the code of a PostgREST error (a SQLSTATE or PGRSTxxx)"""
+    code = getattr(e, "sqlstate", None) or getattr(e, "code", None)
+    return code if isinstance(code, str) else None
+
+# SQLSTATE classes that reject the rows themselves (data exceptions, constraint violations);
+# retrying the same rows cannot succeed
+PERMANENT_DB_ERROR_CLASSES = ("22", "23")
+
+def is_permanent_db_error(e: Exception) -> bool:
+    if isinstance(e, (ValueError, TypeError)):
+        return True
+    code = db_error_code(e)
+    return bool(code) and code[:2] in PERMANENT_DB_ERROR_CLASSES
+
+def payload_hash(payload) -> str:
+    """SHA-256 of the payload's canonical JSON (sorted keys, no whitespace)"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+# Columns holding a webhook_payloads hash, and the payload column each one stands in for
+PAYLOAD_REFERENCES = {
+    "webhook_events": ("resource_hash", "event_resource"),
+    "transactions": ("metadata_hash", "metadata"),
+}
+
+class TransactionStore:
+    """
+    Data access for the hot webhook and transaction-history paths. Uses the direct Postgres
+    pool when configured (falling back to PostgREST when no connection frees up in time)
+    and the Supabase client otherwise. Rows come back in the same shape from either.
+    """
+
+    def __init__(self, hash_cache_entries: int = 4096, hash_cache_ttl_seconds: float = 86400):
+        # Hashes known to be in webhook_payloads, so repeated payloads skip the upsert. Each
+        # upsert refreshes the row's created_at, which prune_webhook_payloads only deletes once
+        # it is older than its min_age, so entries must expire well before that
+        self.hash_cache_entries = hash_cache_entries
+        self.hash_cache_ttl_seconds = hash_cache_ttl_seconds
+        self._stored_hashes = OrderedDict()
+        self._stored_hashes_lock = threading.Lock()
+
+    def _use_postgres(self) -> bool:
+        return get_db_pool() is not None
+
+    def _fallback(self, e: Exception, what: str):
+        from psycopg_pool import PoolTimeout
+        if not isinstance(e, PoolTimeout) or not get_supabase():
+            raise e
+        print(f"WARNING: Postgres pool exhausted ({what}) - using the Supabase client")
+
+    def find_user_id_by_customer(self, customer_id: str) -> Optional[str]:
+        if self._use_postgres():
+            try:
+                rows = run_sql("SELECT id FROM public.user_profiles WHERE unblockpay_customer_id = %s LIMIT 1",
+                               (customer_id,), "user_profiles", "select")
+                return rows[0]["id"] if rows else None
+            except Exception as e:
+                self._fallback(e, "user_profiles select")
+        result = run_query(get_supabase().table("user_profiles").select("id").eq("unblockpay_customer_id", customer_id), "user_profiles", "select")
+        return result.data[0]["id"] if result.data else None
+
+    def find_customer_id_for_user(self, user_id: str) -> Optional[Dict]:
+        """The user's profile row ({"unblockpay_customer_id": ...}), or None when there is none"""
+        if self._use_postgres():
+            try:
+                rows = run_sql("SELECT unblockpay_customer_id FROM public.user_profiles WHERE id = %s",
+                               (user_id,), "user_profiles", "select")
+                return rows[0] if rows else None
+            except Exception as e:
+                self._fallback(e, "user_profiles select")
+        result = run_query(get_supabase().table("user_profiles").select("unblockpay_customer_id").eq("id", user_id), "user_profiles", "select")
+        return result.data[0] if result.data else None
+
+    def find_user_ids_by_customer(self, customer_id: str) -> List[str]:
+        """Every user profile linked to an UnblockPay customer"""
+        if self._use_postgres():
+            try:
+                rows = run_sql("SELECT id FROM public.user_profiles WHERE unblockpay_customer_id = %s",
+                               (customer_id,), "user_profiles", "select")
+                return [row["id"] for row in rows]
+            except Exception as e:
+                self._fallback(e, "user_profiles select")
+        result = run_query(get_supabase().table("user_profiles").select("id").eq("unblockpay_customer_id", customer_id), "user_profiles", "select")
+        return [row["id"] for row in (result.data or [])]
+
+    def insert_webhook_event(self, webhook_data: Dict) -> Optional[Dict]:
+        if self._use_postgres():
+            columns = list(webhook_data)
+            sql = (f"INSERT INTO public.webhook_events ({', '.join(columns)}) "
+                   f"VALUES ({', '.join(['%s'] * len(columns))}) RETURNING *")
+            try:
+                rows = run_sql(sql, [_db_value(webhook_data[column]) for column in columns], "webhook_events", "insert")
+                return rows[0] if rows else None
+            except Exception as e:
+                self._fallback(e, "webhook_events insert")
+        result = run_query(get_supabase().table("webhook_events").insert(webhook_data), "webhook_events", "insert")
+        return result.data[0] if result.data else None
+
+    def insert_webhook_events(self, rows: List[Dict]):
+        """Insert many webhook events with one multi-row INSERT"""
+        if self._use_postgres():
+            columns = list(dict.fromkeys(column for row in rows for column in row))
+            placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+            sql = (f"INSERT INTO public.webhook_events ({', '.join(columns)}) "
+                   f"VALUES {', '.join([placeholders] * len(rows))}")
+            try:
+                run_sql(sql, [_db_value(row.get(column)) for row in rows for column in columns], "webhook_events", "insert")
+                return
+            except Exception as e:
+                self._fallback(e, "webhook_events insert")
+        run_query(get_supabase().table("webhook_events").insert(rows), "webhook_events", "insert")
+
+    def upsert_transaction(self, transaction_data: Dict) -> str:
+        """Update the transaction with this unblockpay_transaction_id, or create it; returns "updated"/"created" """
+        transaction_id = transaction_data["unblockpay_transaction_id"]
+        if self._use_postgres():
+            columns = [column for column in transaction_data if column != "unblockpay_transaction_id"]
+            params = [_db_value(transaction_data[column]) for column in columns]
+            try:
+                # One round trip: update existing rows, insert only when none matched
+                rows = run_sql(
+                    f"WITH updated AS (UPDATE public.transactions SET {', '.join(f'{column} = %s' for column in columns)} "
+                    f"WHERE unblockpay_transaction_id = %s RETURNING id), "
+                    f"inserted AS (INSERT INTO public.transactions (unblockpay_transaction_id, {', '.join(columns)}) "
+                    f"SELECT %s, {', '.join(['%s'] * len(columns))} WHERE NOT EXISTS (SELECT 1 FROM updated) RETURNING id) "
+                    f"SELECT (SELECT count(*) FROM updated) AS updated_count",
+                    params + [transaction_id, transaction_id] + params, "transactions", "upsert"
+                )
+                return "updated" if rows and rows[0]["updated_count"] else "created"
+            except Exception as e:
+                self._fallback(e, "transactions upsert")
+        supabase = get_supabase()
+        existing = run_query(supabase.table("transactions").select("id").eq("unblockpay_transaction_id", transaction_id), "transactions", "select")
+        if existing.data:
+            run_query(supabase.table("transactions").update(transaction_data).eq("unblockpay_transaction_id", transaction_id), "transactions", "update")
+            return "updated"
+        run_query(supabase.table("transactions").insert(transaction_data), "transactions", "insert")
+        return "created"
+
+    def store_payload(self, payload) -> str:
+        """Store a payload in webhook_payloads (once per distinct content) and return its hash"""
+        digest = payload_hash(payload)
+        with self._stored_hashes_lock:
+            stored_at = self._stored_hashes.get(digest)
+            if stored_at is not None and time.monotonic() - stored_at < self.hash_cache_ttl_seconds:
+                self._stored_hashes.move_to_end(digest)
+                CACHE_REQUESTS.labels("webhook_payloads", "hit").inc()
+                return digest
+        CACHE_REQUESTS.labels("webhook_payloads", "miss").inc()
+
+        stored_at = time.monotonic()
+        stored = False
+        if self._use_postgres():
+            try:
+                run_sql("INSERT INTO public.webhook_payloads (hash, payload) VALUES (%s, %s) "
+                        "ON CONFLICT (hash) DO UPDATE SET created_at = EXCLUDED.created_at",
+                        (digest, _db_value(payload)), "webhook_payloads", "upsert")
+                stored = True
+            except Exception as e:
+                self._fallback(e, "webhook_payloads upsert")
+        if not stored:
+            row = {"hash": digest, "payload": payload, "created_at": datetime.now().astimezone().isoformat()}
+            run_query(get_supabase().table("webhook_payloads").upsert(row, on_conflict="hash"),
+                      "webhook_payloads", "upsert")
+
+        with self._stored_hashes_lock:
+            self._stored_hashes[digest] = stored_at
+            self._stored_hashes.move_to_end(digest)
+            while len(self._stored_hashes) > self.hash_cache_entries:
+                self._stored_hashes.popitem(last=False)
+        return digest
+
+    def fetch_payloads(self, hashes: List[str]) -> Dict[str, object]:
+        """Payloads for the given hashes, fetched in one query"""
+        if not hashes:
+            return {}
+        if self._use_postgres():
+            try:
+                rows = run_sql("SELECT hash, payload FROM public.webhook_payloads WHERE hash = ANY(%s)",
+                               (list(hashes),), "webhook_payloads", "select")
+                return {row["hash"]: row["payload"] for row in rows}
+            except Exception as e:
+                self._fallback(e, "webhook_payloads select")
+        result = run_query(get_supabase().table("webhook_payloads").select("hash,payload").in_("hash", list(hashes)), "webhook_payloads", "select")
+        return {row["hash"]: row["payload"] for row in (result.data or [])}
+
+    def transaction_summary(self, user_id: str) -> Dict:
+        """Dashboard totals computed by the public.user_transaction_summary database function"""
+        if self._use_postgres():
+            try:
+                rows = run_sql("SELECT * FROM public.user_transaction_summary(%s)", (user_id,), "user_transaction_summary", "rpc")
+                return rows[0]
+            except Exception as e:
+                self._fallback(e, "user_transaction_summary rpc")
+        result = run_query(get_supabase().rpc("user_transaction_summary", {"p_user_id": user_id}), "user_transaction_summary", "rpc")
+        return result.data[0]
+
+    def list_webhook_events(self, customer_id: str) -> List[Dict]:
+        """All webhook events for a customer, newest first"""
+        if self._use_postgres():
+            try:
+                return run_sql("SELECT * FROM public.webhook_events WHERE customer_id = %s ORDER BY created_at DESC",
+                               (customer_id,), "webhook_events", "select")
+            except Exception as e:
+                self._fallback(e, "webhook_events select")
+        result = run_query(get_supabase().table("webhook_events").select("*").eq("customer_id", customer_id).order("created_at", desc=True), "webhook_events", "select")
+        return result.data or []
+
+    def export_page(self, table: str, since: Optional[str], until: Optional[str], customer_id: Optional[str],
+                    user_ids: Optional[List[str]], cursor: Optional[tuple], limit: int) -> List[Dict]:
+        """
+        One page of an export table in (created_at, id) order, starting after cursor
+        ((created_at, id) of the previous page's last row). table must be an EXPORT_COLUMNS key.
+        """
+        if self._use_postgres():
+            conditions, params = [], []
+            if since:
+                conditions.append("created_at >= %s")
+                params.append(since)
+            if until:
+                conditions.append("created_at < %s")
+                params.append(until)
+            if customer_id:
+                conditions.append("customer_id = %s")
+                params.append(customer_id)
+            if user_ids is not None:
+                conditions.append("user_id = ANY(%s::uuid[])")
+                params.append(list(user_ids))
+            if cursor:
+                conditions.append("(created_at, id) > (%s::timestamptz, %s)")
+                params.extend(cursor)
+            where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+            try:
+                return run_sql(f"SELECT * FROM public.{table} {where}ORDER BY created_at, id LIMIT %s",
+                               params + [limit], table, "select")
+            except Exception as e:
+                self._fallback(e, f"{table} export")
+
+        query = get_supabase().table(table).select("*")
+        if since:
+            query = query.gte("created_at", since)
+        if until:
+            query = query.lt("created_at", until)
+        if customer_id:
+            query = query.eq("customer_id", customer_id)
+        if user_ids is not None:
+            query = query.in_("user_id", user_ids)
+        if cursor:
+            last_created_at, last_id = cursor
+            query = query.or_(
+                f'created_at.gt."{last_created_at}",and(created_at.eq."{last_created_at}",id.gt.{last_id})'
+            )
+        result = run_query(query.order("created_at").order("id").limit(limit), table, "select")
+        return result.data or []
+
+transaction_store = TransactionStore(WEBHOOK_PAYLOAD_HASH_CACHE_ENTRIES, WEBHOOK_PAYLOAD_HASH_CACHE_TTL_SECONDS)
+
+def hydrate_payloads(table: str, rows: List[Dict]) -> List[Dict]:
+    """
+    Fill in payload columns of rows written with WEBHOOK_PAYLOAD_DEDUP from webhook_payloads
+    (for webhook_events also raw_payload["event_resource"]). Rows are updated in place.
+    """
+    hash_column, payload_column = PAYLOAD_REFERENCES[table]
+    hashes = {row[hash_column] for row in rows if row.get(hash_column)}
+    if not hashes:
+        return rows
+    payloads = transaction_store.fetch_payloads(sorted(hashes))
+    for row in rows:
+        digest = row.get(hash_column)
+        if not digest or digest not in payloads:
+            continue
+        row[payload_column] = payloads[digest]
+        if table == "webhook_events" and isinstance(row.get("raw_payload"), dict):
+            row["raw_payload"] = {**row["raw_payload"], "event_resource": payloads[digest]}
+    return rows
+
+def database_configured() -> bool:
+    return get_db_pool() is not None or get_supabase() is not None
+
+def current_view() -> Optional[str]:
+    """View function name of the current request, without the blueprint prefix"""
+    return request.endpoint.rsplit(".", 1)[-1] if request.endpoint else None
+
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_DURATION.labels(route, request.method, str(response.status_code)).observe(elapsed)
+        if current_view() == "handle_unblockpay_webhook":
+            WEBHOOK_PROCESSING_DURATION.labels(g.get("webhook_event_type") or "unknown").observe(elapsed)
+    if g.get("trace_span") is not None:
+        g.trace_span.set_attribute("http.status_code", response.status_code)
+    return response
+
+@api.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint (aggregated across workers when PROMETHEUS_MULTIPROC_DIR is set)"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import CollectorRegistry, multiprocess
+        refresh_live_gauges()
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+# Tracing is initialised lazily (per worker process) the first time a span is needed
+_tracer = None
+_tracing_initialized = False
+_tracing_lock = threading.Lock()
+
+def get_tracer():
+    """Return the OpenTelemetry tracer, or None when tracing is disabled or unavailable"""
+    global _tracer, _tracing_initialized
+    if _tracing_initialized:
+        return _tracer
+    with _tracing_lock:
+        if _tracing_initialized:
+            return _tracer
+        _tracing_initialized = True
+        if OTEL_TRACES_EXPORTER in ("", "none"):
+            return None
+        try:
+            from opentelemetry import trace
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+            if OTEL_TRACES_EXPORTER == "otlp":
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                exporter = OTLPSpanExporter()
+            elif OTEL_TRACES_EXPORTER == "json":
+                exporter = ConsoleSpanExporter(
+                    out=open(OTEL_TRACES_JSON_FILE, "a"),
+                    formatter=lambda span: span.to_json(indent=None) + "\n"
+                )
+            else:
+                print(f"WARNING: Unknown OTEL_TRACES_EXPORTER '{OTEL_TRACES_EXPORTER}' - tracing disabled")
+                return None
+
+            provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(exporter))
+            trace.set_tracer_provider(provider)
+            _tracer = trace.get_tracer("crebit.backend")
+            print(f"🔭 Tracing enabled - exporting spans via {OTEL_TRACES_EXPORTER}")
+        except ImportError as e:
+            print(f"WARNING: OpenTelemetry packages not installed ({e}) - tracing disabled")
+        return _tracer
+
+@contextmanager
+def trace_span(name: str, attributes: Optional[Dict] = None, links: Optional[list] = None):
+    """Run a block inside a span (a no-op yielding None when tracing is disabled)"""
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes, links=links) as span:
+        yield span
+
+def traced(name: str):
+    """Decorator wrapping a helper in a span"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate_span(**attributes):
+    """Set attributes on the current span, skipping None values"""
+    if get_tracer() is None:
+        return
+    from opentelemetry import trace
+    span = trace.get_current_span()
+    for key, value in attributes.items():
+        if value is not None:
+            span.set_attribute(key, value)
+
+def current_span_context():
+    """Span context of the current span, for linking work done later on another thread"""
+    if get_tracer() is None:
+        return None
+    from opentelemetry import trace
+    span_context = trace.get_current_span().get_span_context()
+    return span_context if span_context.is_valid else None
+
+def current_trace_id() -> Optional[str]:
+    span_context = current_span_context()
+    return format(span_context.trace_id, "032x") if span_context else None
+
+def span_links(span_contexts) -> list:
+    """Build span links from captured span contexts (e.g. the webhooks a netted payout covers)"""
+    if get_tracer() is None:
+        return []
+    from opentelemetry.trace import Link
+    return [Link(span_context) for span_context in span_contexts if span_context]
+
+@api.before_app_request
+def start_request_span():
+    tracer = get_tracer()
+    if tracer is None:
+        return
+    from opentelemetry import context, propagate, trace
+    span = tracer.start_span(
+        f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+        context=propagate.extract(request.headers),
+        kind=trace.SpanKind.SERVER,
+        attributes={"http.method": request.method, "http.route": request.url_rule.rule if request.url_rule else "unmatched"}
+    )
+    g.trace_span = span
+    g.trace_context_token = context.attach(trace.set_span_in_context(span))
+
+@api.teardown_app_request
+def end_request_span(exc=None):
+    span = g.pop("trace_span", None)
+    token = g.pop("trace_context_token", None)
+    if span is None:
+        return
+    from opentelemetry import context
+    if exc is not None:
+        span.record_exception(exc)
+    span.end()
+    if token is not None:
+        context.detach(token)
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised instead of calling upstream once the request's deadline budget is spent"""
+
+# Absolute time.monotonic() deadline for the current request (None = no budget)
+_request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+# Per-view budget overrides; None disables the budget (long-running streaming routes)
+ROUTE_DEADLINE_SECONDS = {
+    "get_wallet_provisioning": None,
+    "bulk_onboard": None,
+    "handle_unblockpay_webhook": WEBHOOK_DEADLINE_SECONDS,
+    "export_table": None,
+}
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Run a block of work (e.g. a background job) under its own deadline budget"""
+    token = _request_deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the current deadline budget, or None when no budget applies"""
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def upstream_timeout(default: Optional[float] = None) -> float:
+    """Timeout for the next upstream call: the smaller of default and the remaining budget"""
+    default = default or UPSTREAM_TIMEOUT_SECONDS
+    remaining = remaining_budget()
+    if remaining is None:
+        return default
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded by {-remaining:.2f}s - not calling upstream")
+    return min(default, remaining)
+
+@api.before_app_request
+def start_request_deadline():
+    seconds = ROUTE_DEADLINE_SECONDS.get(current_view(), REQUEST_DEADLINE_SECONDS)
+    g.deadline_token = _request_deadline.set(time.monotonic() + seconds if seconds else None)
+
+@api.teardown_app_request
+def clear_request_deadline(exc=None):
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        _request_deadline.reset(token)
+
+@api.app_errorhandler(DeadlineExceeded)
+def handle_deadline_exceeded(e):
+    print(f"⏱️ {current_view()}: {str(e)}")
+    return jsonify({"error": str(e)}), 504
+
+class RateLimitExceeded(requests.RequestException):
+    """Raised when no outbound rate-limit token became available within the allowed wait"""
+
+# Fraction of each bucket's burst that must remain after a caller of this priority takes a token,
+# so webhook-driven payouts can still get tokens while anonymous quote traffic is being throttled
+PRIORITY_RESERVE = {"high": 0.0, "normal": 0.2, "low": 0.5}
+
+# Priority of the upstream calls made by the current request or job
+_upstream_priority: ContextVar[str] = ContextVar("upstream_priority", default="normal")
+
+ROUTE_PRIORITY = {
+    "handle_unblockpay_webhook": "high",
+    "create_quote_new_endpoint": "low",
+    "bulk_onboard": "low",
+}
+
+@contextmanager
+def upstream_priority(priority: str):
+    """Run a block of upstream calls at the given rate-limit priority"""
+    token = _upstream_priority.set(priority)
+    try:
+        yield
+    finally:
+        _upstream_priority.reset(token)
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `burst`. When state_dir is set the
+    bucket state lives in a file guarded by flock, so every worker process shares one budget.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, state_dir: Optional[str] = None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.state_path = os.path.join(state_dir, f"unblockpay-{name}.bucket") if state_dir else None
+        self.throttled = 0
+        self._tokens = burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens: float, updated: float, floor: float):
+        """Refill, then try to take one token; returns (tokens, updated, seconds_to_wait)"""
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens - 1 >= floor:
+            return tokens - 1, now, 0.0
+        return tokens, now, (floor + 1 - tokens) / self.rate
+
+    def try_acquire(self, priority: str = "normal") -> float:
+        """Take a token if one is available at this priority, else return seconds to wait"""
+        # Never reserve the whole bucket, or small bursts would starve every priority but high
+        reserve = PRIORITY_RESERVE.get(priority, PRIORITY_RESERVE["normal"]) * self.burst
+        floor = min(reserve, self.burst - 1)
+        with self._lock:
+            if not self.state_path:
+                self._tokens, self._updated, wait = self._take(self._tokens, self._updated, floor)
+                return wait
+
+            import fcntl
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                tokens, updated, wait = self._take(state.get("tokens", self.burst), state.get("updated", time.time()), floor)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "updated": updated}))
+                f.flush()
+                return wait
+
+    def acquire(self, priority: str = "normal", max_wait: float = 10):
+        """Block until a token is taken, or raise RateLimitExceeded after max_wait seconds"""
+        give_up_at = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(priority)
+            if wait <= 0:
+                return
+            with self._lock:
+                self.throttled += 1
+            RATE_LIMIT_THROTTLED.labels(self.name, priority).inc()
+            if time.monotonic() + wait > give_up_at:
+                raise RateLimitExceeded(f"UnblockPay {self.name} rate limit reached for {priority} priority call")
+            time.sleep(wait)
+
+def parse_rate_limits(spec: str) -> Dict[str, TokenBucket]:
+    """Build token buckets from a "class=rate:burst,..." specification"""
+    buckets = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, limits = entry.partition("=")
+        rate, _, burst = limits.partition(":")
+        rate, burst = float(rate), float(burst or rate)
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"UNBLOCKPAY_RATE_LIMITS: {entry!r} needs a positive rate and a burst of at least 1")
+        buckets[name.strip()] = TokenBucket(name.strip(), rate, burst, UNBLOCKPAY_RATE_LIMIT_STATE_DIR)
+    return buckets
+
+rate_limit_buckets = parse_rate_limits(UNBLOCKPAY_RATE_LIMITS)
+
+def rate_limit_class(endpoint: str) -> str:
+    """Map an UnblockPay endpoint to its rate-limit class"""
+    if endpoint.startswith("customers") or endpoint == "external-accounts":
+        return "customers"
+    if endpoint == "quote":
+        return "quotes"
+    if endpoint == "payin":
+        return "payins"
+    if endpoint in ("payout", "wallet-transfer"):
+        return "payouts"
+    return endpoint
+
+def acquire_rate_limit_token(endpoint: str):
+    """Wait for the endpoint class's token at the current priority (no-op when unlimited)"""
+    bucket = rate_limit_buckets.get(rate_limit_class(endpoint))
+    if bucket is None:
+        return
+    max_wait = UNBLOCKPAY_RATE_LIMIT_MAX_WAIT_SECONDS
+    remaining = remaining_budget()
+    if remaining is not None:
+        max_wait = min(max_wait, max(remaining, 0))
+    bucket.acquire(_upstream_priority.get(), max_wait)
+
+@api.before_app_request
+def set_upstream_priority():
+    g.priority_token = _upstream_priority.set(ROUTE_PRIORITY.get(current_view(), "normal"))
+
+@api.teardown_app_request
+def clear_upstream_priority(exc=None):
+    token = g.pop("priority_token", None)
+    if token is not None:
+        _upstream_priority.reset(token)
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every `interval` seconds from a background thread and
+    aggregates the samples as folded stacks ("outer;inner;leaf count"), the input format of
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self.started = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            folded = ";".join(reversed(stack))
+            self.stacks[folded] = self.stacks.get(folded, 0) + 1
+            self.samples += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for folded, count in sorted(self.stacks.items()):
+                f.write(f"{folded} {count}\n")
+
+# Caps profiles per process so sampling stays cheap even when left enabled
+profiler_rate_limit = TokenBucket("profiler", PROFILER_MAX_PER_MINUTE / 60, max(PROFILER_MAX_PER_MINUTE, 1))
+
+def profile_trigger() -> Optional[str]:
+    """Why the current request should be profiled ("header" or "sampled"), or None"""
+    if request.headers.get("X-Profile") == "1" and admin_token_valid():
+        return "header"
+    if PROFILER_ENABLED and (not PROFILER_ROUTES or current_view() in PROFILER_ROUTES):
+        if random.random() < PROFILER_SAMPLE_RATE:
+            return "sampled"
+    return None
+
+@api.before_app_request
+def start_request_profiler():
+    trigger = profile_trigger()
+    if not trigger or PROFILER_MAX_PER_MINUTE <= 0:
+        return
+    if profiler_rate_limit.try_acquire("high") > 0:
+        if trigger == "header":
+            print(f"⏱️ Profile requested for {current_view()} but the profiler rate cap was reached")
+        return
+
+    g.profiler = StackSampler(threading.get_ident(), PROFILER_INTERVAL_MS / 1000).start()
+    g.profiler_trigger = trigger
+    g.profile_path = os.path.join(
+        PROFILER_OUTPUT_DIR,
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{current_view() or 'unmatched'}-{uuid.uuid4().hex[:8]}.folded"
+    )
+    annotate_span(**{"profile.file": g.profile_path})
+
+@api.after_app_request
+def add_profile_header(response):
+    if g.get("profile_path"):
+        response.headers["X-Profile-File"] = os.path.basename(g.profile_path)
+    return response
+
+@api.teardown_app_request
+def finish_request_profiler(exc=None):
+    sampler = g.pop("profiler", None)
+    if sampler is None:
+        return
+    sampler.stop()
+    elapsed_ms = (time.perf_counter() - sampler.started) * 1000
+    try:
+        os.makedirs(PROFILER_OUTPUT_DIR, exist_ok=True)
+        sampler.write(g.profile_path)
+        REQUEST_PROFILES.labels(request.url_rule.rule if request.url_rule else "unmatched", g.profiler_trigger).inc()
+        print(f"⏱️ Profiled {current_view()} ({elapsed_ms:.0f} ms, {sampler.samples} samples) -> {g.profile_path}")
+    except OSError as e:
+        print(f"❌ Could not write profile {g.profile_path}: {e}")
+
+class CircuitOpenError(requests.RequestException):
+    """Raised without calling UnblockPay while the endpoint's circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker. Opens after failure_threshold consecutive failures
+    (connection errors, timeouts, 5xx), fails fast for reset_seconds, then lets a single
+    trial request through (half-open) to decide whether to close again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.retries = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            CIRCUIT_BREAKER_REJECTIONS.labels(self.name).inc()
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"✅ Circuit breaker for UnblockPay {self.name} closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    CIRCUIT_BREAKER_TRIPS.labels(self.name).inc()
+                    print(f"🔌 Circuit breaker for UnblockPay {self.name} opened after {self.consecutive_failures} failure(s)")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def record_retry(self):
+        UNBLOCKPAY_RETRIES.labels(self.name).inc()
+        with self._lock:
+            self.retries += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retries": self.retries
+            }
+
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+# Shared session so UnblockPay calls reuse pooled keep-alive connections (created on first use)
+_unblockpay_session = None
+_unblockpay_session_lock = threading.Lock()
+
+def get_unblockpay_session() -> requests.Session:
+    global _unblockpay_session
+    if _unblockpay_session is None:
+        with _unblockpay_session_lock:
+            if _unblockpay_session is None:
+                _unblockpay_session = requests.Session()
+    return _unblockpay_session
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def unblockpay_endpoint(url: str) -> str:
+    """Endpoint class used for breakers and metrics, e.g. 'customers/wallets' or 'payout'"""
+    segments = [segment for segment in urlsplit(url).path.split("/") if segment]
+    if not segments:
+        return "root"
+    if len(segments) >= 3:
+        return f"{segments[0]}/{segments[2]}"
+    return segments[0]
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        breaker = circuit_breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint, CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS)
+            circuit_breakers[endpoint] = breaker
+        return breaker
+
+def _retry_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when UnblockPay sends one"""
+    delay = random.uniform(0, min(UNBLOCKPAY_RETRY_MAX_DELAY_SECONDS, UNBLOCKPAY_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), UNBLOCKPAY_RETRY_MAX_DELAY_SECONDS))
+        except ValueError:
+            pass
+    return delay
+
+def _budget_allows(delay: float) -> bool:
+    """Whether there is budget left to back off for delay seconds and try again"""
+    remaining = remaining_budget()
+    return remaining is None or remaining > delay
+
+def unblockpay_request(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    json: Optional[Union[Dict, list]] = None,
+    timeout: Optional[float] = None,
+    idempotent: Optional[bool] = None
+) -> requests.Response:
+    """
+    Make an UnblockPay API call through the endpoint's circuit breaker.
+    Idempotent calls (GETs by default) are retried on connection errors, timeouts, 429
+    and 5xx with jittered exponential backoff; other calls are attempted once.
+    The timeout is capped by the remaining request deadline budget, and no retry is
+    attempted once the budget cannot cover the backoff.
+    Returns the final response; callers still call raise_for_status().
+    """
+    endpoint = unblockpay_endpoint(url)
+    breaker = get_circuit_breaker(endpoint)
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD")
+    attempts = 1 + (UNBLOCKPAY_MAX_RETRIES if idempotent else 0)
+
+    for attempt in range(attempts):
+        acquire_rate_limit_token(endpoint)
+        call_timeout = upstream_timeout(timeout)
+        if not breaker.allow():
+            raise CircuitOpenError(f"UnblockPay {endpoint} circuit is open - failing fast")
+
+        started = time.perf_counter()
+        try:
+            with trace_span(f"unblockpay {method} {endpoint}", {"http.method": method, "unblockpay.endpoint": endpoint, "retry.attempt": attempt}) as span:
+                response = get_unblockpay_session().request(method, url, headers=headers, json=json, timeout=call_timeout)
+                if span is not None:
+                    span.set_attribute("http.status_code", response.status_code)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            UNBLOCKPAY_REQUEST_DURATION.labels(endpoint, method).observe(time.perf_counter() - started)
+            UNBLOCKPAY_RESPONSES.labels(endpoint, method, e.__class__.__name__).inc()
+            breaker.record_failure()
+            delay = _retry_delay(attempt)
+            if attempt + 1 >= attempts or not _budget_allows(delay):
+                raise
+            print(f"⚠️ UnblockPay {method} {endpoint} failed ({e.__class__.__name__}), retry {attempt + 1}/{attempts - 1} in {delay:.2f}s")
+            breaker.record_retry()
+            time.sleep(delay)
+            continue
+        except Exception as e:
+            UNBLOCKPAY_RESPONSES.labels(endpoint, method, e.__class__.__name__).inc()
+            breaker.record_failure()
+            raise
+
+        UNBLOCKPAY_REQUEST_DURATION.labels(endpoint, method).observe(time.perf_counter() - started)
+        UNBLOCKPAY_RESPONSES.labels(endpoint, method, str(response.status_code)).inc()
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        delay = _retry_delay(attempt, response)
+        if response.status_code in RETRYABLE_STATUS_CODES and attempt + 1 < attempts and _budget_allows(delay):
+            print(f"⚠️ UnblockPay {method} {endpoint} returned {response.status_code}, retry {attempt + 1}/{attempts - 1} in {delay:.2f}s")
+            breaker.record_retry()
+            time.sleep(delay)
+            continue
+
+        return response
+
 # Root route for health checks
-@app.route("/", methods=["GET", "HEAD"])
+@api.route("/", methods=["GET", "HEAD"])
 def health_check():
     return {"status": "healthy", "service": "tuition-bridge-backend"}, 200
 
 # Health check endpoint
-@app.route("/health", methods=["GET", "HEAD"])
+@api.route("/health", methods=["GET", "HEAD"])
 def health():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}, 200
 
@@ -120,7 +1364,8 @@ def create_external_account(
     
     # Make the API request
     try:
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{base_url}/customers/{customer_id}/external-accounts",
             headers=headers,
             json=payload,
@@ -183,7 +1428,8 @@ def create_wallet(
     
     # Make the API request
     try:
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{base_url}/customers/{customer_id}/wallets",
             headers=headers,
             json=payload,
@@ -207,6 +1453,7 @@ def create_wallet(
             print(f"Response body: {e.response.text}")
         raise
 
+@traced("create_wallet_transfer")
 def create_wallet_transfer(
     amount: float,
     customer_id: str,
@@ -257,7 +1504,8 @@ def create_wallet_transfer(
     
     # Make the API request
     try:
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{base_url}/wallet-transfer",
             headers=headers,
             json=payload,
@@ -341,7 +1589,8 @@ def create_individual_customer(
     }
 
     try:
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{base_url}/customers",
             headers=headers,
             json=payload,
@@ -374,7 +1623,7 @@ def create_individual_customer(
             print(f"Response body: {e.response.text}")
         raise
 
-@app.route("/api/check-customer-by-id", methods=["POST", "OPTIONS"])
+@api.route("/api/check-customer-by-id", methods=["POST", "OPTIONS"])
 def check_customer_by_national_id():
     """Check if a customer exists by national ID (CPF, passport, etc.) and return customer ID if found"""
     if request.method == "OPTIONS":
@@ -395,7 +1644,7 @@ def check_customer_by_national_id():
             "Content-Type": "application/json"
         }
         
-        response = requests.get(f"{BASE_URL}/customers", headers=headers)
+        response = unblockpay_request("GET", f"{BASE_URL}/customers", headers=headers)
         response.raise_for_status()
         customers = response.json()
         
@@ -457,18 +1706,306 @@ def check_customer_by_national_id():
         print(f"❌ {error_msg}")
         return jsonify({"error": error_msg}), 500
 
-@app.route("/api/create-customer", methods=["POST", "OPTIONS"])
+def request_schemas():
+    """The pydantic request models (request_schemas.py), imported on first use to keep pydantic off the cold-start path"""
+    import request_schemas
+    return request_schemas
+
+def validation_error_details(e) -> List[Dict]:
+    """One {field, message, type} entry per invalid field"""
+    details = []
+    for error in e.errors(include_url=False, include_input=False):
+        # Drop union tags ("new"/"existing") so fields read the same as in the request body
+        loc = [str(part) for part in error["loc"] if part not in ("new", "existing")]
+        details.append({"field": ".".join(loc) or "body", "message": error["msg"], "type": error["type"]})
+    return details
+
+def parse_request_body(schema_name: str):
+    """
+    Decode and validate the raw JSON body against a model class or TypeAdapter of request_schemas.py.
+    Returns (body, None), or (None, error response) with one entry per invalid field.
+    """
+    schemas = request_schemas()
+    schema = getattr(schemas, schema_name)
+    validate_json = schema.validate_json if isinstance(schema, schemas.TypeAdapter) else schema.model_validate_json
+    try:
+        return validate_json(request.get_data() or b"{}"), None
+    except schemas.ValidationError as e:
+        details = validation_error_details(e)
+        error_msg = "Validation errors: " + "; ".join(f"{d['field']}: {d['message']}" for d in details)
+        print(error_msg)
+        return None, (jsonify({"error": error_msg, "details": details}), 400)
+
+class WalletProvisioner:
+    """
+    Creates customer wallets on a background pool so signup can respond as soon as the
+    customer exists. Each customer's status (pending, ready or failed) is kept for
+    status_ttl_seconds in a SQLite table shared by every worker on the host, so any worker
+    can report it and a customer is only provisioned once. Waiters (payins, event streams)
+    are woken on changes made in this worker and poll for changes made in others. A pending
+    status older than pending_timeout_seconds belongs to a worker that died and is retried.
+    """
+
+    POLL_SECONDS = 0.25
+    COLUMNS = ("customer_id", "status", "wallet_id", "wallet_address", "error", "version", "updated_at")
+
+    def __init__(self, path: str, max_workers: int = 4, status_ttl_seconds: float = 3600,
+                 pending_timeout_seconds: float = 120):
+        self.path = path
+        self.max_workers = max_workers
+        self.status_ttl_seconds = status_ttl_seconds
+        self.pending_timeout_seconds = pending_timeout_seconds
+        self._jobs = set()
+        self._condition = threading.Condition()
+        self._executor = None
+        self._table_ready = False
+        self._updates = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._table_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS wallet_provisioning (
+                    customer_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    wallet_id TEXT,
+                    wallet_address TEXT,
+                    error TEXT,
+                    version INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._table_ready = True
+        return conn
+
+    def _read(self, conn: sqlite3.Connection, customer_id: str) -> Optional[Dict]:
+        row = conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM wallet_provisioning WHERE customer_id = ?", (customer_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status = dict(zip(self.COLUMNS, row))
+        age = time.time() - status["updated_at"]
+        if age > (self.pending_timeout_seconds if status["status"] == "pending" else self.status_ttl_seconds):
+            return None
+        status["updated_at"] = datetime.fromtimestamp(status["updated_at"]).isoformat()
+        return status
+
+    def _write(self, conn: sqlite3.Connection, customer_id: str, **fields) -> Dict:
+        status = {"customer_id": customer_id, "wallet_id": None, "wallet_address": None, "error": None, **fields}
+        conn.execute(
+            "INSERT INTO wallet_provisioning (customer_id, status, wallet_id, wallet_address, error, version, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 1, ?) ON CONFLICT (customer_id) DO UPDATE SET status = excluded.status, "
+            "wallet_id = excluded.wallet_id, wallet_address = excluded.wallet_address, error = excluded.error, "
+            "version = wallet_provisioning.version + 1, updated_at = excluded.updated_at",
+            (customer_id, status["status"], status["wallet_id"], status["wallet_address"], status["error"], time.time())
+        )
+        self._updates += 1
+        if self._updates % 100 == 0:
+            conn.execute("DELETE FROM wallet_provisioning WHERE updated_at < ?",
+                         (time.time() - max(self.status_ttl_seconds, self.pending_timeout_seconds),))
+        return self._read(conn, customer_id)
+
+    def submit(self, customer_id: str, wallet_name: str) -> Dict:
+        """Start provisioning (unless already pending or done) and return the current status"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                status = self._read(conn, customer_id)
+                if status and status["status"] in ("pending", "ready"):
+                    return status
+                status = self._write(conn, customer_id, status="pending")
+            finally:
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        with self._condition:
+            self._jobs.add(customer_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="wallet-provisioning")
+            self._condition.notify_all()
+        self._executor.submit(self._provision, customer_id, wallet_name, current_span_context())
+        return status
+
+    def get(self, customer_id: str) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            return self._read(conn, customer_id)
+        finally:
+            conn.close()
+
+    def wait(self, customer_id: str, timeout: float, version: Optional[int] = None) -> Optional[Dict]:
+        """
+        Wait until the customer's provisioning finishes (or, given a version, until its status
+        changes from that version) and return the status; returns early on timeout.
+        """
+        give_up_at = time.monotonic() + timeout
+        while True:
+            status = self.get(customer_id)
+            if status is None or status["status"] != "pending" or (version is not None and status["version"] != version):
+                return status
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                return status
+            with self._condition:
+                self._condition.wait(min(remaining, self.POLL_SECONDS))
+
+    def count(self) -> int:
+        """Provisioning jobs held by this process"""
+        with self._condition:
+            return len(self._jobs)
+
+    def drain(self, timeout: float = 30) -> bool:
+        """Wait until no provisioning is in flight in this process (used on shutdown)"""
+        give_up_at = time.monotonic() + timeout
+        with self._condition:
+            while self._jobs:
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _finish(self, customer_id: str, **fields):
+        try:
+            conn = self._connect()
+            try:
+                self._write(conn, customer_id, **fields)
+            finally:
+                conn.close()
+        finally:
+            with self._condition:
+                self._jobs.discard(customer_id)
+                self._condition.notify_all()
+
+    def _provision(self, customer_id: str, wallet_name: str, span_context):
+        with trace_span("wallet_provisioning", {"customer_id": customer_id}, span_links([span_context])):
+            try:
+                wallet_data = create_wallet(customer_id=customer_id, name=wallet_name, blockchain="solana")
+                if not wallet_data.get("id") or not wallet_data.get("address"):
+                    raise ValueError("Failed to create wallet: No wallet ID or address returned")
+            except Exception as e:
+                self._finish(customer_id, status="failed", error=str(e))
+                print(f"❌ Wallet provisioning failed for customer {customer_id}: {e}")
+                return
+            self._finish(customer_id, status="ready", wallet_id=wallet_data["id"], wallet_address=wallet_data["address"])
+            print(f"✅ Provisioned wallet {wallet_data['id']} for customer {customer_id}")
+
+wallet_provisioner = WalletProvisioner(
+    WALLET_PROVISIONING_DB_PATH, WALLET_PROVISIONING_MAX_WORKERS, WALLET_PROVISIONING_STATUS_TTL_SECONDS,
+    WALLET_PROVISIONING_PENDING_TIMEOUT_SECONDS
+)
+
+def wants_async_provisioning() -> bool:
+    if "respond-async" in request.headers.get("Prefer", ""):
+        apply_preference("respond-async")
+        return True
+    return ASYNC_WALLET_PROVISIONING
+
+def fetch_customer_wallet(customer_id: str) -> Optional[Dict]:
+    """First wallet UnblockPay has for the customer (None if it has none)"""
+    headers = {"Authorization": AUTH_TOKEN, "Content-Type": "application/json"}
+    response = unblockpay_request("GET", f"{BASE_URL}/customers/{customer_id}/wallets", headers=headers)
+    response.raise_for_status()
+    wallets = response.json()
+    return wallets[0] if wallets else None
+
+def wallet_provisioning_status(customer_id: str) -> Dict:
+    """Provisioning status from the shared provisioning table, else derived from the customer's wallets upstream"""
+    status = wallet_provisioner.get(customer_id)
+    if status is not None:
+        return status
+    wallet = fetch_customer_wallet(customer_id)
+    if wallet:
+        return {"customer_id": customer_id, "status": "ready", "wallet_id": wallet.get("id"), "wallet_address": wallet.get("address")}
+    return {"customer_id": customer_id, "status": "not_found", "wallet_id": None, "wallet_address": None}
+
+def missing_wallet_response(customer_id: str):
+    """Resolve a payin's wallet when the client didn't send one; returns (wallet, error_response)"""
+    try:
+        wallet = resolve_customer_wallet(customer_id)
+    except requests.RequestException as e:
+        return None, (jsonify({"error": f"Could not look up customer wallet: {str(e)}"}), 502)
+    if wallet is not None:
+        return wallet, None
+    status = wallet_provisioner.get(customer_id)
+    if status and status["status"] == "pending":
+        return None, (jsonify({
+            "error": "Wallet is still being provisioned",
+            "status_url": f"/api/wallet-provisioning/{customer_id}"
+        }), 409, {"Retry-After": "2"})
+    if status and status["status"] == "failed":
+        return None, (jsonify({"error": f"Wallet provisioning failed: {status['error']}"}), 502)
+    return None, (jsonify({"error": "Customer has no wallet"}), 400)
+
+def resolve_customer_wallet(customer_id: str) -> Optional[Dict]:
+    """
+    Wallet for a payin that arrived without one: waits for in-flight provisioning (bounded by
+    WALLET_PROVISIONING_WAIT_SECONDS and the request budget), then falls back to UnblockPay.
+    """
+    timeout = WALLET_PROVISIONING_WAIT_SECONDS
+    remaining = remaining_budget()
+    if remaining is not None:
+        timeout = min(timeout, max(remaining - 5, 0))
+    status = wallet_provisioner.wait(customer_id, timeout)
+    if status is not None:
+        return status if status["status"] == "ready" else None
+    wallet = fetch_customer_wallet(customer_id)
+    if wallet:
+        return {"status": "ready", "wallet_id": wallet.get("id"), "wallet_address": wallet.get("address")}
+    return None
+
+@api.route("/api/wallet-provisioning/<customer_id>", methods=["GET"])
+def get_wallet_provisioning(customer_id):
+    """
+    Wallet provisioning status for a customer. Clients that send "Accept: text/event-stream"
+    (or ?stream=true) get server-sent events on every change until it is ready or failed.
+    """
+    stream = request.args.get("stream", "false").lower() == "true" or "text/event-stream" in request.headers.get("Accept", "")
+    if not stream:
+        try:
+            return jsonify(wallet_provisioning_status(customer_id)), 200
+        except requests.RequestException as e:
+            return jsonify({"error": f"Could not look up wallet: {str(e)}"}), 502
+
+    def events():
+        give_up_at = time.monotonic() + WALLET_PROVISIONING_STREAM_SECONDS
+        try:
+            status = wallet_provisioning_status(customer_id)
+        except requests.RequestException as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        while True:
+            yield f"event: status\ndata: {json.dumps(status)}\n\n"
+            remaining = give_up_at - time.monotonic()
+            if status["status"] != "pending" or remaining <= 0:
+                return
+            # Wake at least every 15s so proxies see traffic on the open connection
+            changed = wallet_provisioner.wait(customer_id, min(remaining, 15), version=status.get("version"))
+            if changed is None:
+                return
+            if changed["version"] == status.get("version"):
+                yield ": keep-alive\n\n"
+            status = changed
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api.route("/api/create-customer", methods=["POST", "OPTIONS"])
 def create_customer():
     # Handle preflight OPTIONS request
     if request.method == "OPTIONS":
         return "", 200
         
-    data = request.json
-    print(f"Received data: {json.dumps(data, indent=2)}")
+    body, error_response = parse_request_body("CreateCustomerBody")
+    if error_response:
+        return error_response
+    print(f"Received data: {body.model_dump_json(indent=2)}")
     
     # Check if this is a request to use existing customer
-    if data.get('use_existing_customer') and data.get('existing_customer_id'):
-        customer_id = data['existing_customer_id']
+    if isinstance(body, request_schemas().UseExistingCustomerRequest):
+        customer_id = body.existing_customer_id
         print(f"🔄 Using existing customer: {customer_id}")
         
         # Get customer wallet info
@@ -481,7 +2018,7 @@ def create_customer():
             try:
                 # Get customer info to create wallet name
                 headers = {"Authorization": AUTH_TOKEN, "Content-Type": "application/json"}
-                customer_response = requests.get(f"{BASE_URL}/customers/{customer_id}", headers=headers)
+                customer_response = unblockpay_request("GET", f"{BASE_URL}/customers/{customer_id}", headers=headers)
                 customer_response.raise_for_status()
                 customer_data = customer_response.json()
                 
@@ -503,7 +2040,7 @@ def create_customer():
             # Get wallet address for existing wallet
             try:
                 headers = {"Authorization": AUTH_TOKEN, "Content-Type": "application/json"}
-                wallet_response = requests.get(f"{BASE_URL}/customers/{customer_id}/wallets", headers=headers)
+                wallet_response = unblockpay_request("GET", f"{BASE_URL}/customers/{customer_id}/wallets", headers=headers)
                 wallet_response.raise_for_status()
                 wallets = wallet_response.json()
                 wallet_address = wallets[0].get('address') if wallets and len(wallets) > 0 else None
@@ -520,8 +2057,9 @@ def create_customer():
         }), 200
     
     # Check for existing customer by national ID before creating new one
-    doc = data["identity_documents"][0] if data.get("identity_documents") else {}
-    national_id = doc.get("value")
+    doc = body.identity_documents[0]
+    addr = body.address
+    national_id = doc.value
     
     if national_id:
         print(f"🔍 Checking for existing customer with national ID: {national_id}")
@@ -529,7 +2067,7 @@ def create_customer():
         # Use the existing check function
         try:
             headers = {"Authorization": AUTH_TOKEN, "Content-Type": "application/json"}
-            response = requests.get(f"{BASE_URL}/customers", headers=headers)
+            response = unblockpay_request("GET", f"{BASE_URL}/customers", headers=headers)
             response.raise_for_status()
             customers = response.json()
             
@@ -587,7 +2125,7 @@ def create_customer():
                         # Get wallet address for existing wallet
                         try:
                             headers = {"Authorization": AUTH_TOKEN, "Content-Type": "application/json"}
-                            wallet_response = requests.get(f"{BASE_URL}/customers/{customer_id}/wallets", headers=headers)
+                            wallet_response = unblockpay_request("GET", f"{BASE_URL}/customers/{customer_id}/wallets", headers=headers)
                             wallet_response.raise_for_status()
                             wallets = wallet_response.json()
                             wallet_address = wallets[0].get('address') if wallets and len(wallets) > 0 else None
@@ -620,102 +2158,51 @@ def create_customer():
             print(f"❌ Error checking for existing customer: {str(e)}")
             # Continue with normal flow if check fails
     
-    # Validate required top-level fields
-    required_top_fields = [
-        "first_name", "last_name", "email", "phone_number", "date_of_birth",
-        "type", "identity_documents", "address"
-    ]
-    missing_fields = [field for field in required_top_fields if not data.get(field)]
-    if missing_fields:
-        error_msg = f"Missing or empty top-level fields: {', '.join(missing_fields)}"
-        print(error_msg)
-        return jsonify({"error": error_msg}), 400
-        
-    # Validate identity_documents
-    if not data["identity_documents"] or not isinstance(data["identity_documents"], list):
-        error_msg = "identity_documents must be a non-empty list"
-        print(error_msg)
-        return jsonify({"error": error_msg}), 400
-        
-    doc = data["identity_documents"][0]
-    required_doc_fields = ["type", "value", "country"]
-    missing_doc_fields = [field for field in required_doc_fields if not doc.get(field)]
-    if missing_doc_fields:
-        error_msg = f"Missing or empty identity document fields: {', '.join(missing_doc_fields)}"
-        print(error_msg)
-        return jsonify({"error": error_msg}), 400
-        
-    # Validate address fields
-    required_address_fields = ["street_line_1", "city", "state", "postal_code", "country"]
-    missing_address_fields = [field for field in required_address_fields if not data["address"].get(field)]
-    if missing_address_fields:
-        error_msg = f"Missing or empty address fields: {', '.join(missing_address_fields)}"
-        print(error_msg)
-        return jsonify({"error": error_msg}), 400
-        
-    # Validate field formats
-    validation_errors = []
-    
-    # Email format
-    if '@' not in data['email']:
-        validation_errors.append("Invalid email format")
-    
-    # Date format (YYYY-MM-DD)
-    date_str = data['date_of_birth']
-    if not (len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-'):
-        validation_errors.append("Date of birth must be in YYYY-MM-DD format")
-    
-    # Phone number format (should have at least some digits)
-    if not any(c.isdigit() for c in data['phone_number']):
-        validation_errors.append("Phone number must contain digits")
-        
-    # Type must be 'individual'
-    if data['type'] != 'individual':
-        validation_errors.append("Customer type must be 'individual'")
-    
-    if validation_errors:
-        error_msg = f"Validation errors: {'; '.join(validation_errors)}"
-        print(error_msg)
-        return jsonify({"error": error_msg}), 400
-
     try:
-        # Extract fields from nested structure
-        doc = data["identity_documents"][0]
-        addr = data["address"]
-        
         # Create customer using the helper function
         response_data = create_individual_customer(
-            first_name=data["first_name"],
-            last_name=data["last_name"],
-            email=data["email"],
-            phone_number=data["phone_number"],
-            date_of_birth=data["date_of_birth"],
-            document_type=doc["type"],
-            document_value=doc["value"],
-            document_country=doc["country"],
-            street_line_1=addr["street_line_1"],
-            city=addr["city"],
-            state=addr["state"],
-            postal_code=addr["postal_code"],
-            country=addr["country"],
-            street_line_2=addr.get("street_line_2")
+            first_name=body.first_name,
+            last_name=body.last_name,
+            email=body.email,
+            phone_number=body.phone_number,
+            date_of_birth=body.date_of_birth,
+            document_type=doc.type,
+            document_value=doc.value,
+            document_country=doc.country,
+            street_line_1=addr.street_line_1,
+            city=addr.city,
+            state=addr.state,
+            postal_code=addr.postal_code,
+            country=addr.country,
+            street_line_2=addr.street_line_2
         )
 
         # Get customer_id and create wallet - data will be stored in frontend localStorage
         customer_id = response_data.get("id")
         if customer_id:
             # Store address for response
-            customer_address = {
-                "street_line_1": addr["street_line_1"],
-                "street_line_2": addr.get("street_line_2"),
-                "city": addr["city"],
-                "state": addr["state"],
-                "postal_code": addr["postal_code"],
-                "country": addr["country"]
-            }
+            customer_address = addr.model_dump()
             
             # Create a wallet for the customer
-            wallet_name = f"{data['first_name']}'s Wallet"
+            wallet_name = f"{body.first_name}'s Wallet"
+            if wants_async_provisioning():
+                provisioning = wallet_provisioner.submit(customer_id, wallet_name)
+                print(f"Created customer {customer_id} - wallet provisioning in the background")
+                response_data["customer_address"] = customer_address
+                result = {
+                    "message": "Customer created - wallet is being provisioned",
+                    "customer_id": customer_id,
+                    "wallet_id": provisioning["wallet_id"],
+                    "wallet_address": provisioning["wallet_address"],
+                    "wallet_provisioning": {
+                        "status": provisioning["status"],
+                        "status_url": f"/api/wallet-provisioning/{customer_id}"
+                    }
+                }
+                if not wants_minimal_response():
+                    result["full_response"] = response_data
+                return jsonify(result), 202
+
             wallet_data = create_wallet(
                 customer_id=customer_id,
                 name=wallet_name,
@@ -738,13 +2225,15 @@ def create_customer():
             response_data["wallet"] = wallet_data
             response_data["customer_address"] = customer_address
 
-        return jsonify({
+        result = {
             "message": "Customer and wallet created successfully",
             "customer_id": customer_id,
             "wallet_id": wallet_id,
-            "wallet_address": wallet_address,
-            "full_response": response_data
-        }), 201
+            "wallet_address": wallet_address
+        }
+        if not wants_minimal_response():
+            result["full_response"] = response_data
+        return jsonify(result), 201
 
     except requests.RequestException as e:
         error_message = str(e)
@@ -758,7 +2247,7 @@ def create_customer():
 
 # Removed /api/last-quote-ids endpoint - quote data now stored in frontend localStorage
 
-@app.route("/api/create-external-account", methods=["POST", "OPTIONS"])
+@api.route("/api/create-external-account", methods=["POST", "OPTIONS"])
 def create_us_wire_account():
     # Handle preflight OPTIONS request
     if request.method == "OPTIONS":
@@ -835,6 +2324,7 @@ def create_us_wire_account():
 
 # Removed /api/last-external-account-id endpoint - external account data now stored in frontend localStorage
 
+@traced("create_quote")
 def create_quote(
     symbol: str,
     quote_type: str = "off_ramp",
@@ -843,7 +2333,8 @@ def create_quote(
 ) -> Dict[str, Union[str, int, float]]:
     """Create a quote using the UnblockPay API."""
     try:
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{base_url}/quote",
             headers={
                 "Authorization": authorization_token,
@@ -863,7 +2354,131 @@ def create_quote(
         error_response = getattr(e.response, "text", "No response body") if hasattr(e, "response") else "No response"
         raise Exception(f"Failed to create quote: {error_response}")
 
-@app.route("/api/create-quote", methods=["POST", "OPTIONS"])
+def quote_expires_at(quote: Dict) -> float:
+    """Return a quote's expiry as a unix timestamp (the API returns epoch seconds)"""
+    expires_at = quote.get("expires_at")
+    if isinstance(expires_at, (int, float)):
+        return float(expires_at)
+    if isinstance(expires_at, str):
+        try:
+            return float(expires_at)
+        except ValueError:
+            return datetime.fromisoformat(expires_at.replace('Z', '+00:00')).timestamp()
+    return 0.0
+
+class OffRampQuotePool:
+    """
+    Keeps one valid off-ramp quote per payout rail so concurrent payouts can share it.
+    A background timer refreshes the quote shortly before expires_at while payouts are
+    still asking for it; an idle pool lets its quote lapse instead of polling upstream.
+    """
+
+    def __init__(self, symbol: str = "USDC/USD", refresh_margin_seconds: float = 15, idle_seconds: float = 300):
+        self.symbol = symbol
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.idle_seconds = idle_seconds
+        self.hits = 0
+        self.misses = 0
+        self._quotes = {}
+        self._last_used = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self._refresh_locks = {}
+
+    def _is_fresh(self, quote: Optional[Dict]) -> bool:
+        return bool(quote) and time.time() < quote_expires_at(quote) - self.refresh_margin_seconds
+
+    def get(self, rail: str = "wire") -> Dict:
+        """Return a quote that stays valid for at least the refresh margin"""
+        with self._lock:
+            self._last_used[rail] = time.monotonic()
+            quote = self._quotes.get(rail)
+            if self._is_fresh(quote):
+                self.hits += 1
+                CACHE_REQUESTS.labels("offramp_quote_pool", "hit").inc()
+                return quote
+            self.misses += 1
+            CACHE_REQUESTS.labels("offramp_quote_pool", "miss").inc()
+        return self.refresh(rail)
+
+    def refresh(self, rail: str = "wire") -> Dict:
+        """Fetch a new quote for the rail; concurrent callers share a single upstream request"""
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(rail, threading.Lock())
+
+        with refresh_lock:
+            with self._lock:
+                quote = self._quotes.get(rail)
+            if self._is_fresh(quote):
+                return quote
+
+            quote = create_quote(symbol=self.symbol, quote_type="off_ramp")
+            if not quote or not quote.get("id"):
+                raise Exception("Failed to create off-ramp quote")
+
+            with self._lock:
+                self._quotes[rail] = quote
+            print(f"🔄 Quote pool refreshed {self.symbol} quote for {rail}: {quote.get('id')} (expires_at: {quote.get('expires_at')})")
+            self._schedule_refresh(rail, quote)
+            return quote
+
+    def invalidate(self, rail: str = "wire", quote_id: Optional[str] = None):
+        """Drop the pooled quote (e.g. after the payout API rejected it)"""
+        with self._lock:
+            quote = self._quotes.get(rail)
+            if quote and (quote_id is None or quote.get("id") == quote_id):
+                del self._quotes[rail]
+                print(f"🗑️ Quote pool invalidated quote {quote.get('id')} for {rail}")
+
+    def _schedule_refresh(self, rail: str, quote: Dict):
+        delay = quote_expires_at(quote) - self.refresh_margin_seconds - time.time()
+        if delay <= 0:
+            return
+
+        timer = threading.Timer(delay, self._proactive_refresh, args=(rail,))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.get(rail)
+            if previous:
+                previous.cancel()
+            self._timers[rail] = timer
+        timer.start()
+
+    def _proactive_refresh(self, rail: str):
+        with self._lock:
+            idle_for = time.monotonic() - self._last_used.get(rail, 0)
+            self._quotes.pop(rail, None)
+        if idle_for > self.idle_seconds:
+            print(f"Quote pool idle for {rail} ({idle_for:.0f}s) - not refreshing")
+            return
+        try:
+            with trace_span("quote_pool_refresh", {"rail": rail}), upstream_priority("high"):
+                self.refresh(rail)
+        except Exception as e:
+            # The next payout will fetch a quote on demand
+            print(f"❌ Quote pool proactive refresh failed for {rail}: {str(e)}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "quotes": {rail: {"id": q.get("id"), "expires_at": q.get("expires_at")} for rail, q in self._quotes.items()}
+            }
+
+off_ramp_quote_pool = OffRampQuotePool(
+    symbol="USDC/USD",
+    refresh_margin_seconds=OFFRAMP_QUOTE_REFRESH_MARGIN_SECONDS,
+    idle_seconds=OFFRAMP_QUOTE_IDLE_SECONDS
+)
+
+def get_payout_quote(rail: str = "wire") -> Dict:
+    """Return the USDC/USD off-ramp quote to use for a payout"""
+    if OFFRAMP_QUOTE_POOL_ENABLED:
+        return off_ramp_quote_pool.get(rail)
+    return create_quote(symbol="USDC/USD", quote_type="off_ramp")
+
+@api.route("/api/create-quote", methods=["POST", "OPTIONS"])
 def create_quote_endpoint():
     # Handle preflight OPTIONS request
     if request.method == "OPTIONS":
@@ -933,7 +2548,7 @@ def create_quote_endpoint():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/create-wallet", methods=["POST", "OPTIONS"])
+@api.route("/api/create-wallet", methods=["POST", "OPTIONS"])
 def create_wallet_endpoint():
     """
     Create a wallet for a customer.
@@ -968,7 +2583,233 @@ def create_wallet_endpoint():
         print(f"Error in create_wallet_endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/create-pix-payment", methods=["POST", "OPTIONS"])
+class IdempotencyStore:
+    """
+    Responses stored by Idempotency-Key: a bounded in-process LRU with a TTL in front of a
+    SQLite table shared by every worker on the host. The first request for a key writes a
+    pending row; duplicates (in this worker or another) wait for its result instead of
+    calling UnblockPay again.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int, wait_seconds: float,
+                 pending_timeout_seconds: float = 120):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.wait_seconds = wait_seconds
+        self.pending_timeout_seconds = pending_timeout_seconds
+        self._cache = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._completed = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._table_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    scope TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    status INTEGER,
+                    content_type TEXT,
+                    body BLOB,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._table_ready = True
+        return conn
+
+    def _cached(self, scope: str) -> Optional[Dict]:
+        entry = self._cache.get(scope)
+        if entry is None:
+            return None
+        if time.time() - entry["created_at"] > self.ttl_seconds:
+            del self._cache[scope]
+            return None
+        self._cache.move_to_end(scope)
+        return entry
+
+    def _remember(self, scope: str, entry: Dict):
+        self._cache[scope] = entry
+        self._cache.move_to_end(scope)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _claim(self, scope: str, fingerprint: str) -> Optional[Dict]:
+        """Insert a pending row for scope; returns None if claimed, else the existing row"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE scope = ? AND (created_at < ? OR (state = 'pending' AND created_at < ?))",
+                (scope, now - self.ttl_seconds, now - self.pending_timeout_seconds)
+            )
+            claimed = conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (scope, fingerprint, state, created_at) VALUES (?, ?, 'pending', ?)",
+                (scope, fingerprint, now)
+            ).rowcount
+            if claimed:
+                return None
+            row = conn.execute(
+                "SELECT fingerprint, state, status, content_type, body, created_at FROM idempotency_keys WHERE scope = ?",
+                (scope,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            # Deleted between the insert and the select - try again
+            return {"state": "pending", "fingerprint": fingerprint}
+        return dict(zip(("fingerprint", "state", "status", "content_type", "body", "created_at"), row))
+
+    def begin(self, scope: str, fingerprint: str):
+        """
+        Returns (entry, True) when the caller owns the key and must run the request, or
+        (entry, False) with the stored/conflicting entry. entry is None after waiting too long.
+        Raises sqlite3.Error when the shared table cannot be reached.
+        """
+        give_up_at = time.monotonic() + self.wait_seconds
+        remaining = remaining_budget()
+        if remaining is not None:
+            give_up_at = min(give_up_at, time.monotonic() + max(remaining, 0))
+
+        while True:
+            with self._lock:
+                entry = self._cached(scope)
+                if entry is not None:
+                    CACHE_REQUESTS.labels("idempotency", "hit").inc()
+                    return entry, False
+                event = self._inflight.get(scope)
+                if event is None:
+                    # Reserve the key in this worker, then claim it in SQLite without holding the lock
+                    self._inflight[scope] = threading.Event()
+
+            if event is None:
+                try:
+                    entry = self._claim(scope, fingerprint)
+                except sqlite3.Error:
+                    with self._lock:
+                        self._finish(scope)
+                    raise
+                if entry is None:
+                    CACHE_REQUESTS.labels("idempotency", "miss").inc()
+                    return None, True
+                with self._lock:
+                    # Another worker holds the key; wake local duplicates so they poll it too
+                    self._finish(scope)
+                    if entry["state"] == "done":
+                        self._remember(scope, entry)
+                if entry["state"] == "done":
+                    CACHE_REQUESTS.labels("idempotency", "hit").inc()
+                    return entry, False
+                if entry["fingerprint"] != fingerprint:
+                    return entry, False
+
+            # Another request with this key is running - here (event) or in another worker (poll)
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                return None, False
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(0.1, remaining))
+
+    def _finish(self, scope: str):
+        event = self._inflight.pop(scope, None)
+        if event is not None:
+            event.set()
+
+    def complete(self, scope: str, fingerprint: str, status: int, content_type: str, body: bytes):
+        entry = {
+            "fingerprint": fingerprint, "state": "done", "status": status,
+            "content_type": content_type, "body": body, "created_at": time.time()
+        }
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "UPDATE idempotency_keys SET state = 'done', status = ?, content_type = ?, body = ?, created_at = ? WHERE scope = ?",
+                    (status, content_type, body, entry["created_at"], scope)
+                )
+                self._completed += 1
+                if self._completed % 100 == 0:
+                    conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not persist idempotent response for {scope}: {e}")
+        with self._lock:
+            self._remember(scope, entry)
+            self._finish(scope)
+
+    def abandon(self, scope: str):
+        """Release a key whose request failed so a retry runs it again"""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM idempotency_keys WHERE scope = ? AND state = 'pending'", (scope,))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not release idempotency key {scope}: {e}")
+        with self._lock:
+            self._finish(scope)
+
+idempotency_store = IdempotencyStore(
+    IDEMPOTENCY_DB_PATH, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_WAIT_SECONDS,
+    IDEMPOTENCY_PENDING_TIMEOUT_SECONDS
+)
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header: the first request runs, concurrent duplicates wait for
+    it, and later repeats get its stored 2xx response. Failures are not stored so the client
+    can retry with the same key.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not IDEMPOTENCY_ENABLED or request.method == "OPTIONS" or not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": "Idempotency-Key must be at most 255 characters"}), 400
+
+        scope = f"{current_view()}:{key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        try:
+            entry, owner = idempotency_store.begin(scope, fingerprint)
+        except sqlite3.Error as e:
+            # Without the store a retry could create a second payment, so refuse rather than run it
+            print(f"❌ Idempotency store unavailable for {scope}: {e}")
+            response = jsonify({"error": "Idempotency store unavailable - retry with the same Idempotency-Key"})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+
+        if not owner:
+            if entry is None:
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            if entry["fingerprint"] != fingerprint:
+                return jsonify({"error": "Idempotency-Key was already used with a different request body"}), 422
+            print(f"🔁 Replaying stored response for Idempotency-Key {key}")
+            response = Response(entry["body"], status=entry["status"], content_type=entry["content_type"])
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency_store.abandon(scope)
+            raise
+        if response.status_code < 400 and not response.is_streamed:
+            idempotency_store.complete(scope, fingerprint, response.status_code, response.content_type, response.get_data())
+        else:
+            idempotency_store.abandon(scope)
+        return response
+    return wrapper
+
+@api.route("/api/create-pix-payment", methods=["POST", "OPTIONS"])
+@idempotent
 def create_pix_payment():
     """
     Create a PIX payment for on-ramp transactions using UnblockPay payin API.
@@ -978,28 +2819,22 @@ def create_pix_payment():
     if request.method == "OPTIONS":
         return "", 200
         
+    body, error_response = parse_request_body("PixPaymentRequest")
+    if error_response:
+        return error_response
+
     try:
-        data = request.json or {}
-        amount_brl = float(data.get("amount_brl", 0))
-        customer_id = data.get("customer_id")
-        wallet_address = data.get("wallet_address")
-        quote_id = data.get("quote_id")
-        sender_name = data.get("sender_name")
-        sender_document = data.get("sender_document")  # CPF
-        
-        # Validate required parameters
-        if not amount_brl or amount_brl <= 0:
-            return jsonify({"error": "A valid amount_brl is required"}), 400
-        if not customer_id:
-            return jsonify({"error": "customer_id is required"}), 400
+        amount_brl = body.amount_brl
+        customer_id = body.customer_id
+        wallet_address = body.wallet_address
         if not wallet_address:
-            return jsonify({"error": "wallet_address is required"}), 400
-        if not quote_id:
-            return jsonify({"error": "quote_id is required"}), 400
-        if not sender_name:
-            return jsonify({"error": "sender_name is required"}), 400
-        if not sender_document:
-            return jsonify({"error": "sender_document (CPF) is required"}), 400
+            wallet, error_response = missing_wallet_response(customer_id)
+            if error_response:
+                return error_response
+            wallet_address = wallet["wallet_address"]
+        quote_id = body.quote_id
+        sender_name = body.sender_name
+        sender_document = body.sender_document  # CPF
         
         print(f"Creating PIX payin transaction:")
         print(f"  Amount: R$ {amount_brl}")
@@ -1035,7 +2870,8 @@ def create_pix_payment():
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
         # Make the API request to UnblockPay payin endpoint
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{BASE_URL}/payin",
             headers=headers,
             json=payload,
@@ -1080,15 +2916,17 @@ def create_pix_payment():
                     break
         
         # Return the complete transaction response with deposit address explicitly included
-        return jsonify({
+        result = {
             "success": True,
-            "transaction": transaction_response,
             "transaction_id": transaction_id,
             "status": transaction_response.get("status", "unknown"),
             "amount_brl": amount_brl,
             "wallet_address": wallet_address,
             "deposit_address": deposit_address  # Explicitly include deposit address
-        }), 201
+        }
+        if not wants_minimal_response():
+            result["transaction"] = transaction_response
+        return jsonify(result), 201
         
     except requests.RequestException as e:
         error_msg = f"Error creating payin transaction: {str(e)}"
@@ -1118,7 +2956,8 @@ def create_pix_payment():
             "error": error_msg
         }), 500
 
-@app.route("/api/create-spei-payment", methods=["POST", "OPTIONS"])
+@api.route("/api/create-spei-payment", methods=["POST", "OPTIONS"])
+@idempotent
 def create_spei_payment():
     """
     Create a SPEI payment for on-ramp transactions using UnblockPay payin API.
@@ -1128,25 +2967,21 @@ def create_spei_payment():
     if request.method == "OPTIONS":
         return "", 200
         
+    body, error_response = parse_request_body("SpeiPaymentRequest")
+    if error_response:
+        return error_response
+
     try:
-        data = request.json or {}
-        amount_mxn = float(data.get("amount_mxn", 0))
-        customer_id = data.get("customer_id")
-        wallet_id = data.get("wallet_id")
-        quote_id = data.get("quote_id")
-        sender_clabe = data.get("sender_clabe")
-        
-        # Validate required parameters
-        if not amount_mxn or amount_mxn <= 0:
-            return jsonify({"error": "A valid amount_mxn is required"}), 400
-        if not customer_id:
-            return jsonify({"error": "customer_id is required"}), 400
+        amount_mxn = body.amount_mxn
+        customer_id = body.customer_id
+        wallet_id = body.wallet_id
         if not wallet_id:
-            return jsonify({"error": "wallet_id is required"}), 400
-        if not quote_id:
-            return jsonify({"error": "quote_id is required"}), 400
-        if not sender_clabe:
-            return jsonify({"error": "sender_clabe is required"}), 400
+            wallet, error_response = missing_wallet_response(customer_id)
+            if error_response:
+                return error_response
+            wallet_id = wallet["wallet_id"]
+        quote_id = body.quote_id
+        sender_clabe = body.sender_clabe
         
         print(f"Creating SPEI payin transaction:")
         print(f"  Amount: ${amount_mxn} MXN")
@@ -1181,7 +3016,8 @@ def create_spei_payment():
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
         # Make the API request to UnblockPay payin endpoint
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{BASE_URL}/payin",
             headers=headers,
             json=payload,
@@ -1231,9 +3067,8 @@ def create_spei_payment():
                     break
         
         # Return the complete transaction response with SPEI payment details
-        return jsonify({
+        result = {
             "success": True,
-            "transaction": transaction_response,
             "transaction_id": transaction_id,
             "status": transaction_response.get("status", "unknown"),
             "amount_mxn": amount_mxn,
@@ -1241,7 +3076,10 @@ def create_spei_payment():
             "deposit_address": deposit_address,  # CLABE for SPEI transfers
             "bank_account": bank_account,
             "beneficiary": beneficiary
-        }), 201
+        }
+        if not wants_minimal_response():
+            result["transaction"] = transaction_response
+        return jsonify(result), 201
         
     except requests.RequestException as e:
         error_msg = f"Error creating payin transaction: {str(e)}"
@@ -1277,11 +3115,226 @@ processed_transactions = set()
 
 # Dictionary to track webhook events and off-ramp transactions by payin transaction ID
 webhook_status_tracker = {}
+live_gauge(WEBHOOK_TRACKER_ENTRIES, lambda: len(webhook_status_tracker))
+
+class WebhookEventBuffer:
+    """
+    Write-behind buffer for webhook_events rows. add() appends the row to this process's
+    spill file (fsynced, so a crash loses nothing) and a background flusher inserts the
+    buffered rows in one statement once batch_size rows are waiting or flush_ms have passed.
+    After a successful insert the spill file is rewritten to hold only unflushed rows.
 
+    Each process holds an exclusive flock on its own spill file while it lives. When the
+    flusher starts, spill files that can be locked belong to dead processes and are replayed, so delivery
+    is at-least-once: a crash between the insert and the rewrite inserts that batch twice.
+    Workers also replay them at startup, so a worker that never receives an event still recovers them.
+
+    Transient errors are retried with backoff. When the database rejects the rows themselves
+    (see is_permanent_db_error) the batch is split until the offending rows are isolated; those
+    are appended to the dead-letter file and the rest are inserted.
+    """
+
+    DEAD_LETTER_FILE = "webhook_events.dead_letter.jsonl"
+
+    def __init__(self, spill_dir: str, batch_size: int = 50, flush_ms: float = 200, retry_max_seconds: float = 30):
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.retry_max_seconds = retry_max_seconds
+        self._pending: List[Dict] = []
+        self._in_flight: List[Dict] = []
+        self._first_pending_at = None
+        self._condition = threading.Condition()
+        self._spill_file = None
+        self._worker = None
+        self._closed = False
+
+    def add(self, row: Dict):
+        with self._condition:
+            if self._spill_file is None:
+                self._start()
+            line = json.dumps(row, separators=(",", ":"), default=str) + "\n"
+            self._spill_file.write(line)
+            self._spill_file.flush()
+            os.fsync(self._spill_file.fileno())
+            self._pending.append(row)
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            self._condition.notify_all()
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending) + len(self._in_flight)
+
+    def close(self, timeout: float = 30) -> bool:
+        """Flush everything buffered (used on shutdown); the spill file is removed once empty"""
+        with self._condition:
+            if self._spill_file is None:
+                return True
+            self._closed = True
+            self._condition.notify_all()
+            give_up_at = time.monotonic() + timeout
+            while self._pending or self._in_flight:
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    print(f"❌ {len(self._pending) + len(self._in_flight)} webhook event(s) left in {self._spill_file.name} for replay")
+                    return False
+                self._condition.wait(remaining)
+            os.unlink(self._spill_file.name)
+            self._spill_file.close()
+            self._spill_file = None
+            return True
+
+    def _start(self):
+        import fcntl
+        os.makedirs(self.spill_dir, exist_ok=True)
+        # Unique per start, so a process that reuses a dead worker's pid never takes over its file
+        name = f"webhook_events-{os.getpid()}-{uuid.uuid4().hex[:12]}.jsonl"
+        self._spill_file = open(os.path.join(self.spill_dir, name), "x+")
+        fcntl.flock(self._spill_file, fcntl.LOCK_EX)
+        self._closed = False
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="webhook-event-flusher", daemon=True)
+            self._worker.start()
+
+    def replay_orphaned_spills(self):
+        """Insert the rows left in spill files of processes that died before flushing (run when a worker starts)"""
+        import fcntl
+        if not os.path.isdir(self.spill_dir):
+            return
+        for name in sorted(os.listdir(self.spill_dir)):
+            path = os.path.join(self.spill_dir, name)
+            if not (name.startswith("webhook_events-") and name.endswith(".jsonl")):
+                continue
+            with open(path, "r+") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Owned by a live worker
+                rows = []
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        # A crash mid-write can leave a truncated last line
+                        continue
+                remaining = []
+                for start in range(0, len(rows), self.batch_size):
+                    remaining, error = self._insert(rows[start:start + self.batch_size])
+                    if error:
+                        remaining += rows[start + self.batch_size:]
+                        break
+                if remaining:
+                    # Keep only what is left for the next replay
+                    print(f"❌ Could not replay {len(remaining)} webhook event(s) from {path}: {str(error)}")
+                    f.seek(0)
+                    f.truncate()
+                    f.write("".join(json.dumps(row, separators=(",", ":"), default=str) + "\n" for row in remaining))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    continue
+                os.unlink(path)
+                if rows:
+                    print(f"♻️ Replayed {len(rows)} webhook event(s) from {path}")
+
+    def _insert(self, batch: List[Dict]):
+        """
+        Insert the batch, dead-lettering rows the database rejects outright. Returns the rows
+        still to insert and the transient error that stopped it (([], None) when done).
+        """
+        chunks = [batch]
+        while chunks:
+            rows = chunks.pop(0)
+            try:
+                transaction_store.insert_webhook_events(rows)
+            except Exception as e:
+                if not is_permanent_db_error(e):
+                    return [row for chunk in [rows] + chunks for row in chunk], e
+                if len(rows) == 1:
+                    self._dead_letter(rows[0], e)
+                else:
+                    middle = len(rows) // 2
+                    chunks[:0] = [rows[:middle], rows[middle:]]
+        return [], None
+
+    def _dead_letter(self, row: Dict, error: Exception):
+        import fcntl
+        WEBHOOK_EVENT_FLUSHES.labels("dead_letter").inc()
+        path = os.path.join(self.spill_dir, self.DEAD_LETTER_FILE)
+        print(f"☠️ Webhook event {row.get('transaction_id')} rejected by the database, moved to {path}: {str(error)}")
+        entry = {"failed_at": datetime.now().isoformat(), "error": str(error), "row": row}
+        with open(path, "a") as f:
+            # Shared by every worker
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps(entry, separators=(",", ":"), default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _run(self):
+        # Our own spill file is already locked, so only dead processes' files are replayed
+        # (again, in case a worker died since this one started)
+        self.replay_orphaned_spills()
+        retry_delay = 0
+        retry_at = 0
+        while True:
+            with self._condition:
+                while True:
+                    if not self._pending:
+                        self._condition.wait()
+                        continue
+                    if self._closed or len(self._pending) >= self.batch_size:
+                        due_at = retry_at
+                    else:
+                        due_at = max(self._first_pending_at + self.flush_interval, retry_at)
+                    remaining = due_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                self._in_flight = batch
+                self._first_pending_at = time.monotonic() if self._pending else None
+
+            with trace_span("webhook_events_flush", {"batch_size": len(batch)}):
+                remaining, error = self._insert(batch)
+            if error:
+                WEBHOOK_EVENT_FLUSHES.labels("error").inc()
+                retry_delay = min(max(retry_delay * 2, self.flush_interval), self.retry_max_seconds)
+                retry_at = time.monotonic() + retry_delay
+                print(f"❌ Failed to insert {len(remaining)} webhook event(s), retrying in {retry_delay:.1f}s: {str(error)}")
+                with self._condition:
+                    self._pending = remaining + self._pending
+                    self._in_flight = []
+                    self._first_pending_at = time.monotonic()
+                    if len(remaining) < len(batch):
+                        self._rewrite_spill()
+                    self._condition.notify_all()
+                continue
+            WEBHOOK_EVENT_FLUSHES.labels("success").inc()
+            retry_delay = retry_at = 0
+
+            with self._condition:
+                self._in_flight = []
+                self._rewrite_spill()
+                self._condition.notify_all()
+            print(f"✅ Flushed {len(batch)} webhook event(s) to database")
+
+    def _rewrite_spill(self):
+        self._spill_file.seek(0)
+        self._spill_file.truncate()
+        for row in self._pending:
+            self._spill_file.write(json.dumps(row, separators=(",", ":"), default=str) + "\n")
+        self._spill_file.flush()
+        os.fsync(self._spill_file.fileno())
+
+webhook_event_buffer = WebhookEventBuffer(
+    WEBHOOK_EVENT_SPILL_DIR, WEBHOOK_EVENT_BATCH_SIZE, WEBHOOK_EVENT_FLUSH_MS, WEBHOOK_EVENT_RETRY_MAX_SECONDS
+)
+
+@traced("save_webhook_to_database")
 def save_webhook_to_database(payload, event_type, event_resource, event_resource_status):
-    """Save webhook event to Supabase database"""
-    if not supabase:
-        print("Supabase not configured - skipping database save")
+    """Save webhook event to the database"""
+    if not database_configured():
+        print("Database not configured - skipping database save")
         return None
     
     try:
@@ -1291,9 +3344,7 @@ def save_webhook_to_database(payload, event_type, event_resource, event_resource
         # Try to find user_id by customer_id
         user_id = None
         if customer_id:
-            result = supabase.table("user_profiles").select("id").eq("unblockpay_customer_id", customer_id).execute()
-            if result.data and len(result.data) > 0:
-                user_id = result.data[0]["id"]
+            user_id = transaction_store.find_user_id_by_customer(customer_id)
         
         # Extract amounts
         sender_amount = event_resource.get("sender", {}).get("amount")
@@ -1314,9 +3365,25 @@ def save_webhook_to_database(payload, event_type, event_resource, event_resource
             "status": event_resource_status or "unknown",
             "raw_payload": payload
         }
+        resource_hash = None
+        if WEBHOOK_PAYLOAD_DEDUP:
+            # The resource is stored once; both tables keep only its hash
+            resource_hash = transaction_store.store_payload(event_resource)
+            webhook_data.update(
+                event_resource=None,
+                raw_payload={key: value for key, value in payload.items() if key != "event_resource"},
+                resource_hash=resource_hash
+            )
         
-        result = supabase.table("webhook_events").insert(webhook_data).execute()
-        print(f"✅ Saved webhook event to database - ID: {result.data[0]['id'] if result.data else 'unknown'}")
+        if WEBHOOK_EVENT_BATCHING:
+            # Stamp arrival time so rows replayed after a crash keep their original created_at
+            webhook_data["created_at"] = datetime.now().astimezone().isoformat()
+            webhook_event_buffer.add(webhook_data)
+            saved_event = None
+            print(f"✅ Queued webhook event for database ({webhook_event_buffer.pending_count()} pending)")
+        else:
+            saved_event = transaction_store.insert_webhook_event(webhook_data)
+            print(f"✅ Saved webhook event to database - ID: {saved_event['id'] if saved_event else 'unknown'}")
         
         # Create/update transaction record for user
         if user_id and transaction_id:
@@ -1330,27 +3397,20 @@ def save_webhook_to_database(payload, event_type, event_resource, event_resource
                 "local_currency": sender_currency,
                 "metadata": event_resource
             }
+            if resource_hash:
+                transaction_data.update(metadata=None, metadata_hash=resource_hash)
             
-            # Check if transaction already exists
-            existing = supabase.table("transactions").select("id").eq("unblockpay_transaction_id", transaction_id).execute()
-            
-            if existing.data and len(existing.data) > 0:
-                # Update existing
-                supabase.table("transactions").update(transaction_data).eq("unblockpay_transaction_id", transaction_id).execute()
-                print(f"✅ Updated transaction record for user {user_id}")
-            else:
-                # Create new
-                supabase.table("transactions").insert(transaction_data).execute()
-                print(f"✅ Created transaction record for user {user_id}")
+            outcome = transaction_store.upsert_transaction(transaction_data)
+            print(f"✅ {outcome.capitalize()} transaction record for user {user_id}")
         
-        return result.data[0] if result.data else None
+        return saved_event
         
     except Exception as e:
         print(f"❌ Error saving webhook to database: {str(e)}")
         return None
 
 # Add a simple test endpoint to verify webhook URL is accessible
-@app.route("/webhook/unblockpay", methods=["GET"])
+@api.route("/webhook/unblockpay", methods=["GET"])
 def test_webhook_endpoint():
     """Test endpoint to verify webhook URL is accessible"""
     print(f"GET request to webhook endpoint at {datetime.now()}")
@@ -1363,7 +3423,7 @@ def test_webhook_endpoint():
     }), 200
 
 # Webhook endpoint to handle UnblockPay events
-@app.route("/webhook/unblockpay", methods=["POST"])
+@api.route("/webhook/unblockpay", methods=["POST"])
 def handle_unblockpay_webhook():
     """Handle webhook events from UnblockPay"""
     try:
@@ -1372,12 +3432,14 @@ def handle_unblockpay_webhook():
         print(f"🔥 WEBHOOK URL: {request.url}")
         print(f"🔥 METHOD: {request.method}")
         print(f"🔥 HEADERS: {dict(request.headers)}")
-        print(f"🔥 RAW DATA: {request.get_data()}")
+        raw_body = request.get_data()
+        print(f"🔥 RAW DATA: {raw_body}")
         print(f"🔥 CONTENT-TYPE: {request.content_type}")
         print(f"🔥 REMOTE ADDRESS: {request.remote_addr}")
         print(f"🔥 USER AGENT: {request.headers.get('User-Agent', 'Unknown')}")
         print(f"🚨 WEBHOOK RECEIVED! 🚨 END 🚨\n")
         
+        # Parsed once (by the app's JSON provider) and shared with the database save and handlers below
         payload = request.get_json()
         if not payload:
             print("ERROR: No JSON payload received")
@@ -1388,12 +3450,14 @@ def handle_unblockpay_webhook():
         event_type = payload.get("event_type")
         event_resource = payload.get("event_resource", {})
         event_resource_status = payload.get("event_resource_status")
+        g.webhook_event_type = event_type
+        annotate_span(**{"webhook.event_type": event_type, "webhook.resource_id": event_resource.get("id"), "customer_id": event_resource.get("customer_id")})
         
         print(f"\n🎯 WEBHOOK DATA PARSED 🎯")
         print(f"🎯 EVENT: {event}")
         print(f"🎯 EVENT TYPE: {event_type}")
         print(f"🎯 EVENT RESOURCE STATUS: {event_resource_status}")
-        print(f"🎯 EVENT RESOURCE: {json.dumps(event_resource, indent=2)}")
+        print(f"🎯 EVENT RESOURCE: {to_log_json(event_resource)}")
         print(f"🎯 WEBHOOK DATA PARSED END 🎯\n")
         
         # Save webhook to database
@@ -1434,6 +3498,7 @@ def handle_unblockpay_webhook():
                 "payin_amount_brl": sender_amount,
                 "payin_amount_usdc": receiver_amount,
                 "customer_id": customer_id,
+                "trace_id": current_trace_id(),
                 "timestamp": datetime.now().isoformat()
             }
             
@@ -1464,14 +3529,23 @@ def handle_unblockpay_webhook():
                     }
                     send_slack_notification(transaction_data)
                 
-                # Generate new off-ramp quote for this payout
-                off_ramp_quote = create_quote(symbol="USDC/USD", quote_type="off_ramp")
+                # Hold the payin for an aggregated payout when netting is enabled
+                if payout_netting_scheduler.enabled:
+                    netting = payout_netting_scheduler.add(customer_id, external_account_id, transaction_id, receiver_amount)
+                    webhook_status_tracker[transaction_id]["offramp_netting"] = netting
+                    return jsonify({"status": "queued", "netting": netting}), 200
+                
+                # Start the bonus transfer now so it overlaps with the quote and wallet lookups
+                bonus_future = start_bonus_transfer(customer_id)
+                
+                # Get an off-ramp quote for this payout (shared from the quote pool when enabled)
+                off_ramp_quote = get_payout_quote()
                 if not off_ramp_quote:
                     print("Failed to create off-ramp quote")
                     return jsonify({"status": "error", "message": "Failed to create quote"}), 500
                 
                 off_ramp_quote_id = off_ramp_quote.get("id")
-                print(f"Created new off-ramp quote ID: {off_ramp_quote_id}")
+                print(f"Using off-ramp quote ID: {off_ramp_quote_id}")
                 
                 # Use the USDC amount received from the payin for the off-ramp
                 usdc_amount = receiver_amount
@@ -1481,24 +3555,29 @@ def handle_unblockpay_webhook():
                     amount=usdc_amount,
                     quote_id=off_ramp_quote["id"],
                     customer_id=customer_id,
-                    external_account_id=external_account_id
+                    external_account_id=external_account_id,
+                    bonus_future=bonus_future
                 )              
                 if payout_result:
                     payout_id = payout_result.get('id')
                     print(f"Successfully created off-ramp payout: {payout_id}")
                     
                     # Update webhook status tracker with off-ramp transaction info
+                    annotate_span(payout_id=payout_id)
                     webhook_status_tracker[transaction_id]["offramp_transaction"] = {
                         "id": payout_id,
                         "status": "processing",
                         "amount": usdc_amount,
                         "currency": "USD",
+                        "trace_id": current_trace_id(),
                         "created_at": datetime.now().isoformat()
                     }
                     
                     return jsonify({"status": "success", "payout_id": payout_id}), 200
                 else:
                     print("Failed to create off-ramp payout")
+                    # Don't hand a quote the payout API may have rejected to the next payout
+                    off_ramp_quote_pool.invalidate(quote_id=off_ramp_quote_id)
                     return jsonify({"status": "error", "message": "Failed to create payout"}), 500
                     
             except Exception as e:
@@ -1512,7 +3591,7 @@ def handle_unblockpay_webhook():
             
             if not transaction_id:
                 print(f"WARNING: payin.created webhook missing transaction ID")
-                print(f"Event resource: {json.dumps(event_resource, indent=2)}")
+                print(f"Event resource: {to_log_json(event_resource)}")
             
             # Store the transaction creation event
             webhook_status_tracker[transaction_id] = {
@@ -1531,51 +3610,59 @@ def handle_unblockpay_webhook():
             transaction_id = event_resource.get("id")
             print(f"Off-ramp payout completed - Transaction ID: {transaction_id}")
             
-            # Find the payin transaction that triggered this payout
-            payin_transaction_id = None
-            for payin_id, status_data in webhook_status_tracker.items():
-                if status_data.get("offramp_transaction", {}).get("id") == transaction_id:
-                    payin_transaction_id = payin_id
-                    break
+            # Find the payin transaction that triggered this payouts (several when the payout was netted)
+            payin_transaction_ids = [
+                payin_id for payin_id, status_data in webhook_status_tracker.items()
+                if status_data.get("offramp_transaction", {}).get("id") == transaction_id
+            ]
             
-            if payin_transaction_id:
-                webhook_status_tracker[payin_transaction_id]["offramp_completed"] = True
-                webhook_status_tracker[payin_transaction_id]["offramp_transaction"]["status"] = "completed"
-                print(f"Updated webhook status for payin transaction: {payin_transaction_id}")
+            if payin_transaction_ids:
+                for payin_transaction_id in payin_transaction_ids:
+                    webhook_status_tracker[payin_transaction_id]["offramp_completed"] = True
+                    webhook_status_tracker[payin_transaction_id]["offramp_transaction"]["status"] = "completed"
+                    # Tie this event to the trace of the payout request it settles
+                    annotate_span(**{"payin.transaction_id": payin_transaction_id, "payout.trace_id": webhook_status_tracker[payin_transaction_id]["offramp_transaction"].get("trace_id")})
+                    print(f"Updated webhook status for payin transaction: {payin_transaction_id}")
             else:
                 print(f"WARNING: payout.completed webhook for unknown transaction ID: {transaction_id}")
-                print(f"Current tracked payin transactions: {list(webhook_status_tracker.keys())}")
-                print(f"Event resource: {json.dumps(event_resource, indent=2)}")
+                print(f"Current tracked payin transactions: {len(webhook_status_tracker)}")
+                print(f"Event resource: {to_log_json(event_resource)}")
             
         elif event_type == "payout.failed":
             transaction_id = event_resource.get("id")
             print(f"Off-ramp transaction failed - Transaction ID: {transaction_id}")
             
-            # Find the corresponding payin transaction
-            payin_transaction_id = None
-            for payin_id, status_data in webhook_status_tracker.items():
-                if status_data.get("offramp_transaction", {}).get("id") == transaction_id:
-                    payin_transaction_id = payin_id
-                    break
+            # Find the corresponding payin transactions (several when the payout was netted)
+            payin_transaction_ids = [
+                payin_id for payin_id, status_data in webhook_status_tracker.items()
+                if status_data.get("offramp_transaction", {}).get("id") == transaction_id
+            ]
             
-            if payin_transaction_id:
-                webhook_status_tracker[payin_transaction_id]["offramp_failed"] = True
-                webhook_status_tracker[payin_transaction_id]["offramp_transaction"]["status"] = "failed"
-                print(f"Updated webhook status for payin transaction: {payin_transaction_id}")
+            if payin_transaction_ids:
+                for payin_transaction_id in payin_transaction_ids:
+                    webhook_status_tracker[payin_transaction_id]["offramp_failed"] = True
+                    webhook_status_tracker[payin_transaction_id]["offramp_transaction"]["status"] = "failed"
+                    # Tie this event to the trace of the payout request it settles
+                    annotate_span(**{"payin.transaction_id": payin_transaction_id, "payout.trace_id": webhook_status_tracker[payin_transaction_id]["offramp_transaction"].get("trace_id")})
+                    print(f"Updated webhook status for payin transaction: {payin_transaction_id}")
             else:
                 print(f"WARNING: payout.failed webhook for unknown transaction ID: {transaction_id}")
-                print(f"Current tracked payin transactions: {list(webhook_status_tracker.keys())}")
-                print(f"Event resource: {json.dumps(event_resource, indent=2)}")
+                print(f"Current tracked payin transactions: {len(webhook_status_tracker)}")
+                print(f"Event resource: {to_log_json(event_resource)}")
         
         else:
             # Handle unknown event types
             print(f"WARNING: Unknown webhook event type: {event_type}")
-            print(f"Event resource: {json.dumps(event_resource, indent=2)}")
+            print(f"Event resource: {to_log_json(event_resource)}")
             
         # Always return success to acknowledge webhook receipt
         print(f"\n✅ WEBHOOK PROCESSING COMPLETE ✅")
         print(f"✅ EVENT TYPE PROCESSED: {event_type}")
-        print(f"✅ CURRENT WEBHOOK STATUS TRACKER: {json.dumps(webhook_status_tracker, indent=2)}")
+        # Only this event's entry - dumping the whole tracker grows with every payin ever seen
+        tracked = webhook_status_tracker.get(event_resource.get("id"))
+        if tracked is not None:
+            print(f"✅ WEBHOOK STATUS FOR {event_resource.get('id')}: {to_log_json(tracked)}")
+        print(f"✅ TRACKED TRANSACTIONS: {len(webhook_status_tracker)}")
         print(f"✅ WEBHOOK PROCESSING COMPLETE END ✅\n")
         return jsonify({"status": "success", "event_type": event_type}), 200
         
@@ -1588,7 +3675,7 @@ def handle_unblockpay_webhook():
         # Still return 200 to avoid webhook retries
         return jsonify({"status": "error", "message": error_msg}), 200
 
-@app.route("/api/webhook-status/<transaction_id>", methods=["GET"])
+@api.route("/api/webhook-status/<transaction_id>", methods=["GET"])
 def get_webhook_status(transaction_id):
     """Get webhook status for a specific transaction ID"""
     try:
@@ -1607,124 +3694,138 @@ def get_webhook_status(transaction_id):
         error_msg = f"Error getting webhook status: {str(e)}"
         print(error_msg)
         
-        # Return proper JSON error response
-        return jsonify({"error": error_msg}), 500
+        # Return proper JSON error response
+        return jsonify({"error": error_msg}), 500
+
+def group_webhook_events(raw_transactions: List[Dict]) -> List[Dict]:
+    """
+    Collapse a customer's webhook events (newest first) into user-facing transactions: events
+    within $10.20 (the payout bonus) and 5 minutes of a group's newest event belong to it.
+    Mirrored in SQL by public.user_transaction_summary (user-transaction-summary-function.sql).
+    """
+    # Group transactions by similar amount and time proximity
+    grouped_transactions = []
+    used_indices = set()
+    
+    for i, t1 in enumerate(raw_transactions):
+        if i in used_indices:
+            continue
+            
+        # Start a new transaction group
+        # Map webhook_events fields to transaction fields
+        event_type = t1.get("event_type", "")
+        tx_type = "payin" if "payin" in event_type else "payout"
+        
+        group = {
+            "id": t1.get("id"),
+            "unblockpay_transaction_id": t1.get("transaction_id"),
+            "amount_usd": float(t1.get("amount_usd", 0)),
+            "amount_local": t1.get("amount_local"),
+            "local_currency": t1.get("local_currency"),
+            "created_at": t1.get("created_at"),
+            "updated_at": t1.get("updated_at") or t1.get("created_at"),
+            "recipient": None,
+            "reference": None,
+            "statuses": [t1.get("status")],
+            "types": [tx_type],
+            "all_transactions": [t1]
+        }
+        used_indices.add(i)
+        
+        t1_time = datetime.fromisoformat(t1.get("created_at").replace('Z', '+00:00'))
+        t1_amount = float(t1.get("amount_usd", 0))
+        
+        # Find related transactions (within $10.20 and 5 minutes) - check all transactions
+        for j, t2 in enumerate(raw_transactions):
+            if j in used_indices or j == i:
+                continue
+            
+            t2_time = datetime.fromisoformat(t2.get("created_at").replace('Z', '+00:00'))
+            t2_amount = float(t2.get("amount_usd", 0))
+            
+            # Check if amounts are within $10.20 (to account for $10 bonus) and times are within 5 minutes
+            amount_diff = abs(t1_amount - t2_amount)
+            time_diff = abs((t1_time - t2_time).total_seconds())
+            
+            if amount_diff <= 10.20 and time_diff <= 300:  # $10.20 and 5 minutes
+                group["statuses"].append(t2.get("status"))
+                group["types"].append(t2.get("type"))
+                group["all_transactions"].append(t2)
+                group["updated_at"] = max(group["updated_at"], t2.get("updated_at") or t2.get("created_at"))
+                used_indices.add(j)
+        
+        # Determine overall status based on the most recent transaction status
+        # Sort transactions by updated_at to get the most recent status
+        sorted_txs = sorted(group["all_transactions"], key=lambda x: x.get("updated_at", ""), reverse=True)
+        most_recent_status = sorted_txs[0].get("status") if sorted_txs else "unknown"
+        
+        # Find the highest USD amount in the group (to show payout amount with $10 bonus)
+        max_usd_amount = max(float(tx.get("amount_usd", 0)) for tx in group["all_transactions"])
+        group["amount_usd"] = max_usd_amount
+        
+        statuses = group["statuses"]
+        # Priority: failed > most_recent > completed (all) > processing > awaiting_deposit > pending
+        if "failed" in statuses:
+            group["status"] = "failed"
+        elif most_recent_status in ["completed", "processing", "awaiting_deposit", "pending"]:
+            group["status"] = most_recent_status
+        elif "completed" in statuses and len([s for s in statuses if s == "completed"]) == len(statuses):
+            group["status"] = "completed"
+        elif "processing" in statuses:
+            group["status"] = "processing"
+        elif "awaiting_deposit" in statuses:
+            group["status"] = "awaiting_deposit"
+        elif "pending" in statuses:
+            group["status"] = "pending"
+        else:
+            group["status"] = statuses[0] if statuses else "unknown"
+        
+        # Clean up temporary fields
+        del group["statuses"]
+        del group["types"]
+        del group["all_transactions"]
+        
+        grouped_transactions.append(group)
+    
+    return grouped_transactions
+
+def summarize_transaction_groups(grouped_transactions: List[Dict]) -> Dict:
+    """Dashboard totals over grouped transactions"""
+    return {
+        "total_sent": sum(float(t["amount_usd"]) for t in grouped_transactions),
+        "total_completed": sum(float(t["amount_usd"]) for t in grouped_transactions if t["status"] == "completed"),
+        "total_pending": sum(float(t["amount_usd"]) for t in grouped_transactions if t["status"] in ["pending", "processing", "awaiting_deposit"]),
+        "transaction_count": len(grouped_transactions)
+    }
 
-@app.route("/api/user-transactions/<user_id>", methods=["GET"])
+@api.route("/api/user-transactions/<user_id>", methods=["GET"])
 def get_user_transactions(user_id):
     """Get all transactions for a specific user from Supabase, grouped by amount and time"""
     try:
-        if not supabase:
+        if not database_configured():
             return jsonify({"error": "Database not configured"}), 500
         
         print(f"Fetching transactions for user: {user_id}")
         
         # Get user's unblockpay_customer_id
-        user_profile = supabase.table("user_profiles").select("unblockpay_customer_id").eq("id", user_id).execute()
+        user_profile = transaction_store.find_customer_id_for_user(user_id)
         
-        if not user_profile.data or len(user_profile.data) == 0:
+        if not user_profile:
             print(f"No user profile found for user_id: {user_id}")
             return jsonify({"transactions": [], "summary": {"total_sent": 0, "total_completed": 0, "total_pending": 0, "transaction_count": 0}}), 200
         
-        customer_id = user_profile.data[0].get("unblockpay_customer_id")
+        customer_id = user_profile.get("unblockpay_customer_id")
         print(f"User's unblockpay_customer_id: {customer_id}")
         
         # Query webhook_events table by customer_id
-        result = supabase.table("webhook_events").select("*").eq("customer_id", customer_id).order("created_at", desc=True).execute()
-        
-        raw_transactions = result.data if result.data else []
+        raw_transactions = transaction_store.list_webhook_events(customer_id)
         print(f"Found {len(raw_transactions)} webhook events for customer_id: {customer_id}")
         
-        from datetime import datetime, timedelta
-        
-        # Group transactions by similar amount and time proximity
-        grouped_transactions = []
-        used_indices = set()
-        
-        for i, t1 in enumerate(raw_transactions):
-            if i in used_indices:
-                continue
-                
-            # Start a new transaction group
-            # Map webhook_events fields to transaction fields
-            event_type = t1.get("event_type", "")
-            tx_type = "payin" if "payin" in event_type else "payout"
-            
-            group = {
-                "id": t1.get("id"),
-                "unblockpay_transaction_id": t1.get("transaction_id"),
-                "amount_usd": float(t1.get("amount_usd", 0)),
-                "amount_local": t1.get("amount_local"),
-                "local_currency": t1.get("local_currency"),
-                "created_at": t1.get("created_at"),
-                "updated_at": t1.get("updated_at") or t1.get("created_at"),
-                "recipient": None,
-                "reference": None,
-                "statuses": [t1.get("status")],
-                "types": [tx_type],
-                "all_transactions": [t1]
-            }
-            used_indices.add(i)
-            
-            t1_time = datetime.fromisoformat(t1.get("created_at").replace('Z', '+00:00'))
-            t1_amount = float(t1.get("amount_usd", 0))
-            
-            # Find related transactions (within $10.20 and 5 minutes) - check all transactions
-            for j, t2 in enumerate(raw_transactions):
-                if j in used_indices or j == i:
-                    continue
-                
-                t2_time = datetime.fromisoformat(t2.get("created_at").replace('Z', '+00:00'))
-                t2_amount = float(t2.get("amount_usd", 0))
-                
-                # Check if amounts are within $10.20 (to account for $10 bonus) and times are within 5 minutes
-                amount_diff = abs(t1_amount - t2_amount)
-                time_diff = abs((t1_time - t2_time).total_seconds())
-                
-                if amount_diff <= 10.20 and time_diff <= 300:  # $10.20 and 5 minutes
-                    group["statuses"].append(t2.get("status"))
-                    group["types"].append(t2.get("type"))
-                    group["all_transactions"].append(t2)
-                    group["updated_at"] = max(group["updated_at"], t2.get("updated_at"))
-                    used_indices.add(j)
-            
-            # Determine overall status based on the most recent transaction status
-            # Sort transactions by updated_at to get the most recent status
-            sorted_txs = sorted(group["all_transactions"], key=lambda x: x.get("updated_at", ""), reverse=True)
-            most_recent_status = sorted_txs[0].get("status") if sorted_txs else "unknown"
-            
-            # Find the highest USD amount in the group (to show payout amount with $10 bonus)
-            max_usd_amount = max(float(tx.get("amount_usd", 0)) for tx in group["all_transactions"])
-            group["amount_usd"] = max_usd_amount
-            
-            statuses = group["statuses"]
-            # Priority: failed > most_recent > completed (all) > processing > awaiting_deposit > pending
-            if "failed" in statuses:
-                group["status"] = "failed"
-            elif most_recent_status in ["completed", "processing", "awaiting_deposit", "pending"]:
-                group["status"] = most_recent_status
-            elif "completed" in statuses and len([s for s in statuses if s == "completed"]) == len(statuses):
-                group["status"] = "completed"
-            elif "processing" in statuses:
-                group["status"] = "processing"
-            elif "awaiting_deposit" in statuses:
-                group["status"] = "awaiting_deposit"
-            elif "pending" in statuses:
-                group["status"] = "pending"
-            else:
-                group["status"] = statuses[0] if statuses else "unknown"
-            
-            # Clean up temporary fields
-            del group["statuses"]
-            del group["types"]
-            del group["all_transactions"]
-            
-            grouped_transactions.append(group)
-        
-        # Calculate totals based on unique transaction groups
-        total_sent = sum(float(t["amount_usd"]) for t in grouped_transactions)
-        total_completed = sum(float(t["amount_usd"]) for t in grouped_transactions if t["status"] == "completed")
-        total_pending = sum(float(t["amount_usd"]) for t in grouped_transactions if t["status"] in ["pending", "processing", "awaiting_deposit"])
+        grouped_transactions = group_webhook_events(raw_transactions)
+        summary = summarize_transaction_groups(grouped_transactions)
+        total_sent = summary["total_sent"]
+        total_completed = summary["total_completed"]
+        total_pending = summary["total_pending"]
         
         print(f"Found {len(grouped_transactions)} unique transaction groups for user {user_id}")
         print(f"Total sent: ${total_sent}, Completed: ${total_completed}, Pending: ${total_pending}")
@@ -1739,12 +3840,7 @@ def get_user_transactions(user_id):
         
         return jsonify({
             "transactions": grouped_transactions,
-            "summary": {
-                "total_sent": total_sent,
-                "total_completed": total_completed,
-                "total_pending": total_pending,
-                "transaction_count": len(grouped_transactions)
-            }
+            "summary": summary
         }), 200
         
     except Exception as e:
@@ -1752,6 +3848,546 @@ def get_user_transactions(user_id):
         print(error_msg)
         return jsonify({"error": error_msg}), 500
 
+# Cleared when the summary function turns out not to exist, so later requests skip straight to Python
+_summary_rpc_available = TRANSACTION_SUMMARY_RPC
+
+@api.route("/api/user-transactions/<user_id>/summary", methods=["GET"])
+def get_user_transaction_summary(user_id):
+    """
+    Dashboard totals for a user without transferring their events: computed by the
+    user_transaction_summary database function, or in Python when it is unavailable
+    """
+    global _summary_rpc_available
+    if not database_configured():
+        return jsonify({"error": "Database not configured"}), 500
+
+    try:
+        uuid.UUID(user_id)
+    except ValueError:
+        return jsonify({"error": "user_id must be a UUID"}), 400
+
+    if _summary_rpc_available:
+        try:
+            totals = transaction_store.transaction_summary(user_id)
+            summary = {
+                "total_sent": float(totals["total_sent"]),
+                "total_completed": float(totals["total_completed"]),
+                "total_pending": float(totals["total_pending"]),
+                "transaction_count": int(totals["transaction_count"])
+            }
+            return jsonify({"summary": summary, "source": "database"}), 200
+        except Exception as e:
+            # Function missing: PostgREST reports PGRST202, Postgres undefined_function (42883)
+            if db_error_code(e) in ("PGRST202", "42883"):
+                print("WARNING: user_transaction_summary function not found - run user-transaction-summary-function.sql")
+                _summary_rpc_available = False
+            else:
+                print(f"❌ user_transaction_summary failed, computing in Python: {str(e)}")
+
+    try:
+        user_profile = transaction_store.find_customer_id_for_user(user_id)
+        if not user_profile:
+            return jsonify({"summary": summarize_transaction_groups([]), "source": "python"}), 200
+        raw_transactions = transaction_store.list_webhook_events(user_profile.get("unblockpay_customer_id"))
+        summary = summarize_transaction_groups(group_webhook_events(raw_transactions))
+        return jsonify({"summary": summary, "source": "python"}), 200
+    except Exception as e:
+        error_msg = f"Error computing transaction summary: {str(e)}"
+        print(error_msg)
+        return jsonify({"error": error_msg}), 500
+
+def admin_token_valid() -> bool:
+    """Whether the request carries the admin API token (always False when none is configured)"""
+    if not ADMIN_API_TOKEN:
+        return False
+    auth_header = request.headers.get("Authorization", "")
+    token = request.headers.get("X-Admin-Token") or (auth_header[7:] if auth_header.startswith("Bearer ") else "")
+    return bool(token) and hmac.compare_digest(token, ADMIN_API_TOKEN)
+
+def require_admin_token():
+    """Return an error response unless the request carries the admin API token"""
+    if not ADMIN_API_TOKEN:
+        return jsonify({"error": "Admin API is disabled - set ADMIN_API_TOKEN to enable it"}), 403
+    if not admin_token_valid():
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+@api.route("/api/admin/circuit-breakers", methods=["GET"])
+def get_circuit_breaker_stats():
+    """Report state, trips, fast-fail rejections and retries for each UnblockPay endpoint"""
+    auth_error = require_admin_token()
+    if auth_error:
+        return auth_error
+
+    with _circuit_breakers_lock:
+        breakers = dict(circuit_breakers)
+    stats = {endpoint: breaker.stats() for endpoint, breaker in breakers.items()}
+    stats["rate_limits"] = {
+        name: {"rate": bucket.rate, "burst": bucket.burst, "throttled": bucket.throttled, "shared": bool(bucket.state_path)}
+        for name, bucket in rate_limit_buckets.items()
+    }
+    return jsonify(stats), 200
+
+# Baseline tracemalloc snapshot that growth deltas are computed against
+_memory_baseline = None
+_memory_baseline_taken_at = None
+_memory_lock = threading.Lock()
+
+# Noise from the tracer itself and the import system
+TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this worker process (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def cached_object_counts() -> Dict[str, int]:
+    """Sizes of the module-level caches and trackers that grow with traffic"""
+    with _circuit_breakers_lock:
+        breaker_count = len(circuit_breakers)
+    return {
+        "webhook_status_tracker": len(webhook_status_tracker),
+        "processed_transactions": len(processed_transactions),
+        "offramp_quote_pool": len(off_ramp_quote_pool.stats()["quotes"]),
+        "payout_netting_buckets": payout_netting_scheduler.pending_count(),
+        "bonus_transfers_pending": bonus_transfer_queue.pending_count(),
+        "webhook_event_buffer": webhook_event_buffer.pending_count(),
+        "wallet_provisioning_jobs": wallet_provisioner.count(),
+        "circuit_breakers": breaker_count,
+    }
+
+# The tracker, netting and bonus queue already have their own gauges
+for _cache in ("processed_transactions", "offramp_quote_pool", "wallet_provisioning_jobs", "webhook_event_buffer", "circuit_breakers"):
+    live_gauge(CACHED_OBJECTS.labels(_cache), lambda cache=_cache: cached_object_counts()[cache])
+live_gauge(TRACEMALLOC_TRACED_BYTES, lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0)
+
+def format_memory_stat(stat) -> Dict:
+    """JSON-friendly view of a tracemalloc Statistic or StatisticDiff"""
+    entry = {
+        "site": str(stat.traceback[0]),
+        "size_bytes": stat.size,
+        "count": stat.count,
+    }
+    if len(stat.traceback) > 1:
+        entry["traceback"] = [str(frame) for frame in stat.traceback]
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry["size_diff_bytes"] = stat.size_diff
+        entry["count_diff"] = stat.count_diff
+    return entry
+
+@api.route("/api/admin/memory", methods=["GET"])
+def get_memory_report():
+    """
+    Report RSS, cache sizes and the top tracemalloc allocation sites, plus growth since the
+    baseline snapshot. Query params: limit (default 20), group_by (lineno|filename|traceback)
+    and rebase=true to make this snapshot the new baseline after diffing.
+    """
+    global _memory_baseline, _memory_baseline_taken_at
+    auth_error = require_admin_token()
+    if auth_error:
+        return auth_error
+
+    limit = min(request.args.get("limit", 20, type=int), 200)
+    group_by = request.args.get("group_by", "lineno")
+    if group_by not in ("lineno", "filename", "traceback"):
+        return jsonify({"error": "group_by must be lineno, filename or traceback"}), 400
+
+    report = {
+        "pid": os.getpid(),
+        "rss_bytes": current_rss_bytes(),
+        "gc_counts": gc.get_count(),
+        "cached_objects": cached_object_counts(),
+        "tracemalloc": {"tracing": tracemalloc.is_tracing()}
+    }
+    if not tracemalloc.is_tracing():
+        report["tracemalloc"]["message"] = "Not tracing - POST /api/admin/memory/snapshot to start"
+        return jsonify(report), 200
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS)
+    traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    report["tracemalloc"].update({
+        "frames": tracemalloc.get_traceback_limit(),
+        "traced_bytes": traced_bytes,
+        "peak_bytes": peak_bytes,
+        "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+        "top": [format_memory_stat(stat) for stat in snapshot.statistics(group_by)[:limit]]
+    })
+
+    with _memory_lock:
+        if _memory_baseline is not None:
+            growth = [stat for stat in snapshot.compare_to(_memory_baseline, group_by) if stat.size_diff > 0]
+            report["tracemalloc"]["baseline_taken_at"] = _memory_baseline_taken_at
+            report["tracemalloc"]["growth"] = [format_memory_stat(stat) for stat in growth[:limit]]
+        if request.args.get("rebase", "false").lower() == "true":
+            _memory_baseline = snapshot
+            _memory_baseline_taken_at = datetime.now().isoformat()
+
+    return jsonify(report), 200
+
+@api.route("/api/admin/memory/snapshot", methods=["POST", "DELETE"])
+def memory_snapshot():
+    """POST starts tracemalloc if needed and takes a baseline snapshot; DELETE stops tracing"""
+    global _memory_baseline, _memory_baseline_taken_at
+    auth_error = require_admin_token()
+    if auth_error:
+        return auth_error
+
+    with _memory_lock:
+        if request.method == "DELETE":
+            _memory_baseline = None
+            _memory_baseline_taken_at = None
+            tracemalloc.stop()
+            print("🧠 tracemalloc stopped")
+            return jsonify({"tracing": False}), 200
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            print(f"🧠 tracemalloc started ({TRACEMALLOC_FRAMES} frames)")
+        _memory_baseline = tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS)
+        _memory_baseline_taken_at = datetime.now().isoformat()
+
+    return jsonify({
+        "tracing": True,
+        "baseline_taken_at": _memory_baseline_taken_at,
+        "traced_bytes": tracemalloc.get_traced_memory()[0],
+        "rss_bytes": current_rss_bytes()
+    }), 200
+
+# Columns written (in order) for CSV exports; NDJSON exports include every column
+EXPORT_COLUMNS = {
+    "webhook_events": [
+        "id", "created_at", "event_type", "event_resource_status", "status", "transaction_id",
+        "customer_id", "user_id", "amount_usd", "amount_local", "local_currency",
+        "event_resource", "raw_payload"
+    ],
+    "transactions": [
+        "id", "created_at", "updated_at", "user_id", "unblockpay_transaction_id", "type", "status",
+        "amount_usd", "amount_local", "local_currency", "recipient", "reference",
+        "quote_id", "payin_id", "payout_id", "metadata"
+    ]
+}
+
+def iter_export_rows(table: str, since: Optional[str] = None, until: Optional[str] = None,
+                     customer_id: Optional[str] = None, user_ids: Optional[list] = None):
+    """
+    Yield rows from an export table in (created_at, id) order using keyset pagination.
+    Only one page of EXPORT_PAGE_SIZE rows is held in memory at a time.
+    """
+    cursor = None
+    while True:
+        rows = transaction_store.export_page(table, since, until, customer_id, user_ids, cursor, EXPORT_PAGE_SIZE)
+        rows = hydrate_payloads(table, rows)
+
+        for row in rows:
+            yield row
+
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        cursor = (rows[-1]["created_at"], rows[-1]["id"])
+
+def _parse_export_timestamp(value: Optional[str]) -> Optional[str]:
+    """Validate an ISO-8601 export bound and return it normalized"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).isoformat()
+
+@api.route("/api/admin/export/<table>", methods=["GET"])
+def export_table(table):
+    """
+    Stream webhook_events or transactions as NDJSON (default) or CSV.
+    Query params: format=ndjson|csv, since/until (ISO-8601 on created_at), customer_id, user_id
+    """
+    auth_error = require_admin_token()
+    if auth_error:
+        return auth_error
+
+    if table not in EXPORT_COLUMNS:
+        return jsonify({"error": f"table must be one of: {', '.join(EXPORT_COLUMNS)}"}), 400
+    if not database_configured():
+        return jsonify({"error": "Database not configured"}), 500
+
+    export_format = request.args.get("format", "ndjson").lower()
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+
+    try:
+        since = _parse_export_timestamp(request.args.get("since"))
+        until = _parse_export_timestamp(request.args.get("until"))
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO-8601 timestamps"}), 400
+
+    customer_id = request.args.get("customer_id")
+    user_id = request.args.get("user_id")
+    user_ids = [user_id] if user_id else None
+
+    if customer_id and table == "transactions":
+        # transactions are keyed by user, so map the UnblockPay customer to its user profile(s)
+        profile_ids = transaction_store.find_user_ids_by_customer(customer_id)
+        user_ids = [uid for uid in profile_ids if uid in user_ids] if user_ids is not None else profile_ids
+        customer_id = None
+
+    print(f"📦 Exporting {table} as {export_format} (since={since}, until={until}, customer_id={customer_id}, user_ids={user_ids})")
+
+    def generate():
+        row_count = 0
+        try:
+            if export_format == "csv":
+                columns = EXPORT_COLUMNS[table]
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                for row in iter_export_rows(table, since, until, customer_id, user_ids):
+                    writer.writerow([
+                        json.dumps(row.get(column)) if isinstance(row.get(column), (dict, list)) else row.get(column)
+                        for column in columns
+                    ])
+                    row_count += 1
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate(0)
+                if row_count == 0:
+                    yield buffer.getvalue()
+            else:
+                for row in iter_export_rows(table, since, until, customer_id, user_ids):
+                    row_count += 1
+                    yield json.dumps(row, separators=(",", ":")) + "\n"
+        except Exception as e:
+            # The 200 status is already sent: write an error trailer, then re-raise so the chunked
+            # response is aborted without its final chunk and the client sees a truncated transfer
+            print(f"❌ Export of {table} failed after {row_count} rows: {str(e)}")
+            error = f"Export failed after {row_count} rows: {str(e)}"
+            if export_format == "csv":
+                yield f"# ERROR: {error}\n"
+            else:
+                yield json.dumps({"error": error}, separators=(",", ":")) + "\n"
+            raise
+        print(f"✅ Exported {row_count} rows from {table}")
+
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{table}-export.{export_format}"'}
+    )
+
+class OnboardingIndex:
+    """
+    Existing customers (by identity document) and external accounts (by routing and account
+    number), fetched once per bulk batch instead of a full-list scan for every row.
+    """
+
+    def __init__(self):
+        headers = {"Authorization": AUTH_TOKEN, "Content-Type": "application/json"}
+        customers_response = unblockpay_request("GET", f"{BASE_URL}/customers", headers=headers)
+        customers_response.raise_for_status()
+        accounts_response = unblockpay_request("GET", f"{BASE_URL}/external-accounts", headers=headers)
+        accounts_response.raise_for_status()
+
+        self.customers_by_document: Dict[str, Dict] = {}
+        for customer in customers_response.json():
+            for doc in customer.get("identity_documents", []):
+                if doc.get("value"):
+                    self.customers_by_document.setdefault(doc["value"], customer)
+
+        self.external_accounts: Dict[tuple, str] = {
+            (account.get("routing_number"), account.get("bank_account_number")): account.get("id")
+            for account in accounts_response.json()
+        }
+        self._account_locks: Dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        print(f"🔍 Onboarding index: {len(self.customers_by_document)} customer document(s), {len(self.external_accounts)} external account(s)")
+
+    def account_lock(self, key: tuple) -> threading.Lock:
+        """Serializes rows sharing a bank account so it is only created once"""
+        with self._lock:
+            return self._account_locks.setdefault(key, threading.Lock())
+
+def read_bulk_onboarding_records() -> List[Dict]:
+    """Raw rows of the batch: a multipart "file" upload, or a CSV / JSONL request body"""
+    upload = request.files.get("file")
+    if upload:
+        text = upload.read().decode("utf-8-sig")
+        is_jsonl = (upload.filename or "").endswith((".jsonl", ".ndjson"))
+    else:
+        text = request.get_data(as_text=True)
+        is_jsonl = request.mimetype in ("application/x-ndjson", "application/jsonl", "application/json")
+
+    if is_jsonl:
+        records = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"line {line_number} is not valid JSON: {str(e)}")
+            if not isinstance(record, dict):
+                raise ValueError(f"line {line_number} is not a JSON object")
+            records.append(record)
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+
+    # Blank CSV cells count as missing, and columns beyond the header are dropped
+    return [
+        {key: value.strip() if isinstance(value, str) else value for key, value in record.items()
+         if key is not None and value not in ("", None)}
+        for record in records
+    ]
+
+def onboard_row(line_number: int, row: "request_schemas.BulkOnboardingRow", index: OnboardingIndex, span_context) -> Dict:
+    """Create (or reuse) the customer, wallet and external account for one batch row"""
+    result = {
+        "row": line_number, "id": row.id, "status": "success",
+        "customer_id": None, "customer_created": False,
+        "wallet_id": None, "wallet_address": None, "wallet_created": False,
+        "external_account_id": None, "external_account_created": False,
+        "error": None
+    }
+    started = time.perf_counter()
+    # Batch work yields outbound rate-limit tokens to interactive signups and webhooks
+    with trace_span("bulk_onboarding_row", {"row": line_number}, span_links([span_context])), upstream_priority("low"):
+        try:
+            existing_customer = index.customers_by_document.get(row.document_value)
+            if existing_customer:
+                result["customer_id"] = existing_customer["id"]
+                wallet = fetch_customer_wallet(result["customer_id"])
+            else:
+                customer = create_individual_customer(
+                    first_name=row.first_name,
+                    last_name=row.last_name,
+                    email=row.email,
+                    phone_number=row.phone_number,
+                    date_of_birth=row.date_of_birth,
+                    document_type=row.document_type,
+                    document_value=row.document_value,
+                    document_country=row.document_country,
+                    street_line_1=row.street_line_1,
+                    street_line_2=row.street_line_2,
+                    city=row.city,
+                    state=row.state,
+                    postal_code=row.postal_code,
+                    country=row.country
+                )
+                if not customer.get("id"):
+                    raise ValueError("Failed to create customer: No customer ID returned")
+                result.update(customer_id=customer["id"], customer_created=True)
+                wallet = None
+
+            if not wallet:
+                wallet = create_wallet(customer_id=result["customer_id"], name=f"{row.first_name}'s Wallet", blockchain="solana")
+                if not wallet.get("id"):
+                    raise ValueError("Failed to create wallet: No wallet ID returned")
+                result["wallet_created"] = True
+            result.update(wallet_id=wallet.get("id"), wallet_address=wallet.get("address"))
+
+            if row.has_bank_account:
+                key = (row.routing_number, row.bank_account_number)
+                with index.account_lock(key):
+                    external_account_id = index.external_accounts.get(key)
+                    if not external_account_id:
+                        full_name = f"{row.first_name} {row.last_name}"
+                        account = create_external_account(
+                            customer_id=result["customer_id"],
+                            account_name=row.account_name or full_name,
+                            beneficiary_name=row.beneficiary_name or full_name,
+                            bank_name=row.bank_name,
+                            bank_account_number=row.bank_account_number,
+                            routing_number=row.routing_number,
+                            address=row.address
+                        )
+                        external_account_id = account.get("id")
+                        index.external_accounts[key] = external_account_id
+                        result["external_account_created"] = True
+                result["external_account_id"] = external_account_id
+        except Exception as e:
+            result.update(status="failed", error=str(e))
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+@api.route("/api/admin/bulk-onboarding", methods=["POST"])
+def bulk_onboard():
+    """
+    Onboard a cohort from a CSV (with header) or JSONL batch, sent as the request body or a
+    multipart "file". Each row needs the customer fields of request_schemas.BulkOnboardingRow; bank_name,
+    bank_account_number and routing_number add a US wire external account.
+    Existing customers (same identity document) and accounts are reused, so a batch can be
+    re-sent after partial failures. Streams one NDJSON result per row as it completes,
+    followed by a {"summary": ...} line.
+    """
+    auth_error = require_admin_token()
+    if auth_error:
+        return auth_error
+
+    try:
+        records = read_bulk_onboarding_records()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Could not read batch: {str(e)}"}), 400
+    if not records:
+        return jsonify({"error": "Batch is empty"}), 400
+    if len(records) > BULK_ONBOARDING_MAX_ROWS:
+        return jsonify({"error": f"Batch has {len(records)} rows; the limit is {BULK_ONBOARDING_MAX_ROWS}"}), 413
+
+    schemas = request_schemas()
+    rows = []
+    rejected = []
+    seen_documents: Dict[str, int] = {}
+    for line_number, record in enumerate(records, start=1):
+        try:
+            row = schemas.BulkOnboardingRow.model_validate(record)
+        except schemas.ValidationError as e:
+            details = validation_error_details(e)
+            rejected.append({"row": line_number, "id": record.get("id"), "status": "invalid",
+                             "error": "; ".join(f"{d['field']}: {d['message']}" for d in details)})
+            continue
+        if row.document_value in seen_documents:
+            rejected.append({"row": line_number, "id": row.id, "status": "duplicate",
+                             "error": f"Same identity document as row {seen_documents[row.document_value]}"})
+            continue
+        seen_documents[row.document_value] = line_number
+        rows.append((line_number, row))
+
+    try:
+        index = OnboardingIndex()
+    except requests.RequestException as e:
+        return jsonify({"error": f"Could not load existing customers and accounts: {str(e)}"}), 502
+
+    print(f"📋 Bulk onboarding {len(rows)} row(s) ({len(rejected)} rejected) with {BULK_ONBOARDING_MAX_WORKERS} worker(s)")
+    span_context = current_span_context()
+
+    def generate():
+        counts = {"success": 0, "failed": 0, "invalid": 0, "duplicate": 0}
+        for result in rejected:
+            counts[result["status"]] += 1
+            BULK_ONBOARDING_ROWS.labels(result["status"]).inc()
+            yield json.dumps(result, separators=(",", ":")) + "\n"
+
+        executor = ThreadPoolExecutor(max_workers=BULK_ONBOARDING_MAX_WORKERS, thread_name_prefix="bulk-onboarding")
+        try:
+            futures = [executor.submit(onboard_row, line_number, row, index, span_context) for line_number, row in rows]
+            for future in as_completed(futures):
+                result = future.result()
+                counts[result["status"]] += 1
+                BULK_ONBOARDING_ROWS.labels(result["status"]).inc()
+                icon = "✅" if result["status"] == "success" else "❌"
+                print(f"{icon} Bulk onboarding row {result['row']}: {result['customer_id'] or result['error']}")
+                yield json.dumps(result, separators=(",", ":")) + "\n"
+        finally:
+            # If the client disconnects, rows not yet started are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        print(f"🎉 Bulk onboarding finished: {counts}")
+        yield json.dumps({"summary": {"rows": len(records), **counts}}, separators=(",", ":")) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 def get_customer_wallet_id(customer_id: str) -> Optional[str]:
     """Get the first wallet_id for a customer"""
     try:
@@ -1763,7 +4399,8 @@ def get_customer_wallet_id(customer_id: str) -> Optional[str]:
             "Content-Type": "application/json"
         }
         
-        response = requests.get(
+        response = unblockpay_request(
+            "GET",
             f"{BASE_URL}/customers/{customer_id}/wallets",
             headers=headers
         )
@@ -1806,7 +4443,7 @@ def get_customer_external_account(customer_id: str) -> Optional[Dict]:
         url = f"{BASE_URL}/customers/{customer_id}/external-accounts"
         print(f"Making request to: {url}")
         
-        response = requests.get(url, headers=headers)
+        response = unblockpay_request("GET", url, headers=headers)
         
         print(f"External accounts API response status: {response.status_code}")
         print(f"External accounts API response: {response.text}")
@@ -1846,7 +4483,8 @@ def create_off_ramp_quote() -> Optional[Dict]:
         
         print(f"Quote request data: {json.dumps(quote_data, indent=2)}")
         
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{BASE_URL}/quote",
             headers=headers,
             json=quote_data
@@ -1885,7 +4523,8 @@ def create_quote_new(symbol: str, quote_type: str) -> Optional[Dict]:
         
         print(f"Quote request data: {json.dumps(quote_data, indent=2)}")
         
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{BASE_URL}/quote",
             headers=headers,
             json=quote_data
@@ -1908,7 +4547,7 @@ def create_quote_new(symbol: str, quote_type: str) -> Optional[Dict]:
         print(f"Error creating quote: {str(e)}")
         return None
 
-@app.route("/api/create-quote-new", methods=["POST", "OPTIONS"])
+@api.route("/api/create-quote-new", methods=["POST", "OPTIONS"])
 def create_quote_new_endpoint():
     """API endpoint for create_quote_new function"""
     if request.method == "OPTIONS":
@@ -2010,7 +4649,8 @@ def send_slack_notification(transaction_data: Dict) -> bool:
         response = requests.post(
             SLACK_WEBHOOK_URL,
             json=slack_payload,
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json'},
+            timeout=upstream_timeout(SLACK_TIMEOUT_SECONDS)
         )
         response.raise_for_status()
         print("Slack notification sent successfully")
@@ -2028,7 +4668,8 @@ def get_customer_wallet_address(customer_id: str) -> Optional[str]:
             "Content-Type": "application/json"
         }
         
-        response = requests.get(
+        response = unblockpay_request(
+            "GET",
             f"{BASE_URL}/customers/{customer_id}/wallets",
             headers=headers
         )
@@ -2046,8 +4687,142 @@ def get_customer_wallet_address(customer_id: str) -> Optional[str]:
         print(f"Error getting customer wallet address: {str(e)}")
         return None
 
-def create_off_ramp_payout(amount: float, quote_id: str, customer_id: str, external_account_id: str) -> Optional[Dict]:
-    """Create an off-ramp payout transaction"""
+class BonusTransferQueue:
+    """
+    Sends payout bonuses from the treasury wallet off the payout critical path.
+    A background worker collects the transfers that come due within one batch interval,
+    merges bonuses owed to the same customer into a single transfer and sends the batch
+    concurrently, resolving each customer's wallet address once per batch.
+    """
+
+    def __init__(self, batch_interval_seconds: float = 0.5, max_workers: int = 4):
+        self.batch_interval_seconds = batch_interval_seconds
+        self.max_workers = max_workers
+        self._pending = []
+        self._in_flight = 0
+        self._waiters = 0
+        self._condition = threading.Condition()
+        self._worker = None
+        self._executor = None
+
+    def submit(self, customer_id: str, amount: float) -> Future:
+        """Queue a bonus transfer; the future resolves to the transfer response (or raises)"""
+        future = Future()
+        with self._condition:
+            self._pending.append((customer_id, amount, future, current_span_context()))
+            if self._worker is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bonus-transfer")
+                self._worker = threading.Thread(target=self._run, name="bonus-transfer-batcher", daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        return future
+
+    def result(self, future: Future, timeout: Optional[float] = None) -> Dict:
+        """Block on a queued transfer; the batch it is in is sent right away instead of after the batch interval"""
+        with self._condition:
+            self._waiters += 1
+            self._condition.notify_all()
+        try:
+            return future.result(timeout=timeout)
+        finally:
+            with self._condition:
+                self._waiters -= 1
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+    def drain(self, timeout: float = 30) -> bool:
+        """Wait until every queued transfer has been sent (used on shutdown)"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Give other transfers that are about to come due a chance to join this batch,
+                # unless a payout is already blocked on one of them
+                self._condition.wait_for(lambda: self._waiters > 0, timeout=self.batch_interval_seconds)
+                batch, self._pending = self._pending, []
+                self._in_flight += len(batch)
+            try:
+                self._send_batch(batch)
+            finally:
+                with self._condition:
+                    self._in_flight -= len(batch)
+                    self._condition.notify_all()
+
+    def _send_batch(self, batch):
+        merged = {}
+        for customer_id, amount, future, span_context in batch:
+            total, futures, span_contexts = merged.get(customer_id, (0, [], []))
+            merged[customer_id] = (total + amount, futures + [future], span_contexts + [span_context])
+
+        print(f"💸 Sending {len(merged)} bonus transfer(s) for {len(batch)} queued bonus(es)")
+        results = [
+            (self._executor.submit(self._transfer, customer_id, total, span_contexts), futures)
+            for customer_id, (total, futures, span_contexts) in merged.items()
+        ]
+        for transfer, futures in results:
+            try:
+                response = transfer.result()
+                for future in futures:
+                    future.set_result(response)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+
+    def _transfer(self, customer_id: str, amount: float, span_contexts: list) -> Dict:
+        # Link back to every payout request whose bonus is part of this transfer
+        with trace_span("bonus_transfer", {"customer_id": customer_id, "amount": amount}, span_links(span_contexts)):
+            with upstream_priority("high"):
+                return self._send_transfer(customer_id, amount)
+
+    def _send_transfer(self, customer_id: str, amount: float) -> Dict:
+        wallet_address = get_customer_wallet_address(customer_id)
+        if not wallet_address:
+            raise ValueError(f"No wallet address found for customer {customer_id}")
+        try:
+            response = create_wallet_transfer(amount, TREASURY_CUSTOMER_ID, TREASURY_WALLET_ID, wallet_address)
+            print(f"✅ Bonus transfer of {amount} USDC sent to customer {customer_id}: {response.get('id')}")
+            return response
+        except Exception as e:
+            print(f"❌ Bonus transfer of {amount} USDC to customer {customer_id} failed: {str(e)}")
+            raise
+
+bonus_transfer_queue = BonusTransferQueue(
+    batch_interval_seconds=BONUS_TRANSFER_BATCH_INTERVAL_SECONDS,
+    max_workers=BONUS_TRANSFER_MAX_WORKERS
+)
+live_gauge(BONUS_TRANSFERS_PENDING, bonus_transfer_queue.pending_count)
+
+def start_bonus_transfer(customer_id: str, bonus_amount: float = BONUS_AMOUNT_USDC) -> Optional[Future]:
+    """Queue a payout's bonus transfer early, so it runs while the quote and wallet are prepared"""
+    if bonus_amount > 0 and ASYNC_BONUS_TRANSFERS_ENABLED:
+        return bonus_transfer_queue.submit(customer_id, bonus_amount)
+    return None
+
+@traced("create_off_ramp_payout")
+def create_off_ramp_payout(
+    amount: float,
+    quote_id: str,
+    customer_id: str,
+    external_account_id: str,
+    bonus_amount: float = BONUS_AMOUNT_USDC,
+    bonus_future: Optional[Future] = None
+) -> Optional[Dict]:
+    """
+    Create an off-ramp payout transaction, topped up with bonus_amount from the treasury wallet.
+    Pass the bonus_future from start_bonus_transfer when the bonus was queued ahead of the payout.
+    """
     try:
         print(f"=== CREATING OFF-RAMP PAYOUT ===")
         print(f"Amount: {amount}")
@@ -2069,12 +4844,30 @@ def create_off_ramp_payout(amount: float, quote_id: str, customer_id: str, exter
         print(f"Using wallet_id: {wallet_id}")
 
 
-        try:
-            wallet_address = get_customer_wallet_address(customer_id)
-            create_wallet_transfer(10, "0199d13b-6e91-71cb-afba-30113108e359", "0199d386-a3e2-77ce-8402-877744f4eb1b", wallet_address)
-            amount = amount + 10
-        except Exception as e:
-            print(f"Error getting customer wallet address: {str(e)}")
+        if bonus_amount > 0 and ASYNC_BONUS_TRANSFERS_ENABLED:
+            if bonus_future is None:
+                bonus_future = bonus_transfer_queue.submit(customer_id, bonus_amount)
+            # Only pay the bonus out once its transfer has landed in the customer's wallet
+            wait = BONUS_TRANSFER_WAIT_SECONDS
+            remaining = remaining_budget()
+            if remaining is not None:
+                wait = max(0.0, min(wait, remaining))
+            try:
+                if bonus_transfer_queue.result(bonus_future, timeout=wait):
+                    amount = amount + bonus_amount
+                else:
+                    print(f"Bonus transfer for customer {customer_id} returned no result - paying out without bonus")
+            except FutureTimeoutError:
+                print(f"Bonus transfer for customer {customer_id} not done after {wait:.1f}s - paying out without bonus")
+            except Exception as e:
+                print(f"Bonus transfer for customer {customer_id} failed - paying out without bonus: {str(e)}")
+        elif bonus_amount > 0:
+            try:
+                wallet_address = get_customer_wallet_address(customer_id)
+                create_wallet_transfer(bonus_amount, TREASURY_CUSTOMER_ID, TREASURY_WALLET_ID, wallet_address)
+                amount = amount + bonus_amount
+            except Exception as e:
+                print(f"Error getting customer wallet address: {str(e)}")
            
         
         payout_data = {
@@ -2092,7 +4885,8 @@ def create_off_ramp_payout(amount: float, quote_id: str, customer_id: str, exter
         
         print(f"Payout data: {json.dumps(payout_data, indent=2)}")
         
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{BASE_URL}/payout",
             headers=headers,
             json=payout_data
@@ -2114,8 +4908,265 @@ def create_off_ramp_payout(amount: float, quote_id: str, customer_id: str, exter
         print(f"Error creating off-ramp payout: {str(e)}")
         return None
 
+class PayoutNettingScheduler:
+    """
+    Accumulates payin.completed amounts per (customer wallet, external account) and issues
+    one aggregated payout when the key's window closes. The window starts with the first
+    payin for a key, so no payin waits longer than window_seconds for its payout.
+
+    Payins are recorded in a SQLite table shared by every worker on the host before the
+    webhook is acknowledged, so a key is netted across workers and open buckets survive a
+    crash: recover() (run when a worker starts) schedules every bucket left open. A worker
+    claims a bucket's rows before paying it out and deletes them afterwards; rows still
+    claimed at startup belong to a payout interrupted mid-flight and are reported, not re-paid.
+    A payout that fails releases its claim, and the bucket is retried with exponential backoff.
+    """
+
+    def __init__(self, window_seconds: float, path: str, max_retry_seconds: float = 600):
+        self.window_seconds = window_seconds
+        self.path = path
+        self.max_retry_seconds = max_retry_seconds
+        self._timers = {}
+        self._failures = {}
+        self._span_contexts = {}
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._table_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS netting_payins (
+                    payin_transaction_id TEXT PRIMARY KEY,
+                    customer_id TEXT NOT NULL,
+                    external_account_id TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    added_at REAL NOT NULL,
+                    claim_id TEXT
+                )
+            """)
+            self._table_ready = True
+        return conn
+
+    def _schedule(self, key, due_at: float):
+        """Start this process's timer for key unless one is already running (call with the lock held)"""
+        if key in self._timers:
+            return
+        timer = threading.Timer(max(due_at - time.time(), 0), self.flush, args=(key,))
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+    def add(self, customer_id: str, external_account_id: str, payin_transaction_id: str, amount) -> Dict:
+        """Record a completed payin for the next aggregated payout and return its bucket summary"""
+        key = (customer_id, external_account_id)
+        conn = self._connect()
+        try:
+            # A redelivered webhook for the same payin is only netted once
+            conn.execute(
+                "INSERT OR IGNORE INTO netting_payins (payin_transaction_id, customer_id, external_account_id, amount, added_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (payin_transaction_id, customer_id, external_account_id, float(amount), time.time())
+            )
+            total, payin_count, opened_at = conn.execute(
+                "SELECT SUM(amount), COUNT(*), MIN(added_at) FROM netting_payins "
+                "WHERE customer_id = ? AND external_account_id = ? AND claim_id IS NULL",
+                key
+            ).fetchone()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._span_contexts.setdefault(key, []).append(current_span_context())
+            # The window runs from the oldest payin still open for this key, whichever worker added it
+            self._schedule(key, (opened_at or time.time()) + self.window_seconds)
+        print(f"🧮 Netting payin {payin_transaction_id} ({amount} USDC) into payout for {key}: "
+              f"{payin_count} payins, {total} USDC")
+        return {
+            "amount": total or float(amount),
+            "payin_count": payin_count or 1,
+            "opened_at": datetime.fromtimestamp(opened_at or time.time()).isoformat(),
+            "window_seconds": self.window_seconds
+        }
+
+    def _claim(self, key, claim_id: str) -> Optional[Dict]:
+        """Claim the key's open payins once its window has closed; returns the bucket, or None"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                opened_at = conn.execute(
+                    "SELECT MIN(added_at) FROM netting_payins WHERE customer_id = ? AND external_account_id = ? AND claim_id IS NULL",
+                    key
+                ).fetchone()[0]
+                if opened_at is None:
+                    return None
+                if opened_at + self.window_seconds > time.time():
+                    # Rows this timer was started for were paid out by another worker; wait for the newer ones
+                    with self._lock:
+                        self._schedule(key, opened_at + self.window_seconds)
+                    return None
+                conn.execute(
+                    "UPDATE netting_payins SET claim_id = ? WHERE customer_id = ? AND external_account_id = ? AND claim_id IS NULL",
+                    (claim_id, *key)
+                )
+                rows = conn.execute(
+                    "SELECT payin_transaction_id, amount FROM netting_payins WHERE claim_id = ? ORDER BY added_at",
+                    (claim_id,)
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return {
+            "customer_id": key[0],
+            "external_account_id": key[1],
+            "amount": sum(amount for _, amount in rows),
+            "payin_transaction_ids": [payin_id for payin_id, _ in rows],
+            "opened_at": datetime.fromtimestamp(opened_at).isoformat()
+        }
+
+    def flush(self, key):
+        """Close the window for a key and create its aggregated payout"""
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            span_contexts = self._span_contexts.pop(key, [])
+        if timer:
+            timer.cancel()
+        claim_id = uuid.uuid4().hex
+        try:
+            bucket = self._claim(key, claim_id)
+        except sqlite3.Error as e:
+            self._retry(key, span_contexts, f"Could not claim netting bucket {key}: {e}")
+            return
+        if not bucket:
+            return
+        # The payout span links to the webhook span of every payin it covers (those handled by this worker)
+        payout_result = None
+        try:
+            with trace_span(
+                "netted_payout",
+                {"payin_count": len(bucket["payin_transaction_ids"]), "external_account_id": bucket["external_account_id"]},
+                span_links(span_contexts)
+            ):
+                payout_result = execute_netted_payout(bucket)
+        except Exception as e:
+            print(f"❌ Netted payout for {key} raised: {str(e)}")
+
+        conn = self._connect()
+        try:
+            if payout_result:
+                conn.execute("DELETE FROM netting_payins WHERE claim_id = ?", (claim_id,))
+            else:
+                # No payout was created: hand the payins back to the bucket for the next attempt
+                conn.execute("UPDATE netting_payins SET claim_id = NULL WHERE claim_id = ?", (claim_id,))
+        finally:
+            conn.close()
+
+        with self._lock:
+            if payout_result:
+                self._failures.pop(key, None)
+                return
+        self._retry(key, span_contexts, f"Netted payout for {key} failed")
+
+    def _retry(self, key, span_contexts: list, reason: str):
+        """Reschedule a bucket after a failed flush, backing off on repeated failures"""
+        with self._lock:
+            failures = self._failures.get(key, 0)
+            self._failures[key] = failures + 1
+            delay = min(self.window_seconds * 2 ** failures, self.max_retry_seconds)
+            self._span_contexts.setdefault(key, [])[:0] = span_contexts
+            self._schedule(key, time.time() + delay)
+        print(f"❌ {reason}, retrying in {delay:.0f}s")
+
+    def recover(self):
+        """Schedule the buckets left open by workers that exited (run when a worker starts)"""
+        if not os.path.exists(self.path):
+            return
+        conn = self._connect()
+        try:
+            open_buckets = conn.execute(
+                "SELECT customer_id, external_account_id, MIN(added_at), COUNT(*) FROM netting_payins "
+                "WHERE claim_id IS NULL GROUP BY customer_id, external_account_id"
+            ).fetchall()
+            interrupted = conn.execute(
+                "SELECT claim_id, GROUP_CONCAT(payin_transaction_id) FROM netting_payins "
+                "WHERE claim_id IS NOT NULL GROUP BY claim_id"
+            ).fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for customer_id, external_account_id, opened_at, payin_count in open_buckets:
+                print(f"♻️ Recovered netting bucket for {(customer_id, external_account_id)} with {payin_count} payin(s)")
+                self._schedule((customer_id, external_account_id), opened_at + self.window_seconds)
+        # Claims are only held while a payout is created, so these are either in flight in
+        # another worker or were interrupted by a crash and need checking against UnblockPay
+        for claim_id, payin_ids in interrupted:
+            print(f"⚠️ Netted payout {claim_id} for payins {payin_ids} is claimed but not finished - check it was created")
+
+    def pending_count(self) -> int:
+        """Buckets this process holds a timer for"""
+        with self._lock:
+            return len(self._timers)
+
+payout_netting_scheduler = PayoutNettingScheduler(PAYOUT_NETTING_WINDOW_SECONDS, PAYOUT_NETTING_DB_PATH)
+live_gauge(PAYOUT_NETTING_OPEN_BUCKETS, payout_netting_scheduler.pending_count)
+
+def execute_netted_payout(bucket: Dict) -> Optional[Dict]:
+    """Create one payout for every payin accumulated in a netting bucket"""
+    payin_ids = bucket["payin_transaction_ids"]
+    print(f"=== CREATING NETTED PAYOUT FOR {len(payin_ids)} PAYIN(S) ===")
+    print(f"Payins: {payin_ids}, total: {bucket['amount']} USDC")
+
+    payout_result = None
+    quote_id = None
+    try:
+        with upstream_priority("high"):
+            # Every netted payin still earns its own bonus, sent as a single transfer alongside the quote
+            bonus_amount = BONUS_AMOUNT_USDC * len(payin_ids)
+            bonus_future = start_bonus_transfer(bucket["customer_id"], bonus_amount)
+            off_ramp_quote = get_payout_quote()
+            quote_id = off_ramp_quote.get("id")
+            payout_result = create_off_ramp_payout(
+                amount=bucket["amount"],
+                quote_id=quote_id,
+                customer_id=bucket["customer_id"],
+                external_account_id=bucket["external_account_id"],
+                bonus_amount=bonus_amount,
+                bonus_future=bonus_future
+            )
+    except Exception as e:
+        print(f"❌ Error creating netted payout: {str(e)}")
+
+    if not payout_result:
+        if quote_id:
+            off_ramp_quote_pool.invalidate(quote_id=quote_id)
+        for payin_id in payin_ids:
+            webhook_status_tracker.setdefault(payin_id, {})["offramp_failed"] = True
+        print(f"❌ Failed to create netted payout for payins: {payin_ids} (the bucket will be retried)")
+        return None
+
+    payout_id = payout_result.get("id")
+    annotate_span(payout_id=payout_id)
+    for payin_id in payin_ids:
+        webhook_status_tracker.setdefault(payin_id, {})["offramp_transaction"] = {
+            "id": payout_id,
+            "status": "processing",
+            "amount": bucket["amount"],
+            "currency": "USD",
+            "netted_payin_ids": payin_ids,
+            "trace_id": current_trace_id(),
+            "created_at": datetime.now().isoformat()
+        }
+    print(f"✅ Created netted payout {payout_id} for payins: {payin_ids}")
+    return payout_result
+
 # Endpoint to check transaction status
-@app.route("/transaction-status/<transaction_id>", methods=["GET"])
+@api.route("/transaction-status/<transaction_id>", methods=["GET"])
 def get_transaction_status(transaction_id: str):
     """Get the status of a transaction"""
     try:
@@ -2124,7 +5175,8 @@ def get_transaction_status(transaction_id: str):
             "Content-Type": "application/json"
         }
         
-        response = requests.get(
+        response = unblockpay_request(
+            "GET",
             f"{BASE_URL}/transactions/{transaction_id}",
             headers=headers
         )
@@ -2146,7 +5198,7 @@ def get_transaction_status(transaction_id: str):
             "error": f"Failed to get transaction status: {str(e)}"
         }), 500
 
-@app.route("/webhook/mock", methods=["POST"])
+@api.route("/webhook/mock", methods=["POST"])
 def mock_webhook():
     """Mock webhook endpoint for testing transaction events in sandbox"""
     try:
@@ -2192,7 +5244,7 @@ def mock_webhook():
         print(f"Calling real webhook handler with mock data: {json.dumps(webhook_payload, indent=2)}")
         
         # Call the real webhook handler with mock data
-        with app.test_request_context('/webhook/unblockpay', method='POST', json=webhook_payload):
+        with current_app.test_request_context('/webhook/unblockpay', method='POST', json=webhook_payload):
             result = handle_unblockpay_webhook()
             print(f"Mock webhook result: {result}")
         
@@ -2206,7 +5258,7 @@ def mock_webhook():
         print(f"Error processing mock webhook: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route("/api/trigger-mock-webhook", methods=["POST"])
+@api.route("/api/trigger-mock-webhook", methods=["POST"])
 def trigger_mock_webhook():
     """API endpoint to trigger mock webhook events from frontend"""
     try:
@@ -2252,7 +5304,7 @@ def trigger_mock_webhook():
         
         # Call the real webhook handler
         try:
-            with app.test_request_context('/webhook/unblockpay', method='POST', json=webhook_payload):
+            with current_app.test_request_context('/webhook/unblockpay', method='POST', json=webhook_payload):
                 print("About to call handle_unblockpay_webhook()")
                 webhook_result = handle_unblockpay_webhook()
                 print(f"Webhook handler result: {webhook_result}")
@@ -2273,7 +5325,7 @@ def trigger_mock_webhook():
         print(f"Error triggering mock webhook: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route("/api/setup-webhook", methods=["POST"])
+@api.route("/api/setup-webhook", methods=["POST"])
 def setup_webhook():
     """Setup webhook configuration with UnblockPay"""
     try:
@@ -2303,7 +5355,8 @@ def setup_webhook():
         print(f"Setting up webhook with URL: {webhook_url}")
         print(f"Webhook config: {webhook_config}")
         
-        response = requests.post(
+        response = unblockpay_request(
+            "POST",
             f"{BASE_URL}/webhooks",
             headers=headers,
             json=webhook_config
@@ -2342,7 +5395,7 @@ def check_existing_external_account(routing_number: str, account_number: str) ->
         }
         
         # Get all external accounts
-        response = requests.get(f"{BASE_URL}/external-accounts", headers=headers)
+        response = unblockpay_request("GET", f"{BASE_URL}/external-accounts", headers=headers)
         response.raise_for_status()
         external_accounts = response.json()
         
@@ -2370,7 +5423,7 @@ def check_existing_external_account(routing_number: str, account_number: str) ->
         print(f"❌ Error checking external accounts: {str(e)}")
         raise
 
-@app.route("/api/check-external-account", methods=["POST", "OPTIONS"])
+@api.route("/api/check-external-account", methods=["POST", "OPTIONS"])
 def check_external_account_endpoint():
     """Check if an external account exists with given routing and account number"""
     if request.method == "OPTIONS":
@@ -2403,7 +5456,221 @@ def check_external_account_endpoint():
         print(f"❌ {error_msg}")
         return jsonify({"error": error_msg}), 500
 
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html"}
+
+# (body digest, encoding) -> compressed body, least recently used first
+_compressed_cache = OrderedDict()
+_compressed_cache_lock = threading.Lock()
+
+def negotiate_encoding() -> Optional[str]:
+    """Best content coding the client accepts: br (if available), then gzip"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality("br") > 0:
+        return "br"
+    if accepted.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """Compress body, reusing the result for byte-identical bodies seen recently"""
+    key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+    with _compressed_cache_lock:
+        compressed = _compressed_cache.get(key)
+        if compressed is not None:
+            _compressed_cache.move_to_end(key)
+            CACHE_REQUESTS.labels("compression", "hit").inc()
+            return compressed
+    CACHE_REQUESTS.labels("compression", "miss").inc()
+
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+    if COMPRESSION_CACHE_ENTRIES > 0:
+        with _compressed_cache_lock:
+            _compressed_cache[key] = compressed
+            while len(_compressed_cache) > COMPRESSION_CACHE_ENTRIES:
+                _compressed_cache.popitem(last=False)
+    return compressed
+
+@api.after_app_request
+def compress_response(response):
+    if not COMPRESSION_ENABLED or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    # Streamed bodies (exports, event streams) must reach the client as they are produced
+    if (response.is_streamed or response.direct_passthrough or "Content-Encoding" in response.headers
+            or not 200 <= response.status_code < 300 or response.status_code == 204 or request.method == "HEAD"):
+        return response
+    if (response.content_length or 0) < COMPRESSION_MIN_BYTES:
+        return response
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    compressed = compress_body(response.get_data(), encoding)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+def apply_preference(preference: str):
+    """Record an honoured Prefer token for the Preference-Applied header"""
+    applied = g.get("preference_applied")
+    g.preference_applied = f"{applied}, {preference}" if applied else preference
+
+def wants_minimal_response() -> bool:
+    """Whether to leave large upstream echoes (full_response, transaction) out of the response"""
+    if "return=minimal" in request.headers.get("Prefer", ""):
+        apply_preference("return=minimal")
+        return True
+    return OMIT_RESPONSE_ECHOES or request.args.get("minimal", "false").lower() == "true"
+
+@api.after_app_request
+def add_preference_applied(response):
+    if g.get("preference_applied"):
+        response.headers["Preference-Applied"] = g.preference_applied
+    return response
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson, used by jsonify, request.get_json and the webhook
+    logs. Datetimes and other non-native types go through Flask's default hook so responses
+    keep their format; ints over 64 bits go through the stdlib both ways, so they stay exact.
+    """
+
+    # Key order carries no meaning for our clients and sorting is the costliest part of encoding
+    sort_keys = False
+    # orjson parses ints over 64 bits as floats; bodies with such long digit runs use the stdlib
+    _long_digits = re.compile(r"\d{19}")
+    _long_digits_bytes = re.compile(rb"\d{19}")
+
+    def _dumps_bytes(self, obj, indent: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, indent=2 if indent else None).encode()
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self._dumps_bytes(obj, indent=bool(kwargs.get("indent"))).decode()
+
+    def loads(self, s, **kwargs):
+        if (self._long_digits if isinstance(s, str) else self._long_digits_bytes).search(s):
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self._dumps_bytes(obj, indent) + b"\n", mimetype=self.mimetype)
+
+def to_log_json(obj) -> str:
+    """Pretty JSON for log lines, through the app's JSON provider when there is an app context"""
+    if has_app_context():
+        return current_app.json.dumps(obj, indent=2)
+    return json.dumps(obj, indent=2, default=str)
+
+def prewarm_connections():
+    """Open pooled connections to UnblockPay and Supabase before a worker takes traffic"""
+    if not PREWARM_CONNECTIONS:
+        return
+    started = time.perf_counter()
+    get_tracer()
+    request_schemas()
+    try:
+        # Any response will do - this only establishes the keep-alive TLS connection
+        get_unblockpay_session().head(BASE_URL, timeout=5)
+    except requests.RequestException as e:
+        print(f"WARNING: UnblockPay pre-warm failed: {e}")
+    supabase = get_supabase()
+    if supabase:
+        try:
+            run_query(supabase.table("user_profiles").select("id").limit(1), "user_profiles", "select")
+        except Exception as e:
+            print(f"WARNING: Supabase pre-warm failed: {e}")
+    db_pool = get_db_pool()
+    if db_pool:
+        try:
+            db_pool.wait(timeout=DATABASE_POOL_TIMEOUT_SECONDS)
+        except Exception as e:
+            print(f"WARNING: Postgres pool pre-warm failed: {e}")
+    print(f"🔥 Connections pre-warmed in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def shutdown_background_work(timeout: float = SHUTDOWN_DRAIN_SECONDS):
+    """
+    Finish work held in this process before it exits: wallet provisioning, queued bonuses,
+    then buffered webhook events (before the database pool closes)
+    """
+    if payout_netting_scheduler.pending_count():
+        # Their payins are in the netting table, so the next worker to start pays them out on schedule
+        print(f"🛑 Leaving {payout_netting_scheduler.pending_count()} netting bucket(s) for the next worker")
+    if wallet_provisioner.count():
+        print(f"🛑 Waiting for {wallet_provisioner.count()} wallet provisioning job(s) before exit")
+        wallet_provisioner.drain(timeout)
+    if bonus_transfer_queue.pending_count():
+        print(f"🛑 Draining {bonus_transfer_queue.pending_count()} bonus transfer(s) before exit")
+        if not bonus_transfer_queue.drain(timeout):
+            print(f"❌ {bonus_transfer_queue.pending_count()} bonus transfer(s) still pending after {timeout:.0f}s")
+    if webhook_event_buffer.pending_count():
+        print(f"🛑 Flushing {webhook_event_buffer.pending_count()} buffered webhook event(s) before exit")
+    webhook_event_buffer.close(timeout)
+    if _db_pool is not None:
+        _db_pool.close()
+
+def run_production_server():
+    """Replace this process with gunicorn using gunicorn.conf.py next to this file"""
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"Starting gunicorn on {HOST}:{PORT}")
+    os.execv(sys.executable, [
+        sys.executable, "-m", "gunicorn",
+        "--chdir", server_dir,
+        "--config", os.path.join(server_dir, "gunicorn.conf.py"),
+        "app:app"
+    ])
+
+def create_app(config: Optional[Dict] = None) -> Flask:
+    """
+    Build the Flask app. Nothing here talks to the network: the Supabase client, UnblockPay
+    session and tracer are created the first time a request needs them.
+    """
+    flask_app = Flask(__name__)
+    if config:
+        flask_app.config.update(config)
+    if orjson is not None:
+        flask_app.json = OrjsonProvider(flask_app)
+    else:
+        print("WARNING: orjson not installed - using the stdlib JSON provider")
+
+    # Configure CORS with environment-based origins
+    CORS(flask_app,
+         origins=ALLOWED_ORIGINS,
+         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+         allow_headers=["Content-Type", "Authorization", "X-Admin-Token", "X-Profile", "Idempotency-Key", "Prefer"],
+         expose_headers=["Content-Type", "Idempotent-Replayed", "Preference-Applied"],
+         supports_credentials=True,
+         allow_credentials=True)
+    flask_app.register_blueprint(api)
+    return flask_app
+
+# Module-level app for `gunicorn app:app` and `python app.py`
+app = create_app()
+
+IMPORT_TIME_MS = (time.perf_counter() - _import_started) * 1000
+if IMPORT_TIME_MS > IMPORT_TIME_BUDGET_MS:
+    print(f"WARNING: app.py import took {IMPORT_TIME_MS:.0f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms)")
+else:
+    print(f"⚡ app.py imported in {IMPORT_TIME_MS:.0f} ms")
+
 if __name__ == "__main__":
-    print(f"Starting Flask app on host: {HOST}, port: {PORT}")
+    if "--production" in sys.argv or SERVER_MODE == "production":
+        run_production_server()
+    payout_netting_scheduler.recover()
+    webhook_event_buffer.replay_orphaned_spills()
+    print(f"Starting Flask development server on host: {HOST}, port: {PORT}")
     print(f"Debug mode: {FLASK_DEBUG}")
-    app.run(debug=FLASK_DEBUG, host='0.0.0.0', port=PORT)
\ No newline at end of file
+    app.run(debug=FLASK_DEBUG, host=HOST, port=PORT)
\ No newline at end of file
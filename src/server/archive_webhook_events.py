@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Webhook Events Retention Job
+Moves the JSONB payloads of old webhook_events (event_resource, raw_payload) and settled
+transactions (metadata) into zstd-compressed NDJSON archives, one file per table and month,
+and clears them in the database. Scalar columns (amounts, status, ids, created_at) stay in
+place for reporting, and archived rows get archived_at set.
+
+Run webhook-events-archival-migration.sql first. Example (e.g. nightly from cron):
+
+    python archive_webhook_events.py --older-than-days 90
+
+Archives are appended to (one zstd frame per batch), so runs can be repeated:
+
+    zstd -dc archives/webhook_events/2025-01.ndjson.zst | jq .
+
+Each batch is fsynced to its archive before the database is updated, so a crash can only
+archive a batch twice, never lose it. Payloads stored by hash (WEBHOOK_PAYLOAD_DEDUP) are
+archived in full, and webhook_payloads rows left unreferenced are pruned at the end.
+Run VACUUM on the tables afterwards to reclaim space.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import zstandard
+
+from app import PAYLOAD_REFERENCES, get_supabase, hydrate_payloads, run_query
+
+WEBHOOK_EVENTS_RETENTION_DAYS = int(os.getenv('WEBHOOK_EVENTS_RETENTION_DAYS', 90))
+WEBHOOK_ARCHIVE_DIR = os.getenv('WEBHOOK_ARCHIVE_DIR', 'archives')
+
+# Per table: the JSONB columns moved to the archive and the extra filter for rows to archive
+ARCHIVE_TABLES = {
+    "webhook_events": {
+        "payload_columns": ["event_resource", "raw_payload"],
+        "cutoff_column": "created_at",
+    },
+    "transactions": {
+        "payload_columns": ["metadata"],
+        # Transactions still moving can be updated by later webhooks, so only settled ones go
+        "cutoff_column": "updated_at",
+        "statuses": ["completed", "failed"],
+    },
+}
+
+
+class MonthlyArchive:
+    """Appends rows to <archive_dir>/<table>/<YYYY-MM>.ndjson.zst, one zstd frame per batch"""
+
+    def __init__(self, archive_dir: str, table: str, level: int):
+        self.directory = os.path.join(archive_dir, table)
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.bytes_written = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write_batch(self, rows: List[Dict]):
+        by_month: Dict[str, List[Dict]] = {}
+        for row in rows:
+            by_month.setdefault(row["created_at"][:7], []).append(row)
+
+        for month, month_rows in by_month.items():
+            data = "".join(json.dumps(row, separators=(",", ":")) + "\n" for row in month_rows).encode()
+            frame = self.compressor.compress(data)
+            with open(os.path.join(self.directory, f"{month}.ndjson.zst"), "ab") as f:
+                f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+            self.bytes_written += len(frame)
+
+
+def iter_archivable_batches(table: str, cutoff: str, batch_size: int):
+    """Yield batches of unarchived rows older than the cutoff in (created_at, id) order"""
+    supabase = get_supabase()
+    config = ARCHIVE_TABLES[table]
+    cursor = None
+    while True:
+        query = (supabase.table(table).select("*")
+                 .lt(config["cutoff_column"], cutoff)
+                 .is_("archived_at", "null"))
+        if config.get("statuses"):
+            query = query.in_("status", config["statuses"])
+        if cursor:
+            last_created_at, last_id = cursor
+            query = query.or_(
+                f'created_at.gt."{last_created_at}",and(created_at.eq."{last_created_at}",id.gt.{last_id})'
+            )
+
+        rows = run_query(query.order("created_at").order("id").limit(batch_size), table, "select").data or []
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        cursor = (rows[-1]["created_at"], rows[-1]["id"])
+
+
+def archive_table(table: str, cutoff: str, archive: Optional[MonthlyArchive], batch_size: int) -> int:
+    """Archive and strip one table; returns the number of rows archived (or found, on a dry run)"""
+    supabase = get_supabase()
+    payload_columns = ARCHIVE_TABLES[table]["payload_columns"]
+    hash_column = PAYLOAD_REFERENCES[table][0]
+    archived = 0
+
+    for rows in iter_archivable_batches(table, cutoff, batch_size):
+        if archive is None:
+            archived += len(rows)
+            continue
+
+        # Rows written with WEBHOOK_PAYLOAD_DEDUP only hold a hash; archive the full payload
+        archive.write_batch(hydrate_payloads(table, rows))
+        stripped = {column: None for column in payload_columns}
+        if hash_column in rows[0]:
+            stripped[hash_column] = None
+        stripped["archived_at"] = datetime.now(timezone.utc).isoformat()
+        run_query(supabase.table(table).update(stripped).in_("id", [row["id"] for row in rows]), table, "update")
+
+        archived += len(rows)
+        print(f"📦 {table}: archived {archived} row(s) (through {rows[-1]['created_at']})")
+
+    return archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old webhook_events and transaction payloads to zstd NDJSON")
+    parser.add_argument("--older-than-days", type=int, default=WEBHOOK_EVENTS_RETENTION_DAYS,
+                        help=f"Archive rows older than this many days (default: {WEBHOOK_EVENTS_RETENTION_DAYS})")
+    parser.add_argument("--archive-dir", default=WEBHOOK_ARCHIVE_DIR, help=f"Archive directory (default: {WEBHOOK_ARCHIVE_DIR})")
+    parser.add_argument("--table", choices=list(ARCHIVE_TABLES), action="append",
+                        help="Only archive this table (repeatable; default: all)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows archived per batch (default: 500)")
+    parser.add_argument("--level", type=int, default=10, help="zstd compression level (default: 10)")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the rows that would be archived")
+    parser.add_argument("--no-prune-payloads", action="store_true",
+                        help="Keep webhook_payloads rows no longer referenced after archiving")
+    args = parser.parse_args()
+
+    if not get_supabase():
+        print("❌ SUPABASE_SERVICE_KEY is not set")
+        sys.exit(1)
+
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=args.older_than_days)).isoformat()
+    tables = args.table or list(ARCHIVE_TABLES)
+
+    print("🗄️  Webhook Events Retention Job")
+    print("=" * 50)
+    print(f"Cutoff: {cutoff} ({args.older_than_days} days)")
+    print(f"Tables: {', '.join(tables)}")
+    print(f"Archive directory: {args.archive_dir}{' (dry run)' if args.dry_run else ''}")
+    print("=" * 50)
+
+    started = time.perf_counter()
+    for table in tables:
+        archive = None if args.dry_run else MonthlyArchive(args.archive_dir, table, args.level)
+        try:
+            count = archive_table(table, cutoff, archive, args.batch_size)
+        except Exception as e:
+            print(f"❌ {table}: archival stopped: {str(e)}")
+            print("💡 Re-run to continue; batches already archived are skipped.")
+            sys.exit(1)
+
+        if args.dry_run:
+            print(f"🔍 {table}: {count} row(s) would be archived")
+        else:
+            print(f"✅ {table}: {count} row(s) archived, {archive.bytes_written / 1024:.1f} KiB compressed")
+
+    if not args.dry_run and not args.no_prune_payloads:
+        try:
+            pruned = run_query(get_supabase().rpc("prune_webhook_payloads"), "webhook_payloads", "delete").data
+            print(f"🧹 Pruned {pruned} unreferenced webhook payload(s)")
+        except Exception as e:
+            # Without webhook-payloads-migration.sql there is nothing to prune
+            print(f"⚠️  Skipped webhook payload pruning: {str(e)}")
+
+    print(f"🎉 Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
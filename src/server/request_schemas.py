@@ -0,0 +1,135 @@
+"""
+Request schemas for the API: bodies are decoded and validated in one pass before any upstream call.
+Imported by app.py on first use (see request_schemas()), so pydantic stays off the cold-start path.
+"""
+from typing import Annotated, Dict, List, Literal, Optional, Union
+
+from pydantic import (
+    AfterValidator, BaseModel, ConfigDict, Discriminator, Field, StringConstraints, Tag, TypeAdapter,
+    ValidationError, field_validator, model_validator
+)
+
+NonEmptyStr = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+
+def _check_email(value: str) -> str:
+    if "@" not in value:
+        raise ValueError("Invalid email format")
+    return value
+
+EmailAddress = Annotated[NonEmptyStr, AfterValidator(_check_email)]
+
+class RequestSchema(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+class IdentityDocument(RequestSchema):
+    type: NonEmptyStr
+    value: NonEmptyStr
+    country: NonEmptyStr
+
+class CustomerAddress(RequestSchema):
+    street_line_1: NonEmptyStr
+    street_line_2: Optional[str] = None
+    city: NonEmptyStr
+    state: NonEmptyStr
+    postal_code: NonEmptyStr
+    country: NonEmptyStr
+
+class CreateCustomerRequest(RequestSchema):
+    first_name: NonEmptyStr
+    last_name: NonEmptyStr
+    email: EmailAddress
+    phone_number: NonEmptyStr
+    date_of_birth: Annotated[str, StringConstraints(pattern=r"^\d{4}-\d{2}-\d{2}$")]
+    type: Literal["individual"]
+    identity_documents: List[IdentityDocument] = Field(min_length=1)
+    address: CustomerAddress
+
+    @field_validator("phone_number")
+    @classmethod
+    def check_phone_number(cls, value: str) -> str:
+        if not any(c.isdigit() for c in value):
+            raise ValueError("Phone number must contain digits")
+        return value
+
+class UseExistingCustomerRequest(RequestSchema):
+    use_existing_customer: Literal[True]
+    existing_customer_id: NonEmptyStr
+
+def _customer_request_kind(body) -> str:
+    if isinstance(body, dict):
+        flag, existing_customer_id = body.get("use_existing_customer"), body.get("existing_customer_id")
+    else:
+        flag, existing_customer_id = getattr(body, "use_existing_customer", None), getattr(body, "existing_customer_id", None)
+    return "existing" if flag and existing_customer_id else "new"
+
+# /api/create-customer takes either a new customer or a pointer to an existing one. As before
+# the schemas, use_existing_customer without an existing_customer_id is a new-customer signup
+CreateCustomerBody = TypeAdapter(Annotated[
+    Union[Annotated[UseExistingCustomerRequest, Tag("existing")], Annotated[CreateCustomerRequest, Tag("new")]],
+    Discriminator(_customer_request_kind)
+])
+
+class PixPaymentRequest(RequestSchema):
+    amount_brl: float = Field(gt=0)
+    customer_id: NonEmptyStr
+    # Omitted right after an async signup: the customer's (possibly still provisioning) wallet is used
+    wallet_address: Optional[NonEmptyStr] = None
+    quote_id: NonEmptyStr
+    sender_name: NonEmptyStr
+    sender_document: NonEmptyStr  # CPF
+
+class SpeiPaymentRequest(RequestSchema):
+    amount_mxn: float = Field(gt=0)
+    customer_id: NonEmptyStr
+    wallet_id: Optional[NonEmptyStr] = None
+    quote_id: NonEmptyStr
+    sender_clabe: NonEmptyStr
+
+class BulkOnboardingRow(RequestSchema):
+    """One student of a bulk onboarding batch; the bank fields are all-or-nothing"""
+    id: Optional[str] = None
+    first_name: NonEmptyStr
+    last_name: NonEmptyStr
+    email: EmailAddress
+    phone_number: NonEmptyStr
+    date_of_birth: Annotated[str, StringConstraints(pattern=r"^\d{4}-\d{2}-\d{2}$")]
+    document_type: NonEmptyStr
+    document_value: NonEmptyStr
+    document_country: NonEmptyStr
+    street_line_1: NonEmptyStr
+    street_line_2: Optional[str] = None
+    city: NonEmptyStr
+    state: NonEmptyStr
+    postal_code: NonEmptyStr
+    country: NonEmptyStr
+    account_name: Optional[str] = None
+    beneficiary_name: Optional[str] = None
+    bank_name: Optional[str] = None
+    bank_account_number: Optional[str] = None
+    routing_number: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_bank_fields(self):
+        bank_fields = ["bank_name", "bank_account_number", "routing_number"]
+        provided = [field for field in bank_fields if getattr(self, field)]
+        if provided and len(provided) < len(bank_fields):
+            missing = [field for field in bank_fields if field not in provided]
+            raise ValueError(f"Missing bank fields: {', '.join(missing)}")
+        return self
+
+    @property
+    def has_bank_account(self) -> bool:
+        return bool(self.bank_account_number)
+
+    @property
+    def address(self) -> Dict[str, str]:
+        address = {
+            "street_line_1": self.street_line_1,
+            "city": self.city,
+            "state": self.state,
+            "postal_code": self.postal_code,
+            "country": self.country
+        }
+        if self.street_line_2:
+            address["street_line_2"] = self.street_line_2
+        return address
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# app.py reads its configuration at import time; keep the tests off real services
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.pop("SUPABASE_SERVICE_KEY", None)
+os.environ.setdefault("UNBLOCKPAY_AUTH_TOKEN", "test-token")
+os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The server, and the operator scripts at the repository root
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(SERVER_DIR)))
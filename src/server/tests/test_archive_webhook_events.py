@@ -0,0 +1,249 @@
+import json
+import re
+import sys
+
+import pytest
+import zstandard
+
+import app
+import archive_webhook_events as archiver
+
+CUTOFF = "2025-03-01T00:00:00+00:00"
+
+
+class Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """A select or update on one FakeSupabase table, filtered the way PostgREST would"""
+
+    def __init__(self, db, table, values=None):
+        self.db = db
+        self.table = table
+        self.values = values
+        self.filters = []
+        self.limit_to = None
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row[column] < value)
+        return self
+
+    def is_(self, column, value):
+        assert value == "null"
+        self.filters.append(lambda row: row.get(column) is None)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row[column] in values)
+        return self
+
+    def or_(self, expression):
+        # The keyset condition: (created_at, id) > cursor
+        created_at, last_id = re.fullmatch(r'created_at\.gt\."(.+)",and\(created_at\.eq\."\1",id\.gt\.(\d+)\)', expression).groups()
+        self.filters.append(lambda row: (row["created_at"], row["id"]) > (created_at, int(last_id)))
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self.limit_to = count
+        return self
+
+    def execute(self):
+        rows = [row for row in self.db.rows[self.table] if all(check(row) for check in self.filters)]
+        if self.values is None:
+            rows = sorted(rows, key=lambda row: (row["created_at"], row["id"]))[:self.limit_to]
+            return Result([dict(row) for row in rows])
+        if self.db.fail_updates:
+            raise ConnectionError("server closed the connection")
+        self.db.events.append(("update", self.table, sorted(row["id"] for row in rows)))
+        for row in rows:
+            row.update(self.values)
+        return Result(rows)
+
+
+class FakeSupabase:
+    def __init__(self, **rows):
+        self.rows = rows
+        self.events = []
+        self.fail_updates = False
+        self.pruned = False
+
+    def table(self, name):
+        self._table = name
+        return self
+
+    def select(self, columns):
+        return FakeQuery(self, self._table)
+
+    def update(self, values):
+        return FakeQuery(self, self._table, values)
+
+    def rpc(self, name):
+        assert name == "prune_webhook_payloads"
+        self.pruned = True
+        return self
+
+    def execute(self):
+        return Result(0)
+
+
+def event(row_id, created_at, **extra):
+    resource = {"id": f"tx{row_id}", "amount": "1000.00"}
+    return {"id": row_id, "created_at": created_at, "event_resource": resource,
+            "raw_payload": {"event_type": "payin.completed", "event_resource": resource}, "archived_at": None, **extra}
+
+
+def transaction(row_id, created_at, status):
+    return {"id": row_id, "created_at": created_at, "updated_at": created_at, "status": status,
+            "metadata": {"id": f"tx{row_id}"}, "archived_at": None}
+
+
+def read_archive(path):
+    with open(path, "rb") as f:
+        data = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True).read()
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeSupabase(webhook_events=[
+        event(1, "2025-01-10T00:00:00+00:00"),
+        event(2, "2025-01-20T00:00:00+00:00"),
+        event(3, "2025-01-20T00:00:00+00:00"),
+        event(4, "2025-02-05T00:00:00+00:00"),
+        event(5, "2025-03-15T00:00:00+00:00"),
+    ], transactions=[
+        transaction(1, "2025-01-10T00:00:00+00:00", "completed"),
+        transaction(2, "2025-01-11T00:00:00+00:00", "processing"),
+        transaction(3, "2025-01-12T00:00:00+00:00", "failed"),
+    ])
+    monkeypatch.setattr(archiver, "get_supabase", lambda: db)
+    monkeypatch.setattr(app, "get_supabase", lambda: db)
+    return db
+
+
+def test_batches_archived_by_month_then_stripped(db, tmp_path):
+    archive = archiver.MonthlyArchive(str(tmp_path), "webhook_events", level=3)
+    # Batches of two, with a created_at tie across the first batch boundary
+    assert archiver.archive_table("webhook_events", CUTOFF, archive, batch_size=2) == 4
+
+    january = read_archive(tmp_path / "webhook_events" / "2025-01.ndjson.zst")
+    february = read_archive(tmp_path / "webhook_events" / "2025-02.ndjson.zst")
+    assert [row["id"] for row in january] == [1, 2, 3]
+    assert [row["id"] for row in february] == [4]
+    assert january[0]["event_resource"] == {"id": "tx1", "amount": "1000.00"}
+
+    for row in db.rows["webhook_events"][:4]:
+        assert row["event_resource"] is None and row["raw_payload"] is None and row["archived_at"]
+    # Rows newer than the cutoff keep their payloads
+    assert db.rows["webhook_events"][4]["event_resource"] is not None
+    assert db.rows["webhook_events"][4]["archived_at"] is None
+
+
+def test_each_batch_fsynced_before_strip(db, tmp_path, monkeypatch):
+    real_fsync = archiver.os.fsync
+
+    def fsync(fd):
+        real_fsync(fd)
+        db.events.append(("fsync",))
+
+    monkeypatch.setattr(archiver.os, "fsync", fsync)
+    archive = archiver.MonthlyArchive(str(tmp_path), "webhook_events", level=3)
+    archiver.archive_table("webhook_events", CUTOFF, archive, batch_size=2)
+
+    # The second batch spans two months: both archive files are synced before its rows are stripped
+    assert db.events == [
+        ("fsync",), ("update", "webhook_events", [1, 2]),
+        ("fsync",), ("fsync",), ("update", "webhook_events", [3, 4]),
+    ]
+
+
+def test_failed_fsync_leaves_rows_in_database(db, tmp_path, monkeypatch):
+    def fsync(fd):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(archiver.os, "fsync", fsync)
+    archive = archiver.MonthlyArchive(str(tmp_path), "webhook_events", level=3)
+    with pytest.raises(OSError):
+        archiver.archive_table("webhook_events", CUTOFF, archive, batch_size=2)
+    assert db.events == []
+    assert all(row["event_resource"] is not None for row in db.rows["webhook_events"])
+
+
+def test_crash_before_strip_archives_twice_never_loses(db, tmp_path):
+    archive = archiver.MonthlyArchive(str(tmp_path), "webhook_events", level=3)
+    db.fail_updates = True
+    with pytest.raises(ConnectionError):
+        archiver.archive_table("webhook_events", CUTOFF, archive, batch_size=10)
+
+    # The re-run archives the same rows again, then strips them
+    db.fail_updates = False
+    assert archiver.archive_table("webhook_events", CUTOFF, archive, batch_size=10) == 4
+    january = read_archive(tmp_path / "webhook_events" / "2025-01.ndjson.zst")
+    assert [row["id"] for row in january] == [1, 2, 3, 1, 2, 3]
+    assert all(row["archived_at"] for row in db.rows["webhook_events"][:4])
+
+    # Nothing is left to archive on a third run
+    assert archiver.archive_table("webhook_events", CUTOFF, archive, batch_size=10) == 0
+
+
+def test_only_settled_transactions_archived(db, tmp_path):
+    archive = archiver.MonthlyArchive(str(tmp_path), "transactions", level=3)
+    assert archiver.archive_table("transactions", CUTOFF, archive, batch_size=10) == 2
+    assert [row["id"] for row in read_archive(tmp_path / "transactions" / "2025-01.ndjson.zst")] == [1, 3]
+    assert db.rows["transactions"][1]["metadata"] == {"id": "tx2"}
+
+
+def test_deduplicated_payloads_archived_in_full(db, tmp_path, monkeypatch):
+    resource = {"id": "tx9", "amount": "50.00"}
+    db.rows["webhook_events"] = [{
+        "id": 9, "created_at": "2025-01-05T00:00:00+00:00", "event_resource": None, "resource_hash": "abc",
+        "raw_payload": {"event_type": "payin.completed"}, "archived_at": None
+    }]
+
+    class Store:
+        def fetch_payloads(self, hashes):
+            return {"abc": resource}
+
+    monkeypatch.setattr(app, "transaction_store", Store())
+    archive = archiver.MonthlyArchive(str(tmp_path), "webhook_events", level=3)
+    archiver.archive_table("webhook_events", CUTOFF, archive, batch_size=10)
+
+    [archived] = read_archive(tmp_path / "webhook_events" / "2025-01.ndjson.zst")
+    assert archived["event_resource"] == resource
+    assert archived["raw_payload"]["event_resource"] == resource
+    # The hash reference is cleared so the payload can be pruned
+    assert db.rows["webhook_events"][0]["resource_hash"] is None
+
+
+def run_main(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["archive_webhook_events.py", *args])
+    try:
+        archiver.main()
+    except SystemExit as e:
+        return e.code
+    return 0
+
+
+def test_dry_run_writes_nothing(db, tmp_path, monkeypatch, capsys):
+    assert run_main(monkeypatch, "--dry-run", "--archive-dir", str(tmp_path / "archives"), "--older-than-days", "0") == 0
+    assert "5 row(s) would be archived" in capsys.readouterr().out
+    assert not (tmp_path / "archives").exists()
+    assert db.events == [] and not db.pruned
+
+
+def test_run_prunes_unreferenced_payloads(db, tmp_path, monkeypatch):
+    assert run_main(monkeypatch, "--archive-dir", str(tmp_path), "--older-than-days", "0", "--table", "transactions") == 0
+    assert db.pruned
+    assert not (tmp_path / "webhook_events").exists()
+
+
+def test_stops_when_a_batch_fails(db, tmp_path, monkeypatch, capsys):
+    db.fail_updates = True
+    assert run_main(monkeypatch, "--archive-dir", str(tmp_path), "--older-than-days", "0") == 1
+    assert "Re-run to continue" in capsys.readouterr().out
+    assert not db.pruned
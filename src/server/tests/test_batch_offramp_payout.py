@@ -0,0 +1,162 @@
+import json
+import sys
+
+import pytest
+import requests
+
+import batch_offramp_payout as batch
+import offramp_payout
+
+
+class Sent(list):
+    failing = set()
+    rejected = set()
+
+
+@pytest.fixture
+def payouts(monkeypatch):
+    """
+    Wallets paid out from; those in sent.failing raise after sending (e.g. a read timeout),
+    those in sent.rejected get a 4xx
+    """
+    sent = Sent()
+
+    def fake_create_payout(quote_id, amount, wallet_id, external_account_id, quiet):
+        assert quiet
+        sent.append(wallet_id)
+        if wallet_id in sent.failing:
+            raise TimeoutError("read timed out")
+        if wallet_id in sent.rejected:
+            raise offramp_payout.PayoutRejected(422, '{"error": "insufficient balance"}')
+        return {"id": f"payout-{wallet_id}"}
+
+    monkeypatch.setattr(batch, "create_offramp_quote", lambda quiet: {"id": "quote-1", "expires_at": 4102444800})
+    monkeypatch.setattr(batch, "create_payout", fake_create_payout)
+    return sent
+
+
+def run(monkeypatch, tmp_path, input_path, *extra):
+    monkeypatch.setattr(sys, "argv", [
+        "batch_offramp_payout.py", str(input_path), "--yes", "--rate", "0",
+        "--report", str(tmp_path / "report.csv"), *extra
+    ])
+    try:
+        batch.main()
+    except SystemExit as e:
+        return e.code
+    return 0
+
+
+def write_csv(path, rows):
+    path.write_text("wallet_id,external_account_id,amount\n" + "".join(f"{w},{a},{n}\n" for w, a, n in rows))
+
+
+def test_resume_skips_completed_rows(monkeypatch, tmp_path, payouts):
+    input_path = tmp_path / "payouts.csv"
+    write_csv(input_path, [("w1", "a1", 10), ("w2", "a1", 20)])
+    assert run(monkeypatch, tmp_path, input_path) == 0
+    assert sorted(payouts) == ["w1", "w2"]
+
+    # Rows inserted above do not change the keys of rows already paid out
+    write_csv(input_path, [("w0", "a1", 5), ("w1", "a1", 10), ("w2", "a1", 20)])
+    payouts.clear()
+    assert run(monkeypatch, tmp_path, input_path) == 0
+    assert payouts == ["w0"]
+
+
+def test_attempted_rows_flagged_not_retried(monkeypatch, tmp_path, payouts):
+    input_path = tmp_path / "payouts.csv"
+    write_csv(input_path, [("w1", "a1", 10), ("w2", "a1", 20)])
+    payouts.failing = {"w2"}
+    assert run(monkeypatch, tmp_path, input_path) == 1
+
+    payouts.clear()
+    payouts.failing = set()
+    assert run(monkeypatch, tmp_path, input_path) == 1
+    assert payouts == []
+
+    assert run(monkeypatch, tmp_path, input_path, "--retry-unconfirmed") == 0
+    assert payouts == ["w2"]
+
+
+def test_rejected_rows_retried_without_flag(monkeypatch, tmp_path, payouts):
+    input_path = tmp_path / "payouts.csv"
+    write_csv(input_path, [("w1", "a1", 10), ("w2", "a1", 20)])
+    payouts.rejected = {"w2"}
+    assert run(monkeypatch, tmp_path, input_path) == 1
+
+    # A 4xx created no payout, so the row is not held back for manual checking
+    payouts.clear()
+    payouts.rejected = set()
+    assert run(monkeypatch, tmp_path, input_path) == 0
+    assert payouts == ["w2"]
+
+
+def test_rows_failing_before_send_are_retried(monkeypatch, tmp_path, payouts):
+    input_path = tmp_path / "payouts.csv"
+    write_csv(input_path, [("w1", "a1", 10)])
+    monkeypatch.setattr(batch, "create_offramp_quote", lambda quiet: None)
+    assert run(monkeypatch, tmp_path, input_path) == 1
+    assert payouts == []
+
+    monkeypatch.setattr(batch, "create_offramp_quote", lambda quiet: {"id": "quote-1", "expires_at": 4102444800})
+    assert run(monkeypatch, tmp_path, input_path) == 0
+    assert payouts == ["w1"]
+
+
+def test_identical_rows_keyed_separately(tmp_path):
+    input_path = tmp_path / "payouts.csv"
+    write_csv(input_path, [("w1", "a1", 10), ("w1", "a1", 10)])
+    keys = [row["key"] for row in batch.load_rows(str(input_path))]
+    assert len(set(keys)) == 2
+
+
+def test_jsonl_non_string_ids(tmp_path):
+    input_path = tmp_path / "payouts.jsonl"
+    input_path.write_text(json.dumps({"id": 7, "wallet_id": 123, "external_account_id": "a1", "amount": 10}) + "\n")
+    assert batch.load_rows(str(input_path)) == [
+        {"key": "7", "wallet_id": "123", "external_account_id": "a1", "amount": 10.0}
+    ]
+
+
+def test_invalid_amount_rejected(tmp_path):
+    input_path = tmp_path / "payouts.jsonl"
+    input_path.write_text(json.dumps({"wallet_id": "w1", "external_account_id": "a1", "amount": "ten"}) + "\n")
+    with pytest.raises(ValueError, match="Row 1"):
+        batch.load_rows(str(input_path))
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+
+def test_quiet_payout_raises_rejection_without_printing(monkeypatch, capsys):
+    monkeypatch.setattr(offramp_payout.requests, "post", lambda *args, **kwargs: FakeResponse(422, {"error": "bad quote"}))
+    with pytest.raises(offramp_payout.PayoutRejected) as rejected:
+        offramp_payout.create_payout("quote-1", 10, "w1", "a1", quiet=True)
+    assert rejected.value.status_code == 422
+    assert capsys.readouterr().out == ""
+
+
+def test_quiet_payout_reraises_errors_that_may_have_created_it(monkeypatch):
+    def timeout(*args, **kwargs):
+        raise requests.Timeout("read timed out")
+
+    monkeypatch.setattr(offramp_payout.requests, "post", timeout)
+    with pytest.raises(requests.Timeout):
+        offramp_payout.create_payout("quote-1", 10, "w1", "a1", quiet=True)
+    monkeypatch.setattr(offramp_payout.requests, "post", lambda *args, **kwargs: FakeResponse(502, {}))
+    with pytest.raises(requests.HTTPError):
+        offramp_payout.create_payout("quote-1", 10, "w1", "a1", quiet=True)
+    # The standalone script keeps logging and returning None
+    assert offramp_payout.create_payout("quote-1", 10, "w1", "a1") is None
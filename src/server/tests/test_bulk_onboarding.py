@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+import app
+
+ROW = {
+    "first_name": "Ana", "last_name": "Silva", "email": "ana@example.com", "phone_number": "+5511999999999",
+    "date_of_birth": "2000-01-31", "document_type": "cpf", "document_value": "111", "document_country": "BRA",
+    "street_line_1": "Rua A 1", "city": "Sao Paulo", "state": "SP", "postal_code": "01000-000", "country": "BRA",
+    "bank_name": "Bank", "bank_account_number": "123", "routing_number": "021000021"
+}
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Existing customer with document 222; counts created customers, wallets and accounts"""
+    created = {"customers": [], "wallets": [], "accounts": []}
+    existing = [{"id": "customer-existing", "identity_documents": [{"value": "222"}]}]
+
+    def fake_request(method, url, **kwargs):
+        return FakeResponse(existing if url.endswith("/customers") else [])
+
+    def create_customer(**fields):
+        created["customers"].append(fields["document_value"])
+        return {"id": f"customer-{fields['document_value']}"}
+
+    def create_wallet(customer_id, name, blockchain):
+        created["wallets"].append(customer_id)
+        return {"id": f"wallet-{customer_id}", "address": "addr"}
+
+    def create_account(**fields):
+        created["accounts"].append(fields["customer_id"])
+        return {"id": "account-1"}
+
+    monkeypatch.setattr(app, "ADMIN_API_TOKEN", "admin")
+    monkeypatch.setattr(app, "unblockpay_request", fake_request)
+    monkeypatch.setattr(app, "create_individual_customer", create_customer)
+    monkeypatch.setattr(app, "create_wallet", create_wallet)
+    monkeypatch.setattr(app, "fetch_customer_wallet", lambda customer_id: {"id": "wallet-existing", "address": "addr"})
+    monkeypatch.setattr(app, "create_external_account", create_account)
+    return created
+
+
+def post_jsonl(lines):
+    return app.create_app({"TESTING": True}).test_client().post(
+        "/api/admin/bulk-onboarding",
+        data="\n".join(lines),
+        content_type="application/x-ndjson",
+        headers={"X-Admin-Token": "admin"}
+    )
+
+
+def results(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+@pytest.mark.parametrize("line", ["[1, 2]", '"x"', "5", "null"])
+def test_non_object_line_rejected_with_line_number(upstream, line):
+    response = post_jsonl([json.dumps(ROW), "", line])
+    assert response.status_code == 400
+    assert "line 3" in response.get_json()["error"]
+    assert upstream["customers"] == []
+
+
+def test_malformed_json_line_rejected_with_line_number(upstream):
+    response = post_jsonl([json.dumps(ROW), "{not json"])
+    assert response.status_code == 400
+    assert "line 2" in response.get_json()["error"]
+
+
+def test_rows_onboarded_with_invalid_and_duplicate_rows_reported(upstream):
+    response = post_jsonl([
+        json.dumps({**ROW, "id": "a"}),
+        json.dumps({**ROW, "id": "b"}),
+        json.dumps({**ROW, "id": "c", "email": "no-at-sign"}),
+        json.dumps({**ROW, "id": "d", "document_value": "222"}),
+    ])
+    assert response.status_code == 200
+    lines = results(response)
+    by_id = {line["id"]: line for line in lines if "id" in line}
+
+    assert by_id["b"]["status"] == "duplicate"
+    assert by_id["c"]["status"] == "invalid"
+    assert "email" in by_id["c"]["error"]
+    assert by_id["a"]["status"] == "success" and by_id["a"]["customer_created"]
+    # The existing customer is reused, and the shared bank account is created only once
+    assert by_id["d"]["customer_id"] == "customer-existing"
+    assert not by_id["d"]["customer_created"]
+    assert upstream["customers"] == ["111"]
+    assert len(upstream["accounts"]) == 1
+    assert lines[-1]["summary"] == {"rows": 4, "success": 2, "failed": 0, "invalid": 1, "duplicate": 1}
+
+
+def test_batch_needs_admin_token(upstream):
+    response = app.create_app({"TESTING": True}).test_client().post(
+        "/api/admin/bulk-onboarding", data=json.dumps(ROW), content_type="application/x-ndjson"
+    )
+    assert response.status_code == 401
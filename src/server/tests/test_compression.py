@@ -0,0 +1,135 @@
+import gzip
+import json
+from collections import OrderedDict
+
+import brotli
+import pytest
+from flask import Response, jsonify, stream_with_context
+
+import app
+
+LARGE = {"transactions": [{"id": f"tx{i}", "status": "completed", "amount_usd": 184.5} for i in range(200)]}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "COMPRESSION_ENABLED", True)
+    monkeypatch.setattr(app, "COMPRESSION_MIN_BYTES", 1024)
+    monkeypatch.setattr(app, "_compressed_cache", OrderedDict())
+    flask_app = app.create_app({"TESTING": True})
+
+    @flask_app.route("/test/large")
+    def large():
+        return jsonify(LARGE)
+
+    @flask_app.route("/test/small")
+    def small():
+        return jsonify({"ok": True})
+
+    @flask_app.route("/test/error")
+    def error():
+        return jsonify(LARGE), 500
+
+    @flask_app.route("/test/stream")
+    def stream():
+        return Response(stream_with_context(iter(["x" * 2048])), mimetype="application/x-ndjson")
+
+    return flask_app.test_client()
+
+
+def test_gzip_when_accepted(client):
+    response = client.get("/test/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) == len(response.get_data())
+    assert json.loads(gzip.decompress(response.get_data())) == LARGE
+
+
+def test_brotli_preferred(client):
+    response = client.get("/test/large", headers={"Accept-Encoding": "gzip, deflate, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert json.loads(brotli.decompress(response.get_data())) == LARGE
+
+
+def test_gzip_without_brotli_package(client, monkeypatch):
+    monkeypatch.setattr(app, "brotli", None)
+    response = client.get("/test/large", headers={"Accept-Encoding": "br, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+@pytest.mark.parametrize("path, headers", [
+    ("/test/large", {}),
+    ("/test/large", {"Accept-Encoding": "identity"}),
+    ("/test/small", {"Accept-Encoding": "gzip"}),
+    ("/test/error", {"Accept-Encoding": "gzip"}),
+    ("/test/stream", {"Accept-Encoding": "gzip"}),
+])
+def test_sent_uncompressed(client, path, headers):
+    response = client.get(path, headers=headers)
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_identical_bodies_compressed_once(client):
+    client.get("/test/large", headers={"Accept-Encoding": "gzip"})
+    hits = app.CACHE_REQUESTS.labels("compression", "hit")._value.get()
+    second = client.get("/test/large", headers={"Accept-Encoding": "gzip"})
+    assert app.CACHE_REQUESTS.labels("compression", "hit")._value.get() == hits + 1
+    assert json.loads(gzip.decompress(second.get_data())) == LARGE
+    # Each encoding is cached separately
+    assert len(app._compressed_cache) == 1
+    client.get("/test/large", headers={"Accept-Encoding": "br"})
+    assert len(app._compressed_cache) == 2
+
+
+def test_cache_bounded(client, monkeypatch):
+    monkeypatch.setattr(app, "COMPRESSION_CACHE_ENTRIES", 2)
+    for i in range(4):
+        app.compress_body((b"body %d" % i) * 100, "gzip")
+    assert len(app._compressed_cache) == 2
+
+
+class FakeResponse:
+    status_code = 201
+    headers = {}
+    text = "{}"
+
+    def json(self):
+        return {"id": "payin-1", "status": "pending", "sender_deposit_instructions": {"deposit_address": "pix-code"}}
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def pix(client, monkeypatch):
+    monkeypatch.setattr(app, "OMIT_RESPONSE_ECHOES", False)
+    monkeypatch.setattr(app, "unblockpay_request", lambda *args, **kwargs: FakeResponse())
+
+    def create(headers=None, query=""):
+        return client.post(f"/api/create-pix-payment{query}", headers=headers or {}, json={
+            "amount_brl": 100, "customer_id": "c1", "wallet_address": "w1", "quote_id": "q1",
+            "sender_name": "Ana", "sender_document": "12345678900"
+        })
+    return create
+
+
+def test_payin_echo_included_by_default(pix):
+    response = pix()
+    assert response.status_code == 201
+    assert response.get_json()["transaction"]["id"] == "payin-1"
+    assert "Preference-Applied" not in response.headers
+
+
+def test_prefer_minimal_omits_echo(pix):
+    response = pix(headers={"Prefer": "return=minimal"})
+    body = response.get_json()
+    assert "transaction" not in body
+    assert (body["transaction_id"], body["deposit_address"]) == ("payin-1", "pix-code")
+    assert response.headers["Preference-Applied"] == "return=minimal"
+
+
+def test_minimal_query_and_server_setting_omit_echo(pix, monkeypatch):
+    assert "transaction" not in pix(query="?minimal=true").get_json()
+    monkeypatch.setattr(app, "OMIT_RESPONSE_ECHOES", True)
+    assert "transaction" not in pix().get_json()
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+import app
+
+
+def not_at_build_time():
+    raise AssertionError("upstream client created while building the app")
+
+
+def test_apps_with_different_config_are_isolated(monkeypatch):
+    monkeypatch.setattr(app, "get_supabase", not_at_build_time)
+    monkeypatch.setattr(app, "get_unblockpay_session", not_at_build_time)
+
+    debug_app = app.create_app({"DEBUG": True, "ADMIN_NOTE": "debug"})
+    quiet_app = app.create_app({"TESTING": True})
+
+    assert debug_app is not quiet_app
+    assert debug_app.config["ADMIN_NOTE"] == "debug"
+    assert "ADMIN_NOTE" not in quiet_app.config
+    assert "ADMIN_NOTE" not in app.app.config
+
+    # Both serve the blueprint's routes, each rendering JSON per its own config
+    debug_body = debug_app.test_client().get("/").get_data(as_text=True)
+    quiet_body = quiet_app.test_client().get("/").get_data(as_text=True)
+    assert debug_body.startswith("{\n  ")
+    assert "\n  " not in quiet_body
+    assert json.loads(quiet_body) == json.loads(debug_body) == {"status": "healthy", "service": "tuition-bridge-backend"}
+
+
+@pytest.mark.skipif(app.orjson is None, reason="orjson is not installed")
+def test_json_provider_per_app():
+    assert isinstance(app.create_app().json, app.OrjsonProvider)
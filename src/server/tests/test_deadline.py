@@ -0,0 +1,73 @@
+import time
+
+import pytest
+import requests
+from flask import jsonify
+
+import app
+
+
+def test_timeout_capped_by_remaining_budget():
+    assert app.upstream_timeout(10) == 10
+    with app.deadline_scope(0.5):
+        assert 0.4 < app.upstream_timeout(10) <= 0.5
+        assert app.upstream_timeout(0.1) == 0.1
+    assert app.remaining_budget() is None
+
+
+def test_spent_budget_fails_before_calling_upstream(monkeypatch):
+    monkeypatch.setattr(app, "get_unblockpay_session", lambda: pytest.fail("upstream called after the deadline"))
+    with app.deadline_scope(0.01):
+        time.sleep(0.02)
+        with pytest.raises(app.DeadlineExceeded):
+            app.unblockpay_request("GET", f"{app.BASE_URL}/customers")
+
+
+def test_nested_scope_restores_outer_budget():
+    with app.deadline_scope(5):
+        with app.deadline_scope(None):
+            assert app.remaining_budget() is None
+        assert app.remaining_budget() > 4
+
+
+class TimeoutRecordingSession:
+    def __init__(self):
+        self.timeouts = []
+
+    def request(self, method, url, timeout, **kwargs):
+        self.timeouts.append(timeout)
+        raise requests.ConnectionError("refused")
+
+
+def test_retries_stop_when_budget_cannot_cover_backoff(monkeypatch):
+    session = TimeoutRecordingSession()
+    monkeypatch.setattr(app, "get_unblockpay_session", lambda: session)
+    monkeypatch.setattr(app, "circuit_breakers", {})
+    monkeypatch.setattr(app, "acquire_rate_limit_token", lambda endpoint: None)
+    monkeypatch.setattr(app, "UNBLOCKPAY_MAX_RETRIES", 5)
+    monkeypatch.setattr(app, "_retry_delay", lambda attempt, response=None: 1.0)
+
+    with app.deadline_scope(0.5):
+        with pytest.raises(requests.ConnectionError):
+            app.unblockpay_request("GET", f"{app.BASE_URL}/customers")
+    # A 1 s backoff does not fit in the 0.5 s budget, so there is no retry
+    assert len(session.timeouts) == 1
+    assert session.timeouts[0] <= 0.5
+
+
+def test_request_past_its_deadline_gets_504(monkeypatch):
+    monkeypatch.setattr(app, "REQUEST_DEADLINE_SECONDS", 0.01)
+    flask_app = app.create_app({"TESTING": True})
+
+    @flask_app.route("/slow")
+    def slow():
+        time.sleep(0.02)
+        app.upstream_timeout()
+        return jsonify({"status": "ok"})
+
+    response = flask_app.test_client().get("/slow")
+    assert response.status_code == 504
+    assert "deadline" in response.get_json()["error"]
+    # The budget ends with the request
+    assert app.remaining_budget() is None
+
@@ -0,0 +1,110 @@
+import json
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "ADMIN_API_TOKEN", "admin-token")
+    monkeypatch.setattr(app, "get_supabase", lambda: object())
+    return app.create_app({"TESTING": True}).test_client()
+
+
+def failing_rows(*args):
+    yield {"id": "1", "created_at": "2025-01-01T00:00:00+00:00"}
+    yield {"id": "2", "created_at": "2025-01-02T00:00:00+00:00"}
+    raise RuntimeError("statement timeout")
+
+
+def read_stream(response):
+    chunks = []
+    with pytest.raises(RuntimeError, match="statement timeout"):
+        for chunk in response.response:
+            chunks.append(chunk.decode() if isinstance(chunk, bytes) else chunk)
+    return "".join(chunks)
+
+
+@pytest.mark.parametrize("export_format, trailer", [
+    ("ndjson", '{"error":"Export failed after 2 rows: statement timeout"}\n'),
+    ("csv", "# ERROR: Export failed after 2 rows: statement timeout\n"),
+])
+def test_export_failure_ends_with_error_and_aborts(monkeypatch, client, export_format, trailer):
+    monkeypatch.setattr(app, "iter_export_rows", failing_rows)
+    response = client.get(f"/api/admin/export/webhook_events?format={export_format}",
+                          headers={"Authorization": "Bearer admin-token"}, buffered=False)
+    assert response.status_code == 200
+
+    body = read_stream(response)
+    assert body.endswith(trailer)
+    assert '"2"' in body or "\n2," in body
+
+
+def test_export_success_has_no_trailer(monkeypatch, client):
+    monkeypatch.setattr(app, "iter_export_rows", lambda *args: iter([{"id": "1"}]))
+    response = client.get("/api/admin/export/webhook_events", headers={"Authorization": "Bearer admin-token"})
+    assert response.get_data(as_text=True) == '{"id":"1"}\n'
+
+
+requires_db = pytest.mark.skipif(not app.DATABASE_URL, reason="DATABASE_URL is not set")
+
+
+@pytest.fixture
+def pool_only_client(monkeypatch):
+    """Export with only the DATABASE_URL pool configured (no Supabase client)"""
+    monkeypatch.setattr(app, "ADMIN_API_TOKEN", "admin-token")
+    monkeypatch.setattr(app, "get_supabase", lambda: None)
+    monkeypatch.setattr(app, "EXPORT_PAGE_SIZE", 2)
+    app.get_db_pool().wait(timeout=10)
+    return app.create_app({"TESTING": True}).test_client()
+
+
+@pytest.fixture
+def exported_customer():
+    """A customer with five webhook events (two sharing a created_at) and one transaction"""
+    customer_id = f"test-{uuid.uuid4()}"
+    user_id = str(uuid.uuid4())
+    with app.get_db_pool().connection() as conn:
+        conn.execute("INSERT INTO auth.users (id) VALUES (%s)", (user_id,))
+        conn.execute("INSERT INTO public.user_profiles (id, unblockpay_customer_id) VALUES (%s, %s)", (user_id, customer_id))
+        for i, day in enumerate([1, 2, 2, 3, 4]):
+            conn.execute(
+                "INSERT INTO public.webhook_events (event_type, status, customer_id, transaction_id, created_at) "
+                "VALUES ('payin.completed', 'completed', %s, %s, %s)",
+                (customer_id, f"tx-{i}", datetime(2025, 1, day, tzinfo=timezone.utc))
+            )
+        conn.execute(
+            "INSERT INTO public.transactions (user_id, unblockpay_transaction_id, type, status, amount_usd) "
+            "VALUES (%s, 'tx-0', 'payin', 'completed', 18.45)",
+            (user_id,)
+        )
+    yield customer_id
+    with app.get_db_pool().connection() as conn:
+        conn.execute("DELETE FROM public.webhook_events WHERE customer_id = %s", (customer_id,))
+        conn.execute("DELETE FROM public.user_profiles WHERE id = %s", (user_id,))
+        conn.execute("DELETE FROM auth.users WHERE id = %s", (user_id,))
+
+
+@requires_db
+def test_export_pages_through_pool_without_supabase(pool_only_client, exported_customer):
+    response = pool_only_client.get(f"/api/admin/export/webhook_events?customer_id={exported_customer}&since=2025-01-02",
+                                     headers={"Authorization": "Bearer admin-token"})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    # Keyset pages of 2 rows, continuing correctly past the two rows with the same created_at
+    assert sorted(row["transaction_id"] for row in rows[:2]) == ["tx-1", "tx-2"]
+    assert [row["transaction_id"] for row in rows[2:]] == ["tx-3", "tx-4"]
+    assert [(row["created_at"], row["id"]) for row in rows] == sorted((row["created_at"], row["id"]) for row in rows)
+
+
+@requires_db
+def test_export_transactions_by_customer_through_pool(pool_only_client, exported_customer):
+    response = pool_only_client.get(f"/api/admin/export/transactions?customer_id={exported_customer}&format=csv",
+                                    headers={"Authorization": "Bearer admin-token"})
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].startswith("id,created_at")
+    assert len(lines) == 2
+    assert ",tx-0," in lines[1]
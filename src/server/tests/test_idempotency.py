@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+import app
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    store = app.IdempotencyStore(str(tmp_path / "idempotency.sqlite3"), ttl_seconds=3600, max_entries=10,
+                                 wait_seconds=5, pending_timeout_seconds=120)
+    monkeypatch.setattr(app, "idempotency_store", store)
+    return store
+
+
+@pytest.fixture
+def payments():
+    """A payment view counting how often it really ran"""
+    calls = []
+    release = threading.Event()
+    release.set()
+    flask_app = Flask(__name__)
+
+    @flask_app.route("/pay", methods=["POST"])
+    @app.idempotent
+    def pay():
+        calls.append(1)
+        release.wait(5)
+        return jsonify({"payment": len(calls)}), 201
+
+    flask_app.calls, flask_app.release = calls, release
+    return flask_app
+
+
+def pay(client, key, body=None):
+    return client.post("/pay", json=body or {"amount": 10}, headers={"Idempotency-Key": key})
+
+
+def test_repeat_replays_stored_response(store, payments):
+    client = payments.test_client()
+    first = pay(client, "key-1")
+    second = pay(client, "key-1")
+
+    assert first.status_code == second.status_code == 201
+    assert second.get_json() == first.get_json() == {"payment": 1}
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert len(payments.calls) == 1
+
+
+def test_repeat_replayed_by_another_worker(monkeypatch, store, payments):
+    pay(payments.test_client(), "key-1")
+    # A second worker shares the SQLite file but not the in-process cache
+    monkeypatch.setattr(app, "idempotency_store", app.IdempotencyStore(store.path, 3600, 10, 5))
+
+    response = pay(payments.test_client(), "key-1")
+    assert response.get_json() == {"payment": 1}
+    assert len(payments.calls) == 1
+
+
+def test_key_reused_with_other_body_rejected(store, payments):
+    client = payments.test_client()
+    pay(client, "key-1", {"amount": 10})
+    assert pay(client, "key-1", {"amount": 20}).status_code == 422
+
+
+def test_concurrent_duplicate_waits_for_original(store, payments):
+    payments.release.clear()
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(pay(payments.test_client(), "key-1"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while not payments.calls:
+        time.sleep(0.01)
+    payments.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(payments.calls) == 1
+    assert [response.get_json() for response in responses] == [{"payment": 1}, {"payment": 1}]
+
+
+def test_stale_pending_key_claimed_again(store, payments):
+    store.pending_timeout_seconds = 0
+    with sqlite3.connect(store.path) as conn:
+        store._connect().close()
+        conn.execute("INSERT INTO idempotency_keys (scope, fingerprint, state, created_at) VALUES ('pay:key-1', 'x', 'pending', 0)")
+
+    assert pay(payments.test_client(), "key-1").status_code == 201
+    assert len(payments.calls) == 1
+
+
+def test_unavailable_store_refuses_request(store, payments, tmp_path):
+    store.path = str(tmp_path / "missing" / "idempotency.sqlite3")
+
+    response = pay(payments.test_client(), "key-1")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert payments.calls == []
+    assert store._inflight == {}
@@ -0,0 +1,82 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from flask import jsonify, request
+
+import app
+
+BIG = 2 ** 70
+
+
+@pytest.fixture
+def flask_app():
+    flask_app = app.create_app({"TESTING": True})
+
+    @flask_app.route("/test/echo", methods=["POST"])
+    def echo():
+        body = request.get_json()
+        return jsonify({"body": body, "types": {key: type(value).__name__ for key, value in body.items()}})
+
+    return flask_app
+
+
+def test_provider_installed(flask_app):
+    assert isinstance(flask_app.json, app.OrjsonProvider)
+
+
+@pytest.mark.parametrize("value", [BIG, -BIG, 2 ** 64, [1, {"n": BIG}]])
+def test_ints_over_64_bits_encoded_exactly(flask_app, value):
+    assert json.loads(flask_app.json.dumps({"value": value})) == {"value": value}
+    with flask_app.test_request_context():
+        assert json.loads(jsonify(value=value).get_data()) == {"value": value}
+
+
+@pytest.mark.parametrize("body", [
+    b'{"amount": 1180591620717411303424}',
+    b'{"amount": -9223372036854775809}',
+    '{"amount": 18446744073709551616}',
+])
+def test_ints_over_64_bits_parsed_exactly(flask_app, body):
+    assert flask_app.json.loads(body) == json.loads(body)
+    assert isinstance(flask_app.json.loads(body)["amount"], int)
+
+
+def test_request_bodies_parsed_exactly(flask_app):
+    client = flask_app.test_client()
+    response = client.post("/test/echo", data=f'{{"id": "tx1", "amount": {BIG}, "rate": 5.42}}', content_type="application/json")
+    assert response.get_json() == {"body": {"id": "tx1", "amount": BIG, "rate": 5.42}, "types": {"id": "str", "amount": "int", "rate": "float"}}
+
+
+def test_invalid_body_is_a_bad_request(flask_app):
+    response = flask_app.test_client().post("/test/echo", data=b'{"id": ', content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_non_native_types_keep_flask_format(flask_app):
+    when = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    payload = {"at": when, "amount": Decimal("10.50"), "id": uuid.UUID(int=1)}
+    stdlib = app.create_app({"TESTING": True})
+    stdlib.json = stdlib.json_provider_class(stdlib)
+
+    assert json.loads(flask_app.json.dumps(payload)) == json.loads(stdlib.json.dumps(payload))
+    assert json.loads(flask_app.json.dumps(payload))["at"] == "Thu, 02 Jan 2025 03:04:05 GMT"
+    assert json.loads(flask_app.json.dumps({7: "non-str key"})) == {"7": "non-str key"}
+
+
+def test_keys_keep_insertion_order(flask_app):
+    with flask_app.test_request_context():
+        body = jsonify({"b": 1, "a": 2}).get_data()
+    assert body == b'{"b":1,"a":2}\n'
+
+
+def test_debug_responses_indented(flask_app):
+    flask_app.debug = True
+    with flask_app.test_request_context():
+        assert jsonify(a=1).get_data() == b'{\n  "a": 1\n}\n'
+
+
+def test_jsonb_values_fall_back_for_big_ints():
+    assert json.loads(app._jsonb_dumps({"n": BIG, 1: "x"})) == {"n": BIG, "1": "x"}
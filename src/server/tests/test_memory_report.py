@@ -0,0 +1,82 @@
+import tracemalloc
+
+import pytest
+from prometheus_client import REGISTRY
+
+import app
+
+ADMIN = {"X-Admin-Token": "admin"}
+
+retained = []
+
+
+def leak_chunks():
+    retained.extend(bytearray(64 * 1024) for _ in range(32))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "ADMIN_API_TOKEN", "admin")
+    was_tracing = tracemalloc.is_tracing()
+    yield app.create_app({"TESTING": True}).test_client()
+    retained.clear()
+    app._memory_baseline = None
+    app._memory_baseline_taken_at = None
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def test_requires_admin_token(client):
+    assert client.get("/api/admin/memory").status_code == 401
+    assert client.post("/api/admin/memory/snapshot", headers={"X-Admin-Token": "wrong"}).status_code == 401
+
+
+def test_report_without_tracing(client):
+    tracemalloc.stop()
+    report = client.get("/api/admin/memory", headers=ADMIN).get_json()
+    assert report["tracemalloc"]["tracing"] is False
+    assert "snapshot" in report["tracemalloc"]["message"]
+    assert set(report["cached_objects"]) >= {"webhook_status_tracker", "processed_transactions", "circuit_breakers"}
+    assert report["rss_bytes"] > 0
+
+
+def test_growth_since_snapshot_points_at_allocation_site(client):
+    started = client.post("/api/admin/memory/snapshot", headers=ADMIN).get_json()
+    assert started["tracing"] is True
+    assert tracemalloc.is_tracing()
+
+    leak_chunks()
+    report = client.get("/api/admin/memory?limit=5", headers=ADMIN).get_json()["tracemalloc"]
+    assert report["baseline_taken_at"] == started["baseline_taken_at"]
+    assert len(report["top"]) <= 5
+    top_growth = report["growth"][0]
+    assert "test_memory_report.py" in top_growth["site"]
+    assert top_growth["size_diff_bytes"] >= 32 * 64 * 1024
+
+    # rebase=true makes this the new baseline, so the same allocations are no longer growth
+    client.get("/api/admin/memory?rebase=true", headers=ADMIN)
+    report = client.get("/api/admin/memory", headers=ADMIN).get_json()["tracemalloc"]
+    assert all("test_memory_report.py" not in stat["site"] or stat["size_diff_bytes"] < 64 * 1024 for stat in report["growth"])
+
+
+def test_group_by_validated(client):
+    client.post("/api/admin/memory/snapshot", headers=ADMIN)
+    response = client.get("/api/admin/memory?group_by=module", headers=ADMIN)
+    assert response.status_code == 400
+
+    report = client.get("/api/admin/memory?group_by=traceback&limit=1", headers=ADMIN).get_json()
+    assert "traceback" in report["tracemalloc"]["top"][0]
+
+
+def test_delete_stops_tracing(client):
+    client.post("/api/admin/memory/snapshot", headers=ADMIN)
+    assert client.delete("/api/admin/memory/snapshot", headers=ADMIN).get_json() == {"tracing": False}
+    assert not tracemalloc.is_tracing()
+    assert app._memory_baseline is None
+
+
+def test_cache_gauges_follow_cache_sizes(monkeypatch):
+    monkeypatch.setattr(app, "processed_transactions", {"tx1", "tx2", "tx3"})
+    assert REGISTRY.get_sample_value("cached_objects", {"cache": "processed_transactions"}) == 3
+    monkeypatch.setattr(app, "webhook_status_tracker", {"tx1": {}})
+    assert REGISTRY.get_sample_value("webhook_status_tracker_entries") == 1
@@ -0,0 +1,132 @@
+import pytest
+import requests
+from prometheus_client import REGISTRY, Gauge
+
+import app
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def scraped(gauge):
+    return gauge.collect()[0].samples[0].value
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeSession:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def request(self, method, url, **kwargs):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+@pytest.fixture
+def client():
+    return app.create_app({"TESTING": True}).test_client()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(app, "circuit_breakers", {})
+    monkeypatch.setattr(app, "acquire_rate_limit_token", lambda endpoint: None)
+    monkeypatch.setattr(app, "UNBLOCKPAY_MAX_RETRIES", 0)
+
+    def use(outcome):
+        monkeypatch.setattr(app, "get_unblockpay_session", lambda: FakeSession(outcome))
+    return use
+
+
+def test_request_latency_labelled_by_route_template(client):
+    labels = {"route": "/api/webhook-status/<transaction_id>", "method": "GET", "status": "200"}
+    before = sample("http_request_duration_seconds_count", **labels)
+
+    assert client.get("/api/webhook-status/tx-metrics-1").status_code == 200
+    assert client.get("/api/webhook-status/tx-metrics-2").status_code == 200
+    assert sample("http_request_duration_seconds_count", **labels) == before + 2
+
+
+def test_metrics_endpoint_exposes_histograms(client):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket{le="+Inf",method="GET",route="/health",status="200"}' in body
+    assert "# TYPE unblockpay_request_duration_seconds histogram" in body
+    assert "# TYPE supabase_query_duration_seconds histogram" in body
+
+
+def test_upstream_call_recorded_per_endpoint_class(upstream):
+    labels = {"endpoint": "customers/wallets", "method": "GET"}
+    before = sample("unblockpay_request_duration_seconds_count", **labels)
+    before_ok = sample("unblockpay_responses_total", status="200", **labels)
+
+    upstream(FakeResponse(200))
+    app.unblockpay_request("GET", f"{app.BASE_URL}/customers/c1/wallets")
+    app.unblockpay_request("GET", f"{app.BASE_URL}/customers/c2/wallets")
+    assert sample("unblockpay_request_duration_seconds_count", **labels) == before + 2
+    assert sample("unblockpay_responses_total", status="200", **labels) == before_ok + 2
+
+
+def test_upstream_timeout_counted_by_exception_name(upstream):
+    labels = {"endpoint": "quote", "method": "POST"}
+    before = sample("unblockpay_responses_total", status="Timeout", **labels)
+    before_latency = sample("unblockpay_request_duration_seconds_count", **labels)
+
+    upstream(requests.Timeout("read timed out"))
+    with pytest.raises(requests.Timeout):
+        app.unblockpay_request("POST", f"{app.BASE_URL}/quote", json={})
+    assert sample("unblockpay_responses_total", status="Timeout", **labels) == before + 1
+    assert sample("unblockpay_request_duration_seconds_count", **labels) == before_latency + 1
+
+
+def test_failed_query_latency_still_recorded():
+    class FailingQuery:
+        def execute(self):
+            raise RuntimeError("connection reset")
+
+    labels = {"table": "metrics_test", "operation": "select"}
+    before = sample("supabase_query_duration_seconds_count", **labels)
+    with pytest.raises(RuntimeError):
+        app.run_query(FailingQuery(), "metrics_test", "select")
+    assert sample("supabase_query_duration_seconds_count", **labels) == before + 1
+
+
+def test_live_gauges_written_on_refresh_under_multiprocess(monkeypatch):
+    monkeypatch.setattr(app, "PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-multiproc")
+    monkeypatch.setattr(app, "_live_gauges", [])
+    gauge = Gauge("metrics_test_entries", "test", registry=None)
+    values = [3]
+
+    app.live_gauge(Gauge("metrics_test_broken", "test", registry=None), lambda: 1 / 0)
+    app.live_gauge(gauge, lambda: values[0])
+    assert scraped(gauge) == 0
+
+    # A failing value function is logged and does not stop the other gauges
+    app.refresh_live_gauges()
+    assert scraped(gauge) == 3
+    values[0] = 5
+    app.refresh_live_gauges()
+    assert scraped(gauge) == 5
+
+
+def test_live_gauge_reads_value_at_scrape_in_single_process(monkeypatch):
+    monkeypatch.setattr(app, "PROMETHEUS_MULTIPROC_DIR", None)
+    monkeypatch.setattr(app, "_live_gauges", [])
+    gauge = Gauge("metrics_test_single", "test", registry=None)
+    values = [7]
+
+    app.live_gauge(gauge, lambda: values[0])
+    assert app._live_gauges == []
+    assert scraped(gauge) == 7
+    values[0] = 8
+    assert scraped(gauge) == 8
@@ -0,0 +1,148 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import app
+
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+    text = "{}"
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeBonusQueue:
+    def __init__(self, future):
+        self.future = future
+        self.submitted = []
+
+    def submit(self, customer_id, amount):
+        self.submitted.append((customer_id, amount))
+        return self.future
+
+    def result(self, future, timeout=None):
+        return future.result(timeout=timeout)
+
+
+@pytest.fixture
+def payouts(monkeypatch):
+    sent = []
+
+    def fake_request(method, url, **kwargs):
+        sent.append(kwargs["json"])
+        return FakeResponse({"id": "payout-1"})
+
+    monkeypatch.setattr(app, "unblockpay_request", fake_request)
+    monkeypatch.setattr(app, "get_customer_wallet_id", lambda customer_id: "wallet-1")
+    monkeypatch.setattr(app, "ASYNC_BONUS_TRANSFERS_ENABLED", True)
+    monkeypatch.setattr(app, "BONUS_TRANSFER_WAIT_SECONDS", 0.05)
+    return sent
+
+
+def use_bonus_future(monkeypatch, future):
+    queue = FakeBonusQueue(future)
+    monkeypatch.setattr(app, "bonus_transfer_queue", queue)
+    return queue
+
+
+def resolved(result=None, error=None):
+    future = Future()
+    if error:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def test_no_bonus_without_wallet(monkeypatch, payouts):
+    queue = use_bonus_future(monkeypatch, resolved({"id": "transfer-1"}))
+    monkeypatch.setattr(app, "get_customer_wallet_id", lambda customer_id: None)
+
+    assert app.create_off_ramp_payout(100, "quote-1", "customer-1", "account-1", bonus_amount=10) is None
+    assert queue.submitted == []
+    assert payouts == []
+
+
+def test_bonus_added_once_transfer_succeeds(monkeypatch, payouts):
+    queue = use_bonus_future(monkeypatch, resolved({"id": "transfer-1"}))
+
+    assert app.create_off_ramp_payout(100, "quote-1", "customer-1", "account-1", bonus_amount=10) == {"id": "payout-1"}
+    assert queue.submitted == [("customer-1", 10)]
+    assert payouts[0]["amount"] == 110
+
+
+def test_failed_bonus_not_paid_out(monkeypatch, payouts):
+    use_bonus_future(monkeypatch, resolved(error=ValueError("treasury empty")))
+
+    app.create_off_ramp_payout(100, "quote-1", "customer-1", "account-1", bonus_amount=10)
+    assert payouts[0]["amount"] == 100
+
+
+def test_pending_bonus_not_paid_out(monkeypatch, payouts):
+    use_bonus_future(monkeypatch, Future())
+
+    app.create_off_ramp_payout(100, "quote-1", "customer-1", "account-1", bonus_amount=10)
+    assert payouts[0]["amount"] == 100
+
+
+def test_bonus_queued_ahead_is_not_queued_again(monkeypatch, payouts):
+    queue = use_bonus_future(monkeypatch, resolved({"id": "transfer-2"}))
+
+    app.create_off_ramp_payout(100, "quote-1", "customer-1", "account-1", bonus_amount=10,
+                               bonus_future=resolved({"id": "transfer-1"}))
+    assert queue.submitted == []
+    assert payouts[0]["amount"] == 110
+
+
+def test_waiting_payout_skips_batch_interval(monkeypatch):
+    queue = app.BonusTransferQueue(batch_interval_seconds=5)
+    monkeypatch.setattr(queue, "_send_transfer", lambda customer_id, amount: {"id": "transfer-1"})
+
+    started = time.monotonic()
+    future = queue.submit("customer-1", 10)
+    assert queue.result(future, timeout=2) == {"id": "transfer-1"}
+    assert time.monotonic() - started < 1
+
+
+def test_bonus_overlaps_quote_and_wallet_preparation(monkeypatch, payouts):
+    step = 0.3
+    queue = app.BonusTransferQueue(batch_interval_seconds=0.2)
+    monkeypatch.setattr(app, "bonus_transfer_queue", queue)
+    monkeypatch.setattr(app, "BONUS_TRANSFER_WAIT_SECONDS", 5)
+    events = {}
+
+    def timed(name, result):
+        def call(*args):
+            events[name + "_started"] = time.monotonic()
+            time.sleep(step)
+            events[name + "_finished"] = time.monotonic()
+            return result
+        return call
+
+    monkeypatch.setattr(queue, "_send_transfer", timed("transfer", {"id": "transfer-1"}))
+    monkeypatch.setattr(app, "get_payout_quote", timed("quote", {"id": "quote-1"}))
+    monkeypatch.setattr(app, "get_customer_wallet_id", timed("wallet", "wallet-1"))
+
+    result = app.execute_netted_payout({
+        "customer_id": "customer-1",
+        "external_account_id": "account-1",
+        "amount": 100,
+        "payin_transaction_ids": ["payin-1"]
+    })
+
+    assert result == {"id": "payout-1"}
+    assert payouts[0]["amount"] == 100 + app.BONUS_AMOUNT_USDC
+    # The transfer was under way while the quote and wallet were still being prepared
+    assert events["transfer_started"] < events["wallet_finished"]
+    assert events["transfer_finished"] - events["quote_started"] < 3 * step
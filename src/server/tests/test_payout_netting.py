@@ -0,0 +1,137 @@
+import sqlite3
+
+import pytest
+
+import app
+
+
+def run_timers(*schedulers):
+    """Wait for the schedulers' timers to fire and their payouts to finish"""
+    for timer in [timer for scheduler in schedulers for timer in scheduler._timers.values()]:
+        timer.join(5)
+
+
+def stop(scheduler):
+    """Simulate the worker dying: its timers never fire"""
+    for timer in scheduler._timers.values():
+        timer.cancel()
+
+
+def open_rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM netting_payins").fetchone()[0]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "netting.sqlite3")
+
+
+@pytest.fixture
+def payouts(monkeypatch):
+    buckets = []
+
+    def fake_execute(bucket):
+        buckets.append(bucket)
+        return {"id": "payout-1"}
+
+    monkeypatch.setattr(app, "execute_netted_payout", fake_execute)
+    return buckets
+
+
+def test_payins_netted_into_one_payout(db_path, payouts):
+    scheduler = app.PayoutNettingScheduler(0.2, db_path)
+    scheduler.add("customer-1", "account-1", "payin-1", "10.5")
+    summary = scheduler.add("customer-1", "account-1", "payin-2", 4.5)
+    assert summary["amount"] == 15.0
+    assert summary["payin_count"] == 2
+
+    run_timers(scheduler)
+    assert len(payouts) == 1
+    assert payouts[0]["amount"] == 15.0
+    assert payouts[0]["payin_transaction_ids"] == ["payin-1", "payin-2"]
+    assert scheduler.pending_count() == 0
+    assert open_rows(db_path) == 0
+
+
+def test_redelivered_payin_netted_once(db_path, payouts):
+    scheduler = app.PayoutNettingScheduler(60, db_path)
+    scheduler.add("customer-1", "account-1", "payin-1", 10)
+    summary = scheduler.add("customer-1", "account-1", "payin-1", 10)
+    stop(scheduler)
+    assert summary["payin_count"] == 1
+    assert summary["amount"] == 10
+
+
+def test_open_bucket_recovered_after_crash(db_path, payouts):
+    crashed = app.PayoutNettingScheduler(0.2, db_path)
+    crashed.add("customer-1", "account-1", "payin-1", 10)
+    stop(crashed)
+
+    recovered = app.PayoutNettingScheduler(0.2, db_path)
+    recovered.recover()
+
+    run_timers(recovered)
+    assert payouts[0]["payin_transaction_ids"] == ["payin-1"]
+    assert open_rows(db_path) == 0
+
+
+def test_key_netted_across_workers(db_path, payouts):
+    first = app.PayoutNettingScheduler(0.3, db_path)
+    second = app.PayoutNettingScheduler(0.3, db_path)
+    first.add("customer-1", "account-1", "payin-1", 10)
+    second.add("customer-1", "account-1", "payin-2", 20)
+
+    # Both workers' timers fire; only one of them gets the bucket
+    run_timers(first, second)
+    assert len(payouts) == 1
+    assert payouts[0]["amount"] == 30
+    assert open_rows(db_path) == 0
+
+
+@pytest.mark.parametrize("failure", ["returns_none", "raises"])
+def test_failed_payout_keeps_payins_for_next_flush(db_path, monkeypatch, failure):
+    attempts = []
+
+    def flaky_execute(bucket):
+        attempts.append(bucket)
+        if len(attempts) == 1:
+            if failure == "raises":
+                raise RuntimeError("upstream down")
+            return None
+        return {"id": "payout-1"}
+
+    monkeypatch.setattr(app, "execute_netted_payout", flaky_execute)
+    scheduler = app.PayoutNettingScheduler(0.1, db_path)
+    scheduler.add("customer-1", "account-1", "payin-1", 10)
+    scheduler.add("customer-1", "account-1", "payin-2", 5)
+
+    run_timers(scheduler)
+    assert len(attempts) == 1
+    # The claim was released and the bucket rescheduled, not deleted
+    assert open_rows(db_path) == 2
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM netting_payins WHERE claim_id IS NOT NULL").fetchone()[0] == 0
+    assert scheduler.pending_count() == 1
+
+    run_timers(scheduler)
+    assert len(attempts) == 2
+    assert attempts[1]["payin_transaction_ids"] == ["payin-1", "payin-2"]
+    assert attempts[1]["amount"] == 15
+    assert open_rows(db_path) == 0
+    assert scheduler.pending_count() == 0
+
+
+def test_retry_backs_off_exponentially(db_path, monkeypatch):
+    monkeypatch.setattr(app, "execute_netted_payout", lambda bucket: None)
+    scheduler = app.PayoutNettingScheduler(0.1, db_path, max_retry_seconds=0.3)
+    scheduler.add("customer-1", "account-1", "payin-1", 10)
+
+    delays = []
+    for _ in range(3):
+        run_timers(scheduler)
+        delays.append(scheduler._timers[("customer-1", "account-1")].interval)
+    stop(scheduler)
+    assert delays[0] == pytest.approx(0.1, abs=0.05)
+    assert delays[1] == pytest.approx(0.2, abs=0.05)
+    assert delays[2] == pytest.approx(0.3, abs=0.05)
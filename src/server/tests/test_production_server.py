@@ -0,0 +1,109 @@
+import importlib.util
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+import app
+
+SERVER_DIR = os.path.dirname(app.__file__)
+
+
+def load_config(monkeypatch, **env):
+    # Restored to unset afterwards, since the config may setdefault it
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", "")
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR")
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", os.path.join(SERVER_DIR, "gunicorn.conf.py"))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    return config
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_config_read_from_environment(monkeypatch):
+    config = load_config(
+        monkeypatch, GUNICORN_WORKERS="1", GUNICORN_THREADS="4", GUNICORN_WORKER_CLASS="gevent",
+        GUNICORN_TIMEOUT="90", GUNICORN_GRACEFUL_TIMEOUT="30", HOST="127.0.0.1", PORT="6000"
+    )
+    assert (config.workers, config.threads, config.worker_class) == (1, 4, "gevent")
+    assert (config.timeout, config.graceful_timeout) == (90, 30)
+    assert config.bind == "127.0.0.1:6000"
+    assert config.preload_app is False
+    # A single worker keeps the in-process metrics registry
+    assert "PROMETHEUS_MULTIPROC_DIR" not in os.environ
+
+
+def test_several_workers_aggregate_metrics(monkeypatch, tmp_path):
+    metrics_dir = tmp_path / "metrics"
+    metrics_dir.mkdir()
+    (metrics_dir / "counter_123.db").write_text("stale")
+    config = load_config(monkeypatch, GUNICORN_WORKERS="3")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(metrics_dir))
+
+    # Files left by a previous run are removed before workers start
+    config.on_starting(server=None)
+    assert metrics_dir.is_dir() and list(metrics_dir.iterdir()) == []
+
+
+def test_worker_exit_drains_background_work(monkeypatch):
+    config = load_config(monkeypatch, GUNICORN_WORKERS="1")
+    drained = []
+    monkeypatch.setattr(app, "shutdown_background_work", lambda: drained.append(True))
+    config.worker_exit(server=None, worker=None)
+    assert drained == [True]
+
+
+def test_production_mode_execs_gunicorn_with_config(monkeypatch):
+    calls = []
+    monkeypatch.setattr(os, "execv", lambda path, argv: calls.append(argv))
+    app.run_production_server()
+
+    argv = calls[0]
+    assert argv[:3] == [sys.executable, "-m", "gunicorn"]
+    assert argv[argv.index("--config") + 1] == os.path.join(SERVER_DIR, "gunicorn.conf.py")
+    assert argv[argv.index("--chdir") + 1] == SERVER_DIR
+    assert argv[-1] == "app:app"
+
+
+def test_gunicorn_serves_and_stops_gracefully(tmp_path):
+    port = free_port()
+    env = dict(
+        os.environ, HOST="127.0.0.1", PORT=str(port), GUNICORN_WORKERS="1", PREWARM_CONNECTIONS="False",
+        WEBHOOK_EVENT_SPILL_DIR=str(tmp_path / "spill"), IDEMPOTENCY_DB_PATH=str(tmp_path / "idempotency.sqlite3"),
+        WALLET_PROVISIONING_DB_PATH=str(tmp_path / "wallets.sqlite3"), PAYOUT_NETTING_DB_PATH=str(tmp_path / "netting.sqlite3")
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--chdir", SERVER_DIR, "--config", os.path.join(SERVER_DIR, "gunicorn.conf.py"), "app:app"],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    try:
+        give_up_at = time.monotonic() + 30
+        while True:
+            try:
+                response = requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+                break
+            except requests.ConnectionError:
+                if server.poll() is not None or time.monotonic() > give_up_at:
+                    pytest.fail(f"gunicorn did not start:\n{server.stdout.read()}")
+                time.sleep(0.1)
+        assert response.status_code == 200
+        assert response.json()["status"] == "healthy"
+
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=30) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
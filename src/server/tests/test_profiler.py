@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def busy_leaf(seconds):
+    ends = time.perf_counter() + seconds
+    while time.perf_counter() < ends:
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "ADMIN_API_TOKEN", "admin")
+    monkeypatch.setattr(app, "PROFILER_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "PROFILER_INTERVAL_MS", 1)
+    monkeypatch.setattr(app, "PROFILER_ENABLED", False)
+    monkeypatch.setattr(app, "PROFILER_ROUTES", set())
+    monkeypatch.setattr(app, "profiler_rate_limit", app.TokenBucket("profiler", 100, 100))
+    flask_app = app.create_app({"TESTING": True})
+
+    @flask_app.route("/test/slow")
+    def slow_view():
+        busy_leaf(0.05)
+        return {"ok": True}
+
+    @flask_app.route("/test/fast")
+    def fast_view():
+        return {"ok": True}
+
+    return flask_app.test_client()
+
+
+def test_admin_header_writes_folded_profile(client, tmp_path):
+    response = client.get("/test/slow", headers={"X-Profile": "1", "X-Admin-Token": "admin"})
+    assert response.status_code == 200
+
+    profile = tmp_path / response.headers["X-Profile-File"]
+    assert "slow_view" in profile.name
+    lines = profile.read_text().splitlines()
+    assert lines
+    # Each line is "outer;...;leaf count" with the view and the helper it calls on one stack
+    assert any("slow_view (test_profiler.py" in line and "busy_leaf (test_profiler.py" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+@pytest.mark.parametrize("headers", [{"X-Profile": "1"}, {"X-Profile": "1", "X-Admin-Token": "wrong"}])
+def test_header_ignored_without_admin_token(client, tmp_path, headers):
+    response = client.get("/test/slow", headers=headers)
+    assert "X-Profile-File" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sampling_limited_to_configured_routes(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "PROFILER_ENABLED", True)
+    monkeypatch.setattr(app, "PROFILER_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(app, "PROFILER_ROUTES", {"slow_view"})
+
+    assert "X-Profile-File" not in client.get("/test/fast").headers
+    assert "X-Profile-File" in client.get("/test/slow").headers
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_profiles_capped_per_minute(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "profiler_rate_limit", app.TokenBucket("profiler", 0.001, 2))
+    headers = {"X-Profile": "1", "X-Admin-Token": "admin"}
+
+    profiled = ["X-Profile-File" in client.get("/test/fast", headers=headers).headers for _ in range(4)]
+    assert profiled == [True, True, False, False]
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_sampler_aggregates_identical_stacks(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=stop.wait)
+    worker.start()
+    time.sleep(0.01)
+    try:
+        sampler = app.StackSampler(worker.ident, 0.001).start()
+        time.sleep(0.05)
+        sampler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    # The idle thread has one stack, counted once per sample
+    assert len(sampler.stacks) == 1
+    assert sum(sampler.stacks.values()) == sampler.samples > 0
+    sampler.write(str(tmp_path / "idle.folded"))
+    folded, count = (tmp_path / "idle.folded").read_text().strip().rsplit(" ", 1)
+    assert folded.split(";")[-1].startswith("wait (threading.py:")
+    assert int(count) == sampler.samples
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+class Created(list):
+    ttl = 3600
+    delay = 0
+
+
+@pytest.fixture
+def quotes(monkeypatch):
+    """Quotes handed out by a fake UnblockPay, each valid for quotes.ttl seconds"""
+    created = Created()
+
+    def fake_create_quote(symbol, quote_type):
+        time.sleep(created.delay)
+        quote = {"id": f"quote-{len(created) + 1}", "expires_at": time.time() + created.ttl}
+        created.append(quote)
+        return quote
+
+    monkeypatch.setattr(app, "create_quote", fake_create_quote)
+    return created
+
+
+def test_payouts_share_one_quote(quotes):
+    pool = app.OffRampQuotePool(refresh_margin_seconds=15)
+    assert pool.get()["id"] == pool.get()["id"] == "quote-1"
+    assert len(quotes) == 1
+    assert pool.stats()["hits"] == 1
+
+
+def test_concurrent_misses_share_one_upstream_request(quotes):
+    quotes.delay = 0.1
+    pool = app.OffRampQuotePool()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.get()["id"])) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["quote-1"] * 5
+    assert len(quotes) == 1
+
+
+def test_quote_inside_refresh_margin_replaced(quotes):
+    quotes.ttl = 10
+    pool = app.OffRampQuotePool(refresh_margin_seconds=15)
+    assert pool.get()["id"] == "quote-1"
+    # Already within the margin of expiring, so the next payout gets a fresh one
+    assert pool.get()["id"] == "quote-2"
+
+
+def test_invalidate_only_drops_the_rejected_quote(quotes):
+    pool = app.OffRampQuotePool()
+    pool.get()
+    pool.invalidate(quote_id="some-other-quote")
+    assert pool.get()["id"] == "quote-1"
+    pool.invalidate(quote_id="quote-1")
+    assert pool.get()["id"] == "quote-2"
+
+
+def test_proactive_refresh_before_expiry_and_idle_pool_lapses(quotes):
+    quotes.ttl = 0.3
+    pool = app.OffRampQuotePool(refresh_margin_seconds=0.1, idle_seconds=60)
+    pool.get()
+    pool._timers["wire"].join(2)
+    assert pool.stats()["quotes"]["wire"]["id"] == "quote-2"
+
+    pool.idle_seconds = 0
+    pool._timers["wire"].join(2)
+    assert "wire" not in pool.stats()["quotes"]
+    assert len(quotes) == 2
+
+
+def test_failed_quote_raises(monkeypatch):
+    monkeypatch.setattr(app, "create_quote", lambda symbol, quote_type: None)
+    with pytest.raises(Exception, match="Failed to create off-ramp quote"):
+        app.OffRampQuotePool().get()
@@ -0,0 +1,41 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("priority", ["high", "normal", "low"])
+def test_burst_of_one_serves_every_priority(priority):
+    bucket = app.TokenBucket("test", rate=1, burst=1)
+    assert bucket.try_acquire(priority) == 0
+    assert bucket.try_acquire(priority) > 0
+
+
+def test_reserve_kept_for_higher_priorities():
+    bucket = app.TokenBucket("test", rate=0.001, burst=10)
+    taken = 0
+    while bucket.try_acquire("low") == 0:
+        taken += 1
+    # Low priority leaves half the burst for normal and high priority calls
+    assert taken == 5
+    assert bucket.try_acquire("normal") == 0
+    assert bucket.try_acquire("high") == 0
+
+
+def test_shared_state_file(tmp_path):
+    first = app.TokenBucket("test", rate=0.001, burst=2, state_dir=str(tmp_path))
+    second = app.TokenBucket("test", rate=0.001, burst=2, state_dir=str(tmp_path))
+    assert first.try_acquire("high") == 0
+    assert second.try_acquire("high") == 0
+    assert first.try_acquire("high") > 0
+
+
+@pytest.mark.parametrize("spec", ["quotes=0:5", "quotes=5:0.5"])
+def test_unusable_limits_rejected(spec):
+    with pytest.raises(ValueError, match="quotes"):
+        app.parse_rate_limits(spec)
+
+
+def test_burst_defaults_to_rate():
+    buckets = app.parse_rate_limits("quotes=10, payouts=5:8")
+    assert (buckets["quotes"].rate, buckets["quotes"].burst) == (10, 10)
+    assert (buckets["payouts"].rate, buckets["payouts"].burst) == (5, 8)
@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app
+
+CUSTOMER = {
+    "first_name": "Ana", "last_name": "Silva", "email": "ana@example.com", "phone_number": "+55 11 99999-9999",
+    "date_of_birth": "2000-01-31", "type": "individual",
+    "identity_documents": [{"type": "cpf", "value": "111", "country": "BRA"}],
+    "address": {"street_line_1": "Rua A 1", "city": "Sao Paulo", "state": "SP", "postal_code": "01000-000", "country": "BRA"}
+}
+
+
+@pytest.fixture
+def client():
+    return app.create_app({"TESTING": True}).test_client()
+
+
+def fields(response):
+    return {detail["field"] for detail in response.get_json()["details"]}
+
+
+def test_missing_customer_fields_listed(client):
+    response = client.post("/api/create-customer", json={"first_name": "Ana"})
+    assert response.status_code == 400
+    assert {"last_name", "email", "identity_documents", "address"} <= fields(response)
+
+
+def test_invalid_email_rejected_in_every_schema(client):
+    response = client.post("/api/create-customer", json={**CUSTOMER, "email": "ana.example.com"})
+    assert response.status_code == 400
+    assert fields(response) == {"email"}
+    assert "Invalid email format" in response.get_json()["error"]
+
+    schemas = app.request_schemas()
+    with pytest.raises(schemas.ValidationError, match="Invalid email format"):
+        schemas.BulkOnboardingRow.model_validate({
+            "first_name": "Ana", "last_name": "Silva", "email": "nope", "phone_number": "1", "date_of_birth": "2000-01-31",
+            "document_type": "cpf", "document_value": "1", "document_country": "BRA", "street_line_1": "Rua A",
+            "city": "Sao Paulo", "state": "SP", "postal_code": "1", "country": "BRA"
+        })
+
+
+def test_use_existing_customer_without_id_is_a_new_signup(client):
+    # Validated against the new-customer schema, as the handler did before the schemas
+    response = client.post("/api/create-customer", json={"use_existing_customer": True, "first_name": "Ana"})
+    assert response.status_code == 400
+    assert "existing_customer_id" not in fields(response)
+    assert "email" in fields(response)
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+def test_use_existing_customer_with_id(client, monkeypatch):
+    monkeypatch.setattr(app, "get_customer_wallet_id", lambda customer_id: "wallet-1")
+    monkeypatch.setattr(app, "unblockpay_request", lambda *args, **kwargs: FakeResponse([{"id": "wallet-1", "address": "addr"}]))
+
+    response = client.post("/api/create-customer", json={"use_existing_customer": True, "existing_customer_id": "customer-1"})
+    assert response.status_code == 200
+    assert response.get_json()["customer_id"] == "customer-1"
+    assert response.get_json()["wallet_address"] == "addr"
+
+
+def test_pix_payment_amount_must_be_positive(client):
+    response = client.post("/api/create-pix-payment", json={
+        "amount_brl": 0, "customer_id": "c1", "quote_id": "q1", "sender_name": "Ana", "sender_document": "111"
+    })
+    assert response.status_code == 400
+    assert fields(response) == {"amount_brl"}
+
+
+def test_malformed_json_body_rejected(client):
+    response = client.post("/api/create-spei-payment", data="{not json", content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_pydantic_not_imported_with_the_app():
+    code = "import sys, app; print('pydantic' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=os.path.dirname(app.__file__))
+    assert result.stdout.strip().splitlines()[-1] == "False"
@@ -0,0 +1,112 @@
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+import app
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+
+class FakeSession:
+    def request(self, method, url, **kwargs):
+        return FakeResponse()
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    """Trace into an in-memory exporter instead of the configured one"""
+    monkeypatch.delenv("OTEL_SDK_DISABLED", raising=False)
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(app, "_tracer", provider.get_tracer("test"))
+    monkeypatch.setattr(app, "_tracing_initialized", True)
+    return exporter
+
+
+def by_name(exporter, name):
+    return next(span for span in exporter.get_finished_spans() if span.name == name)
+
+
+def test_disabled_tracing_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(app, "_tracer", None)
+    monkeypatch.setattr(app, "_tracing_initialized", False)
+    monkeypatch.setattr(app, "OTEL_TRACES_EXPORTER", "none")
+
+    with app.trace_span("unused") as span:
+        assert span is None
+        app.annotate_span(customer_id="c1")
+        assert app.current_span_context() is None
+        assert app.current_trace_id() is None
+    assert app.span_links([None]) == []
+    assert app.traced("helper")(lambda value: value * 2)(21) == 42
+
+
+def test_unknown_exporter_disables_tracing(monkeypatch, capsys):
+    monkeypatch.setattr(app, "_tracer", None)
+    monkeypatch.setattr(app, "_tracing_initialized", False)
+    monkeypatch.setattr(app, "OTEL_TRACES_EXPORTER", "zipkin")
+
+    assert app.get_tracer() is None
+    assert "Unknown OTEL_TRACES_EXPORTER 'zipkin'" in capsys.readouterr().out
+
+
+def test_request_span_continues_incoming_trace(spans, monkeypatch):
+    monkeypatch.setattr(app, "circuit_breakers", {})
+    monkeypatch.setattr(app, "acquire_rate_limit_token", lambda endpoint: None)
+    monkeypatch.setattr(app, "get_unblockpay_session", lambda: FakeSession())
+    flask_app = app.create_app({"TESTING": True})
+
+    @flask_app.route("/test/upstream")
+    def call_upstream():
+        app.unblockpay_request("GET", f"{app.BASE_URL}/customers/c1/wallets")
+        return {"trace_id": app.current_trace_id()}
+
+    response = flask_app.test_client().get(
+        "/test/upstream", headers={"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01"}
+    )
+    assert response.get_json() == {"trace_id": TRACE_ID}
+
+    server = by_name(spans, "GET /test/upstream")
+    upstream = by_name(spans, "unblockpay GET customers/wallets")
+    assert server.kind == trace.SpanKind.SERVER
+    assert format(server.context.trace_id, "032x") == TRACE_ID
+    assert server.attributes["http.status_code"] == 200
+    assert upstream.parent.span_id == server.context.span_id
+    assert upstream.attributes["http.status_code"] == 200
+    # The request context is detached once the request ends
+    assert app.current_span_context() is None
+
+
+def test_background_work_linked_to_captured_spans(spans):
+    captured = []
+    for transaction_id in ("tx1", "tx2"):
+        with app.trace_span("webhook", {"transaction_id": transaction_id}):
+            captured.append(app.current_span_context())
+
+    with app.trace_span("netted_payout", links=app.span_links(captured + [None])):
+        app.annotate_span(payout_id="p1", customer_id=None)
+
+    payout = by_name(spans, "netted_payout")
+    assert [link.context for link in payout.links] == captured
+    assert payout.attributes["payout_id"] == "p1"
+    assert "customer_id" not in payout.attributes
+
+
+def test_traced_helper_records_its_span(spans):
+    @app.traced("helper")
+    def helper():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        helper()
+    span = by_name(spans, "helper")
+    assert span.status.status_code == trace.StatusCode.ERROR
+    assert span.events[0].name == "exception"
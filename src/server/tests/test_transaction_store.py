@@ -0,0 +1,208 @@
+"""
+TransactionStore against the Postgres in DATABASE_URL (a Supabase database with
+supabase-webhook-events.sql applied). Tests that need it are skipped when it is unset;
+each one creates its own auth user and customer id and deletes them afterwards.
+"""
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+import app
+
+requires_db = pytest.mark.skipif(not app.DATABASE_URL, reason="DATABASE_URL is not set")
+
+
+@pytest.fixture
+def db():
+    pool = app.get_db_pool()
+    pool.wait(timeout=10)
+    return pool
+
+
+@pytest.fixture
+def user_id(db):
+    user_id = str(uuid.uuid4())
+    with db.connection() as conn:
+        conn.execute("INSERT INTO auth.users (id) VALUES (%s)", (user_id,))
+    yield user_id
+    with db.connection() as conn:
+        # Cascades to the user's transactions
+        conn.execute("DELETE FROM auth.users WHERE id = %s", (user_id,))
+
+
+@pytest.fixture
+def customer_id(db):
+    customer_id = f"test-{uuid.uuid4()}"
+    yield customer_id
+    with db.connection() as conn:
+        conn.execute("DELETE FROM public.webhook_events WHERE customer_id = %s", (customer_id,))
+
+
+def transaction(user_id, transaction_id, status):
+    return {
+        "user_id": user_id,
+        "unblockpay_transaction_id": transaction_id,
+        "type": "payin",
+        "status": status,
+        "amount_usd": 18.45,
+        "metadata": {"id": transaction_id, "status": status},
+    }
+
+
+@requires_db
+def test_upsert_creates_then_updates(db, user_id):
+    store = app.TransactionStore()
+    transaction_id = f"tx-{uuid.uuid4()}"
+
+    assert store.upsert_transaction(transaction(user_id, transaction_id, "processing")) == "created"
+    assert store.upsert_transaction(transaction(user_id, transaction_id, "completed")) == "updated"
+
+    with db.connection() as conn:
+        rows = conn.execute(
+            "SELECT status, metadata FROM public.transactions WHERE unblockpay_transaction_id = %s", (transaction_id,)
+        ).fetchall()
+    assert rows == [{"status": "completed", "metadata": {"id": transaction_id, "status": "completed"}}]
+
+
+@requires_db
+def test_insert_webhook_events_in_one_statement(db, customer_id):
+    store = app.TransactionStore()
+    rows = [
+        {
+            "event_type": "payin.completed",
+            "event_resource": {"id": f"tx-{i}", "amounts": [1, 2.5]},
+            "status": "completed",
+            "raw_payload": {"event": "payin"},
+            "customer_id": customer_id,
+            "transaction_id": f"tx-{i}",
+            # Rows may carry different columns; missing ones are inserted as NULL
+            **({"amount_usd": 10 + i} if i else {}),
+        }
+        for i in range(3)
+    ]
+    store.insert_webhook_events(rows)
+
+    with db.connection() as conn:
+        stored = conn.execute(
+            "SELECT transaction_id, event_resource, amount_usd FROM public.webhook_events "
+            "WHERE customer_id = %s ORDER BY transaction_id",
+            (customer_id,)
+        ).fetchall()
+    assert [row["transaction_id"] for row in stored] == ["tx-0", "tx-1", "tx-2"]
+    assert stored[1]["event_resource"] == {"id": "tx-1", "amounts": [1, 2.5]}
+    assert [row["amount_usd"] for row in stored] == [None, Decimal("11"), Decimal("12")]
+
+
+@requires_db
+def test_rows_shaped_like_postgrest(customer_id):
+    store = app.TransactionStore()
+    store.insert_webhook_event({
+        "event_type": "payin.completed",
+        "event_resource": {"id": "tx-1"},
+        "status": "completed",
+        "raw_payload": {},
+        "customer_id": customer_id,
+        "amount_usd": 18.45,
+    })
+
+    [row] = store.list_webhook_events(customer_id)
+    assert isinstance(row["id"], str)
+    uuid.UUID(row["id"])
+    assert row["amount_usd"] == 18.45
+    assert datetime.fromisoformat(row["created_at"]).tzinfo is not None
+    assert row["event_resource"] == {"id": "tx-1"}
+
+
+@requires_db
+def test_pool_timeout_falls_back_to_supabase(db, monkeypatch):
+    from psycopg_pool import ConnectionPool
+
+    supabase = FakeSupabase([{"id": "user-from-supabase"}])
+    monkeypatch.setattr(app, "get_supabase", lambda: supabase)
+    exhausted = ConnectionPool(app.DATABASE_URL, min_size=1, max_size=1, timeout=0.2, open=True)
+    monkeypatch.setattr(app, "_db_pool", exhausted)
+    try:
+        with exhausted.connection():
+            assert app.TransactionStore().find_user_id_by_customer("customer-1") == "user-from-supabase"
+    finally:
+        exhausted.close()
+    assert supabase.queries == [("user_profiles", "eq", ("unblockpay_customer_id", "customer-1"))]
+
+
+@requires_db
+def test_restored_payload_survives_prune(db):
+    store = app.TransactionStore(hash_cache_ttl_seconds=0)
+    payload = {"id": f"tx-{uuid.uuid4()}"}
+    digest = store.store_payload(payload)
+    try:
+        with db.connection() as conn:
+            conn.execute("UPDATE public.webhook_payloads SET created_at = NOW() - INTERVAL '8 days' WHERE hash = %s", (digest,))
+
+        # The cached hash has expired, so storing again refreshes the row before prune can take it
+        assert store.store_payload(payload) == digest
+        with db.connection() as conn:
+            conn.execute("SELECT public.prune_webhook_payloads()")
+            assert conn.execute("SELECT payload FROM public.webhook_payloads WHERE hash = %s", (digest,)).fetchall() == [
+                {"payload": payload}
+            ]
+    finally:
+        with db.connection() as conn:
+            conn.execute("DELETE FROM public.webhook_payloads WHERE hash = %s", (digest,))
+
+
+def test_payload_hash_cache_expires(monkeypatch):
+    statements = []
+    monkeypatch.setattr(app, "get_db_pool", lambda: object())
+    monkeypatch.setattr(app, "run_sql", lambda sql, params, table, operation: statements.append(sql))
+    clock = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: clock[0])
+
+    store = app.TransactionStore(hash_cache_ttl_seconds=60)
+    store.store_payload({"id": "tx-1"})
+    clock[0] += 59
+    store.store_payload({"id": "tx-1"})
+    assert len(statements) == 1
+    clock[0] += 2
+    store.store_payload({"id": "tx-1"})
+    assert len(statements) == 2
+
+
+def test_db_row_renders_postgrest_types():
+    row_id = uuid.uuid4()
+    created_at = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert app._db_row({"id": row_id, "created_at": created_at, "amount_usd": Decimal("18.45"), "status": "ok"}) == {
+        "id": str(row_id),
+        "created_at": "2025-01-02T03:04:05+00:00",
+        "amount_usd": 18.45,
+        "status": "ok",
+    }
+
+
+def test_other_errors_not_hidden_by_fallback(monkeypatch):
+    monkeypatch.setattr(app, "get_supabase", lambda: FakeSupabase([]))
+    with pytest.raises(RuntimeError):
+        app.TransactionStore()._fallback(RuntimeError("syntax error"), "select")
+
+
+class FakeSupabase:
+    """Just enough of the Supabase query builder for table(...).select(...).eq(...).execute()"""
+
+    def __init__(self, data):
+        self.data = data
+        self.queries = []
+
+    def table(self, name):
+        self._table = name
+        return self
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        self.queries.append((self._table, "eq", (column, value)))
+        return self
+
+    def execute(self):
+        return self
@@ -0,0 +1,66 @@
+import uuid
+
+import pytest
+
+import app
+
+
+class DatabaseError(Exception):
+    def __init__(self, message, sqlstate):
+        super().__init__(message)
+        self.sqlstate = sqlstate
+
+
+class PostgrestError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "database_configured", lambda: True)
+    monkeypatch.setattr(app, "_summary_rpc_available", True)
+    monkeypatch.setattr(app.transaction_store, "find_customer_id_for_user", lambda user_id: None)
+    return app.create_app({"TESTING": True}).test_client()
+
+
+def summary(client):
+    return client.get(f"/api/user-transactions/{uuid.uuid4()}/summary").get_json()
+
+
+def failing_summary(monkeypatch, error):
+    def transaction_summary(user_id):
+        raise error
+    monkeypatch.setattr(app.transaction_store, "transaction_summary", transaction_summary)
+
+
+def test_database_summary(monkeypatch, client):
+    monkeypatch.setattr(app.transaction_store, "transaction_summary", lambda user_id: {
+        "total_sent": "12.5", "total_completed": 10, "total_pending": 2.5, "transaction_count": 2
+    })
+    assert summary(client) == {
+        "summary": {"total_sent": 12.5, "total_completed": 10.0, "total_pending": 2.5, "transaction_count": 2},
+        "source": "database",
+    }
+
+
+@pytest.mark.parametrize("error", [
+    DatabaseError("function public.user_transaction_summary(uuid) does not exist", "42883"),
+    PostgrestError("Could not find the function public.user_transaction_summary", "PGRST202"),
+])
+def test_missing_function_falls_back_for_good(monkeypatch, client, error):
+    failing_summary(monkeypatch, error)
+    assert summary(client)["source"] == "python"
+    assert app._summary_rpc_available is False
+
+
+@pytest.mark.parametrize("error", [
+    DatabaseError('relation "public.webhook_events" does not exist', "42P01"),
+    DatabaseError("canceling statement due to statement timeout", "57014"),
+    RuntimeError("connection reset"),
+])
+def test_other_errors_fall_back_once(monkeypatch, client, error):
+    failing_summary(monkeypatch, error)
+    assert summary(client)["source"] == "python"
+    assert app._summary_rpc_available is True
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+import requests
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = str(self.body)
+        self.headers = {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+
+class FakeSession:
+    """Replies with the queued outcomes in order (exceptions are raised)"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(app, "circuit_breakers", {})
+    monkeypatch.setattr(app, "acquire_rate_limit_token", lambda endpoint: None)
+    monkeypatch.setattr(app, "UNBLOCKPAY_RETRY_BASE_DELAY_SECONDS", 0)
+    monkeypatch.setattr(app, "UNBLOCKPAY_MAX_RETRIES", 2)
+    monkeypatch.setattr(app, "CIRCUIT_BREAKER_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(app, "CIRCUIT_BREAKER_RESET_SECONDS", 0.1)
+
+
+def use_session(monkeypatch, *outcomes):
+    session = FakeSession(*outcomes)
+    monkeypatch.setattr(app, "get_unblockpay_session", lambda: session)
+    return session
+
+
+def test_get_retried_on_5xx(monkeypatch):
+    session = use_session(monkeypatch, FakeResponse(503), FakeResponse(200, {"ok": True}))
+
+    response = app.unblockpay_request("GET", f"{app.BASE_URL}/customers/c1/wallets")
+    assert response.status_code == 200
+    assert len(session.calls) == 2
+    assert app.circuit_breakers["customers/wallets"].stats()["retries"] == 1
+
+
+def test_quote_creation_not_retried_after_timeout(monkeypatch):
+    session = use_session(monkeypatch, requests.Timeout("read timed out"), FakeResponse(200, {"id": "quote-2"}))
+
+    assert app.create_quote_new("USDC/USD", "off_ramp") is None
+    # The first POST may have created a quote upstream, so it is not sent again
+    assert len(session.calls) == 1
+
+
+def test_breaker_opens_then_recovers_through_half_open_trial(monkeypatch):
+    session = use_session(monkeypatch, *[requests.ConnectionError("refused")] * 3, FakeResponse(200))
+    url = f"{app.BASE_URL}/payout"
+
+    for _ in range(3):
+        with pytest.raises(requests.ConnectionError):
+            app.unblockpay_request("POST", url, json={})
+    breaker = app.circuit_breakers["payout"]
+    assert breaker.state == "open"
+
+    # Open: fails fast without reaching UnblockPay
+    with pytest.raises(app.CircuitOpenError):
+        app.unblockpay_request("POST", url, json={})
+    assert len(session.calls) == 3
+    assert breaker.stats()["rejected"] == 1
+
+    time.sleep(0.15)
+    assert app.unblockpay_request("POST", url, json={}).status_code == 200
+    assert breaker.state == "closed"
+    assert breaker.stats()["trips"] == 1
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = app.CircuitBreaker("test", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
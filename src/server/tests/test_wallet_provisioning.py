@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def wallets(monkeypatch):
+    """create_wallet calls; they block until wallets.release is set"""
+    calls = Calls()
+
+    def fake_create_wallet(customer_id, name, blockchain):
+        calls.append(customer_id)
+        calls.release.wait(5)
+        if calls.error:
+            raise calls.error
+        return {"id": f"wallet-{customer_id}", "address": f"address-{customer_id}"}
+
+    monkeypatch.setattr(app, "create_wallet", fake_create_wallet)
+    return calls
+
+
+class Calls(list):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.error = None
+
+
+def provisioner(tmp_path, **kwargs):
+    return app.WalletProvisioner(str(tmp_path / "wallet_provisioning.sqlite3"), max_workers=2, **kwargs)
+
+
+def test_status_shared_between_workers(tmp_path, wallets):
+    first, second = provisioner(tmp_path), provisioner(tmp_path)
+
+    assert first.submit("customer-1", "Ana's Wallet")["status"] == "pending"
+    assert first.count() == 1
+    # Another worker sees the pending status and does not provision again
+    assert second.submit("customer-1", "Ana's Wallet")["status"] == "pending"
+    assert second.count() == 0
+
+    wallets.release.set()
+    status = second.wait("customer-1", timeout=5)
+    assert status["status"] == "ready"
+    assert status["wallet_id"] == "wallet-customer-1"
+    assert wallets == ["customer-1"]
+    assert first.drain(5) and first.count() == 0
+
+
+def test_failed_provisioning_can_be_retried(tmp_path, wallets):
+    workers = provisioner(tmp_path)
+    wallets.error = ValueError("upstream down")
+    wallets.release.set()
+    workers.submit("customer-1", "Wallet")
+    assert workers.wait("customer-1", timeout=5)["status"] == "failed"
+
+    wallets.error = None
+    workers.submit("customer-1", "Wallet")
+    assert workers.wait("customer-1", timeout=5)["status"] == "ready"
+    assert len(wallets) == 2
+
+
+def test_wait_returns_on_version_change(tmp_path, wallets):
+    workers = provisioner(tmp_path)
+    pending = workers.submit("customer-1", "Wallet")
+    assert workers.wait("customer-1", timeout=0.3, version=pending["version"])["version"] == pending["version"]
+
+    wallets.release.set()
+    changed = workers.wait("customer-1", timeout=5, version=pending["version"])
+    assert changed["version"] > pending["version"]
+
+
+def test_stale_pending_status_retried(tmp_path, wallets):
+    # The worker that owned this status died before finishing
+    crashed = provisioner(tmp_path, pending_timeout_seconds=0)
+    crashed._executor = Unused()
+    crashed.submit("customer-1", "Wallet")
+
+    wallets.release.set()
+    workers = provisioner(tmp_path, pending_timeout_seconds=0)
+    assert workers.get("customer-1") is None
+    workers.submit("customer-1", "Wallet")
+    assert workers.drain(5)
+    assert workers.get("customer-1")["status"] == "ready"
+    assert wallets == ["customer-1"]
+
+
+class Unused:
+    def submit(self, *args):
+        pass
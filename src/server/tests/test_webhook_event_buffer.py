@@ -0,0 +1,158 @@
+import fcntl
+import json
+import os
+import threading
+
+import pytest
+
+import app
+
+
+class ConstraintViolation(Exception):
+    sqlstate = "23502"
+
+
+class ConnectionLost(Exception):
+    sqlstate = "08006"
+
+
+class FakeStore:
+    """Records inserted rows; rows with "poison" are rejected like a NOT NULL violation"""
+
+    def __init__(self):
+        self.inserted = []
+        self.transient_failures = 0
+        self.lock = threading.Lock()
+
+    def insert_webhook_events(self, rows):
+        with self.lock:
+            if self.transient_failures:
+                self.transient_failures -= 1
+                raise ConnectionLost("connection lost")
+            if any(row.get("poison") for row in rows):
+                raise ConstraintViolation("null value in column violates not-null constraint")
+            self.inserted.extend(rows)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(app, "transaction_store", store)
+    return store
+
+
+def make_buffer(tmp_path, batch_size=10):
+    return app.WebhookEventBuffer(str(tmp_path), batch_size=batch_size, flush_ms=10, retry_max_seconds=0.05)
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_flush_removes_spill_file_on_close(tmp_path, store):
+    buffer = make_buffer(tmp_path)
+    buffer.add({"transaction_id": "t1"})
+    buffer.add({"transaction_id": "t2"})
+    spill_path = buffer._spill_file.name
+
+    assert buffer.close(timeout=5)
+    assert [row["transaction_id"] for row in store.inserted] == ["t1", "t2"]
+    assert not os.path.exists(spill_path)
+
+
+def test_spill_names_are_unique_per_start(tmp_path, store):
+    first, second = make_buffer(tmp_path), make_buffer(tmp_path)
+    first.add({"transaction_id": "t1"})
+    second.add({"transaction_id": "t2"})
+
+    assert first._spill_file.name != second._spill_file.name
+    assert first.close(timeout=5) and second.close(timeout=5)
+
+
+def test_orphaned_spill_replayed_and_live_spill_skipped(tmp_path, store):
+    orphan = tmp_path / f"webhook_events-{os.getpid()}-deadbeef.jsonl"
+    orphan.write_text('{"transaction_id":"orphan-1"}\n{"transaction_id":"orphan-2"}\n{"transaction_id":')
+    live = tmp_path / "webhook_events-1-live.jsonl"
+    live.write_text('{"transaction_id":"live-1"}\n')
+
+    with open(live) as live_file:
+        fcntl.flock(live_file, fcntl.LOCK_EX)
+        make_buffer(tmp_path).replay_orphaned_spills()
+
+    assert [row["transaction_id"] for row in store.inserted] == ["orphan-1", "orphan-2"]
+    assert not orphan.exists()
+    assert live.exists()
+
+
+def test_poison_row_dead_lettered_without_blocking_batch(tmp_path, store):
+    buffer = make_buffer(tmp_path, batch_size=5)
+    rows = [{"transaction_id": f"t{i}", "poison": i == 2} for i in range(5)]
+    for row in rows:
+        buffer.add(row)
+
+    assert buffer.close(timeout=5)
+    assert [row["transaction_id"] for row in store.inserted] == ["t0", "t1", "t3", "t4"]
+    dead = read_jsonl(tmp_path / app.WebhookEventBuffer.DEAD_LETTER_FILE)
+    assert [entry["row"]["transaction_id"] for entry in dead] == ["t2"]
+    assert "not-null" in dead[0]["error"]
+
+
+def test_transient_error_retried(tmp_path, store):
+    store.transient_failures = 2
+    buffer = make_buffer(tmp_path)
+    buffer.add({"transaction_id": "t1"})
+
+    assert buffer.close(timeout=5)
+    assert [row["transaction_id"] for row in store.inserted] == ["t1"]
+    assert not (tmp_path / app.WebhookEventBuffer.DEAD_LETTER_FILE).exists()
+
+
+def test_orphan_with_poison_row_replayed(tmp_path, store):
+    orphan = tmp_path / "webhook_events-1-orphan.jsonl"
+    orphan.write_text('{"transaction_id":"a"}\n{"transaction_id":"b","poison":true}\n')
+
+    make_buffer(tmp_path).replay_orphaned_spills()
+
+    assert [row["transaction_id"] for row in store.inserted] == ["a"]
+    assert not orphan.exists()
+    assert len(read_jsonl(tmp_path / app.WebhookEventBuffer.DEAD_LETTER_FILE)) == 1
+
+
+def test_orphan_kept_on_transient_error(tmp_path, store):
+    store.transient_failures = 1
+    orphan = tmp_path / "webhook_events-1-orphan.jsonl"
+    orphan.write_text('{"transaction_id":"a"}\n')
+
+    make_buffer(tmp_path).replay_orphaned_spills()
+
+    assert store.inserted == []
+    assert read_jsonl(orphan) == [{"transaction_id": "a"}]
+
+
+def test_orphan_replayed_at_worker_start_without_traffic(tmp_path, store, monkeypatch):
+    import importlib.util
+    orphan = tmp_path / "webhook_events-1-orphan.jsonl"
+    orphan.write_text('{"transaction_id":"a"}\n')
+    buffer = make_buffer(tmp_path)
+    monkeypatch.setattr(app, "webhook_event_buffer", buffer)
+    monkeypatch.setattr(app, "prewarm_connections", lambda: None)
+    monkeypatch.setattr(app, "start_live_gauge_refresher", lambda: None)
+    monkeypatch.setattr(app.payout_netting_scheduler, "recover", lambda: None)
+    # One worker, so loading the config does not switch prometheus_client to multiprocess mode
+    monkeypatch.setenv("GUNICORN_WORKERS", "1")
+
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", os.path.join(os.path.dirname(app.__file__), "gunicorn.conf.py"))
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    gunicorn_conf.post_worker_init(worker=None)
+
+    assert [row["transaction_id"] for row in store.inserted] == ["a"]
+    assert not orphan.exists()
+    # Nothing was added, so no spill file or flusher was started
+    assert buffer._worker is None
+
+
+def test_replay_without_spill_dir(tmp_path, store):
+    make_buffer(tmp_path / "missing").replay_orphaned_spills()
+    assert store.inserted == []
@@ -153,7 +153,8 @@ export const paymentService = {
   }> => {
     const response = await fetch(getApiUrl(API_CONFIG.ENDPOINTS.CREATE_PIX_PAYMENT), {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      // One payin per quote: double-clicks and retries reuse the key and get the original response
+      headers: { 'Content-Type': 'application/json', 'Idempotency-Key': `pix-${quoteId}` },
       credentials: 'include',
       body: JSON.stringify({
         amount_brl: amountBrl,
@@ -0,0 +1,94 @@
+-- Migration: Dashboard summary computed in the database
+-- Run this in your Supabase SQL Editor. The backend calls it through
+-- GET /api/user-transactions/<user_id>/summary and falls back to Python until it exists.
+
+-- Mirrors group_webhook_events() in src/server/app.py: walking a customer's webhook events
+-- newest first, each event not yet grouped starts a group that takes every later event within
+-- $10.20 (the payout bonus) and 5 minutes of it. A group counts its highest amount, and its
+-- status is failed if any event failed, else the newest event's status.
+CREATE OR REPLACE FUNCTION public.user_transaction_summary(p_user_id UUID)
+RETURNS TABLE (
+  total_sent NUMERIC,
+  total_completed NUMERIC,
+  total_pending NUMERIC,
+  transaction_count INTEGER
+) AS $$
+DECLARE
+  v_customer_id TEXT;
+  v_times TIMESTAMP WITH TIME ZONE[];
+  v_amounts NUMERIC[];
+  v_statuses TEXT[];
+  v_used BOOLEAN[];
+  v_count INTEGER;
+  g_amount NUMERIC;
+  g_statuses TEXT[];
+  g_status TEXT;
+BEGIN
+  total_sent := 0;
+  total_completed := 0;
+  total_pending := 0;
+  transaction_count := 0;
+
+  SELECT p.unblockpay_customer_id INTO v_customer_id
+  FROM public.user_profiles p
+  WHERE p.id = p_user_id;
+
+  IF v_customer_id IS NULL THEN
+    RETURN NEXT;
+    RETURN;
+  END IF;
+
+  SELECT array_agg(e.created_at ORDER BY e.created_at DESC, e.id),
+         array_agg(COALESCE(e.amount_usd, 0) ORDER BY e.created_at DESC, e.id),
+         array_agg(e.status ORDER BY e.created_at DESC, e.id)
+  INTO v_times, v_amounts, v_statuses
+  FROM public.webhook_events e
+  WHERE e.customer_id = v_customer_id;
+
+  v_count := COALESCE(array_length(v_times, 1), 0);
+  v_used := array_fill(FALSE, ARRAY[v_count]);
+
+  FOR i IN 1..v_count LOOP
+    CONTINUE WHEN v_used[i];
+    v_used[i] := TRUE;
+    g_amount := v_amounts[i];
+    g_statuses := ARRAY[v_statuses[i]];
+
+    FOR j IN i + 1..v_count LOOP
+      CONTINUE WHEN v_used[j];
+      IF abs(v_amounts[i] - v_amounts[j]) <= 10.20
+         AND abs(extract(epoch FROM v_times[i] - v_times[j])) <= 300 THEN
+        v_used[j] := TRUE;
+        g_amount := greatest(g_amount, v_amounts[j]);
+        g_statuses := g_statuses || v_statuses[j];
+      END IF;
+    END LOOP;
+
+    g_status := CASE
+      WHEN 'failed' = ANY(g_statuses) THEN 'failed'
+      WHEN v_statuses[i] IN ('completed', 'processing', 'awaiting_deposit', 'pending') THEN v_statuses[i]
+      WHEN 'processing' = ANY(g_statuses) THEN 'processing'
+      WHEN 'awaiting_deposit' = ANY(g_statuses) THEN 'awaiting_deposit'
+      WHEN 'pending' = ANY(g_statuses) THEN 'pending'
+      ELSE v_statuses[i]
+    END;
+
+    total_sent := total_sent + g_amount;
+    IF g_status = 'completed' THEN
+      total_completed := total_completed + g_amount;
+    ELSIF g_status IN ('pending', 'processing', 'awaiting_deposit') THEN
+      total_pending := total_pending + g_amount;
+    END IF;
+    transaction_count := transaction_count + 1;
+  END LOOP;
+
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Summaries are served by the backend (service role) only
+REVOKE EXECUTE ON FUNCTION public.user_transaction_summary(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.user_transaction_summary(UUID) TO service_role;
+
+-- Verify the migration (replace with a real user id)
+-- SELECT * FROM public.user_transaction_summary('00000000-0000-0000-0000-000000000000');
@@ -0,0 +1,28 @@
+-- Migration: Allow archiving webhook_events and transaction payloads
+-- Run this in your Supabase SQL Editor before using src/server/archive_webhook_events.py
+
+-- Archived rows keep their scalar columns; the JSONB payloads move to the archive files
+ALTER TABLE public.webhook_events
+ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE;
+
+ALTER TABLE public.webhook_events
+ALTER COLUMN event_resource DROP NOT NULL;
+
+ALTER TABLE public.webhook_events
+ALTER COLUMN raw_payload DROP NOT NULL;
+
+ALTER TABLE public.transactions
+ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE;
+
+-- The job scans unarchived rows in (created_at, id) order; archived rows drop out of these indexes
+CREATE INDEX IF NOT EXISTS webhook_events_unarchived_created_at_idx
+ON public.webhook_events(created_at, id) WHERE archived_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS transactions_unarchived_created_at_idx
+ON public.transactions(created_at, id) WHERE archived_at IS NULL;
+
+-- Verify the migration
+SELECT table_name, column_name, is_nullable
+FROM information_schema.columns
+WHERE table_name IN ('webhook_events', 'transactions')
+AND column_name IN ('archived_at', 'event_resource', 'raw_payload');
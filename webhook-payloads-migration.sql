@@ -0,0 +1,55 @@
+-- Migration: Content-addressed webhook payload storage
+-- Run this in your Supabase SQL Editor, then set WEBHOOK_PAYLOAD_DEDUP=True on the backend
+
+-- Each distinct event resource is stored once, keyed by the SHA-256 of its canonical JSON
+CREATE TABLE IF NOT EXISTS public.webhook_payloads (
+  hash TEXT PRIMARY KEY,
+  payload JSONB NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
+);
+
+ALTER TABLE public.webhook_payloads ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage webhook_payloads"
+  ON public.webhook_payloads
+  FOR ALL
+  USING (true);
+
+-- webhook_events.event_resource and transactions.metadata are left NULL and referenced by hash;
+-- webhook_events.raw_payload keeps the envelope without its event_resource
+ALTER TABLE public.webhook_events
+ADD COLUMN IF NOT EXISTS resource_hash TEXT REFERENCES public.webhook_payloads(hash);
+
+ALTER TABLE public.webhook_events
+ALTER COLUMN event_resource DROP NOT NULL;
+
+ALTER TABLE public.transactions
+ADD COLUMN IF NOT EXISTS metadata_hash TEXT REFERENCES public.webhook_payloads(hash);
+
+CREATE INDEX IF NOT EXISTS webhook_events_resource_hash_idx ON public.webhook_events(resource_hash);
+CREATE INDEX IF NOT EXISTS transactions_metadata_hash_idx ON public.transactions(metadata_hash);
+
+-- Delete payloads no row references any more (called by archive_webhook_events.py).
+-- Recent payloads are kept: backend workers remember hashes they have stored for up to
+-- WEBHOOK_PAYLOAD_HASH_CACHE_TTL_SECONDS (1 day by default) and insert rows referencing them
+-- without storing the payload again. Every store refreshes created_at, so min_age must stay
+-- above that TTL.
+CREATE OR REPLACE FUNCTION public.prune_webhook_payloads(min_age INTERVAL DEFAULT INTERVAL '7 days')
+RETURNS INTEGER AS $$
+DECLARE
+  pruned INTEGER;
+BEGIN
+  DELETE FROM public.webhook_payloads p
+  WHERE p.created_at < NOW() - min_age
+    AND NOT EXISTS (SELECT 1 FROM public.webhook_events e WHERE e.resource_hash = p.hash)
+    AND NOT EXISTS (SELECT 1 FROM public.transactions t WHERE t.metadata_hash = p.hash);
+  GET DIAGNOSTICS pruned = ROW_COUNT;
+  RETURN pruned;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Verify the migration
+SELECT table_name, column_name, is_nullable
+FROM information_schema.columns
+WHERE (table_name = 'webhook_events' AND column_name IN ('resource_hash', 'event_resource'))
+   OR (table_name = 'transactions' AND column_name = 'metadata_hash');